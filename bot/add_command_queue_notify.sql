@@ -0,0 +1,24 @@
+-- command_queue への INSERT をBotに通知するトリガー
+-- Supabase SQL Editorで実行してください
+-- （BotはSUPABASE_DB_URLで直接接続し、LISTEN command_queue で待ち受けます）
+
+CREATE OR REPLACE FUNCTION notify_command_queue()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('command_queue', NEW.id::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS command_queue_notify ON command_queue;
+
+CREATE TRIGGER command_queue_notify
+    AFTER INSERT ON command_queue
+    FOR EACH ROW
+    WHEN (NEW.status = 'pending')
+    EXECUTE FUNCTION notify_command_queue();
+
+-- pending の取得用（部分インデックス）
+CREATE INDEX IF NOT EXISTS idx_command_queue_pending
+    ON command_queue(created_at)
+    WHERE status = 'pending';
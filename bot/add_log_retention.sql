@@ -0,0 +1,64 @@
+-- ログテーブルの保持期間・件数上限をサーバー側で適用する関数
+-- Supabase SQL Editorで実行してください
+-- （Botは enforce_log_retention を定期的にRPCで呼び出します）
+
+-- created_at での削除・境界検索用インデックス
+CREATE INDEX IF NOT EXISTS idx_bot_logs_created_at ON bot_logs(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_lyrics_logs_created_at ON lyrics_logs(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_system_stats_created_at ON system_stats(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_network_stats_created_at ON network_stats(created_at DESC);
+
+-- p_max_rows: 残す最大件数（NULLは無制限）
+-- p_max_age: 残す期間（NULLは無制限）
+-- p_batch_size: 1回の呼び出しで削除する最大件数
+-- 戻り値: 削除した件数
+CREATE OR REPLACE FUNCTION enforce_log_retention(
+    p_table TEXT,
+    p_max_rows BIGINT DEFAULT NULL,
+    p_max_age INTERVAL DEFAULT NULL,
+    p_batch_size INTEGER DEFAULT 50000
+)
+RETURNS BIGINT AS $$
+DECLARE
+    v_threshold TIMESTAMPTZ;
+    v_row_threshold TIMESTAMPTZ;
+    v_deleted BIGINT;
+BEGIN
+    IF p_table NOT IN ('bot_logs', 'lyrics_logs', 'system_stats', 'network_stats') THEN
+        RAISE EXCEPTION 'retention is not allowed for table %', p_table;
+    END IF;
+
+    IF p_max_age IS NOT NULL THEN
+        v_threshold := NOW() - p_max_age;
+    END IF;
+
+    IF p_max_rows IS NOT NULL THEN
+        -- 新しい方から (p_max_rows + 1) 件目の created_at（インデックスを逆順に辿るだけ）
+        EXECUTE format(
+            'SELECT created_at FROM %I ORDER BY created_at DESC OFFSET $1 LIMIT 1', p_table
+        ) INTO v_row_threshold USING p_max_rows;
+
+        IF v_row_threshold IS NOT NULL THEN
+            -- 境界の行自体も削除対象にするため、わずかに後ろへずらす
+            v_row_threshold := v_row_threshold + INTERVAL '1 microsecond';
+            v_threshold := GREATEST(v_threshold, v_row_threshold);
+        END IF;
+    END IF;
+
+    IF v_threshold IS NULL THEN
+        RETURN 0;
+    END IF;
+
+    EXECUTE format(
+        'DELETE FROM %I WHERE ctid = ANY(ARRAY(
+            SELECT ctid FROM %I WHERE created_at < $1 ORDER BY created_at LIMIT $2
+        ))', p_table, p_table
+    ) USING v_threshold, p_batch_size;
+    GET DIAGNOSTICS v_deleted = ROW_COUNT;
+
+    RETURN v_deleted;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER SET search_path = public;
+
+REVOKE ALL ON FUNCTION enforce_log_retention(TEXT, BIGINT, INTERVAL, INTEGER) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION enforce_log_retention(TEXT, BIGINT, INTERVAL, INTEGER) TO service_role;
@@ -0,0 +1,8 @@
+-- プレイリストの曲にLavalinkのエンコード済みトラックを保存する列を追加
+-- Supabase SQL Editorで実行してください
+-- （保存済みの曲は再生時に検索せず、/v4/decodetracks で一括デコードされます）
+
+ALTER TABLE playlist_tracks ADD COLUMN IF NOT EXISTS encoded_track TEXT;
+
+-- 完了メッセージ
+SELECT 'playlist_tracks.encoded_track added successfully!' AS status;
@@ -0,0 +1,225 @@
+"""daily_stats / hourly_stats の時系列集計エンジン（PostgreSQL / SQLite 共通）"""
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+METRICS = ('message_count', 'user_count', 'token_count', 'music_count')
+BUCKETS = ('hour', 'day', 'week', 'month')
+
+# period -> (期間, 既定のバケット)。期間 None は全期間
+PERIODS = {
+    'day': (timedelta(hours=24), 'hour'),
+    'week': (timedelta(days=7), 'day'),
+    'month': (timedelta(days=30), 'day'),
+    'all': (None, 'day'),
+}
+
+
+def bucket_start(value: datetime, bucket: str) -> datetime:
+    """value を含むバケットの開始時刻"""
+    if bucket == 'hour':
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        return day
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())  # 月曜始まり
+    return day.replace(day=1)
+
+
+def next_bucket(value: datetime, bucket: str) -> datetime:
+    if bucket == 'hour':
+        return value + timedelta(hours=1)
+    if bucket == 'day':
+        return value + timedelta(days=1)
+    if bucket == 'week':
+        return value + timedelta(weeks=1)
+    return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def count_buckets(start: datetime, end: datetime, bucket: str) -> int:
+    """[start, end) に含まれるバケット数"""
+    start = bucket_start(start, bucket)
+    if bucket == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + (1 if end > bucket_start(end, 'month') else 0)
+    step = {'hour': 3600, 'day': 86400, 'week': 7 * 86400}[bucket]
+    return max(0, -(-int((end - start).total_seconds()) // step))
+
+
+def to_datetime(value) -> datetime:
+    """DBから返った日付（date / datetime / ISO文字列）を datetime にそろえる"""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime.combine(value, datetime.min.time())
+    return datetime.fromisoformat(str(value))
+
+
+class AnalyticsEngine:
+    """ギルドの統計を任意の期間・バケット幅で返す
+
+    - 1時間単位の集計は hourly_stats、それ以外は daily_stats を読む
+    - 集計・穴埋め・ダウンサンプリングはPython側で行い、PostgreSQLとSQLiteで同じ結果を返す
+    - バケット数が max_points を超える場合は hour → day → week → month の順に粗くする
+      （user_count はバケット内の最大値、それ以外は合計）
+    - 同じ (guild, period) の結果は短いTTLで共有し、同時リクエストは1回の計算にまとめる
+    """
+
+    def __init__(self, database, cache_ttl: float = None, max_points: int = None):
+        self.database = database
+        self.cache_ttl = cache_ttl if cache_ttl is not None else float(os.getenv('ANALYTICS_CACHE_TTL', 30))
+        self.max_points = max_points or int(os.getenv('ANALYTICS_MAX_POINTS', 120))
+
+        self.cache: Dict[Tuple, Tuple[List[Dict], float]] = {}
+        self.inflight = SingleFlight()
+
+        # 統計
+        self.stats = {
+            'queries': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'rows_read': 0,
+            'avg_query_ms': 0.0
+        }
+
+    async def get_period(self, guild_id: int, period: str = 'week', bucket: str = None,
+                         max_points: int = None) -> List[Dict]:
+        """ダッシュボードの期間指定（day / week / month / all）で取得（キャッシュあり）"""
+        if period not in PERIODS:
+            period = 'all'
+        key = (guild_id, period, bucket, max_points)
+
+        cached = self.cache.get(key)
+        if cached is not None and cached[1] > time.monotonic():
+            self.stats['cache_hits'] += 1
+            return cached[0]
+
+        if key in self.inflight:
+            self.stats['coalesced'] += 1
+        # 1つのクライアントが切断しても、同じキーを待っている他のリクエストには結果が届く
+        return await self.inflight.do(
+            key, lambda: self._compute_period(key, guild_id, period, bucket, max_points)
+        )
+
+    async def _compute_period(self, key: Tuple, guild_id: int, period: str, bucket: Optional[str],
+                              max_points: Optional[int]) -> List[Dict]:
+        span, default_bucket = PERIODS[period]
+        end = datetime.now()
+        start = end - span if span else None
+        result = await self.query(guild_id, start, end, bucket or default_bucket, max_points)
+        self._remember(key, result)
+        return result
+
+    async def query(self, guild_id: int, start: Optional[datetime], end: datetime,
+                    bucket: str = 'day', max_points: int = None) -> List[Dict]:
+        """[start, end] を bucket 幅で集計した時系列（start=None はデータの最初から）"""
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket: {bucket}")
+        max_points = min(max(max_points or self.max_points, 2), 1000)
+
+        started = time.perf_counter()
+        source = 'hour' if bucket == 'hour' else 'day'
+        end = next_bucket(bucket_start(end, source), source)
+        rows = await self._fetch_rows(guild_id, source, start, end)
+
+        if start is None:
+            if not rows:
+                return []
+            start = rows[0][0]
+
+        # 点数が多すぎる場合はバケットを粗くする
+        while count_buckets(start, end, bucket) > max_points and bucket != 'month':
+            bucket = BUCKETS[BUCKETS.index(bucket) + 1]
+
+        points = self._aggregate(rows, start, end, bucket)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stats['queries'] += 1
+        self.stats['rows_read'] += len(rows)
+        self.stats['avg_query_ms'] += (elapsed_ms - self.stats['avg_query_ms']) / self.stats['queries']
+        return points
+
+    def invalidate(self, guild_id: int = None):
+        """キャッシュを破棄（guild_id 指定時はそのギルドのみ）"""
+        if guild_id is None:
+            self.cache.clear()
+            return
+        for key in [k for k in self.cache if k[0] == guild_id]:
+            del self.cache[key]
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'cached': len(self.cache),
+            'inflight': len(self.inflight)
+        }
+
+    async def _fetch_rows(self, guild_id: int, source: str, start: Optional[datetime],
+                          end: datetime) -> List[Tuple]:
+        """[start, end) の元テーブルの行を (バケット開始, message, user, token, music) で取得"""
+        table, column = ('hourly_stats', 'hour') if source == 'hour' else ('daily_stats', 'date')
+        columns = ', '.join(METRICS)
+        db = self.database
+
+        def bind(value: datetime):
+            if source == 'day':
+                value = value.date()
+            # SQLiteは日付を文字列（YYYY-MM-DD / YYYY-MM-DD HH:MM:SS）で保存している
+            params.append(value if db.pool else str(value))
+            return f'${len(params)}' if db.pool else '?'
+
+        params = [guild_id]
+        where = 'guild_id = $1' if db.pool else 'guild_id = ?'
+        if start is not None:
+            where += f' AND {column} >= {bind(bucket_start(start, source))}'
+        where += f' AND {column} < {bind(end)}'
+
+        rows = await db._fetchall(
+            f'SELECT {column}, {columns} FROM {table} WHERE {where} ORDER BY {column}',
+            *params
+        )
+        return [(to_datetime(r[0]), *(r[i] or 0 for i in range(1, len(METRICS) + 1))) for r in rows]
+
+    def _aggregate(self, rows: List[Tuple], start: datetime, end: datetime, bucket: str) -> List[Dict]:
+        """バケットごとに集計し、データのないバケットは0で埋める"""
+        totals: Dict[datetime, List[int]] = {}
+        for row in rows:
+            key = bucket_start(row[0], bucket)
+            values = totals.get(key)
+            if values is None:
+                totals[key] = list(row[1:])
+                continue
+            values[0] += row[1]
+            values[1] = max(values[1], row[2])  # ユニークユーザーは合計できない
+            values[2] += row[3]
+            values[3] += row[4]
+
+        label_format = self._label_format(start, end, bucket)
+        points = []
+        current = bucket_start(start, bucket)
+        while current < end:
+            values = totals.get(current) or [0, 0, 0, 0]
+            points.append({'date': current.strftime(label_format), **dict(zip(METRICS, values))})
+            current = next_bucket(current, bucket)
+        return points
+
+    @staticmethod
+    def _label_format(start: datetime, end: datetime, bucket: str) -> str:
+        if bucket == 'hour':
+            return '%H:%M' if end - start <= timedelta(days=1) else '%m/%d %H:%M'
+        if bucket == 'month':
+            return '%Y/%m'
+        return '%m/%d' if start.year == (end - timedelta(microseconds=1)).year else '%Y/%m/%d'
+
+    def _remember(self, key: Tuple, result: List[Dict]):
+        now = time.monotonic()
+        self.cache[key] = (result, now + self.cache_ttl)
+        # 期限切れのエントリを掃除
+        for stale in [k for k, (_, expires_at) in self.cache.items() if expires_at <= now]:
+            del self.cache[stale]
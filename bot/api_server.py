@@ -1,7 +1,7 @@
 import asyncio
 import os
 import logging
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Set
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
@@ -10,6 +10,7 @@ import uvicorn
 import json
 import time
 from datetime import datetime, timedelta
+from collections import deque
 import socketio
 
 logger = logging.getLogger(__name__)
@@ -23,9 +24,50 @@ class ModeRequest(BaseModel):
     guild_id: int
     mode: str
 
+class ClientConnection:
+    """WebSocketクライアントごとの送信キューと購読トピック"""
+    __slots__ = ('websocket', 'queue', 'guilds', 'types', 'writer', 'dropped',
+                 'stats_every', 'stats_delta', 'stats_primed')
+
+    def __init__(self, websocket: WebSocket, max_queue: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.guilds: Optional[Set[str]] = None  # None = 全ギルド
+        self.types: Optional[Set[str]] = None   # None = 全イベント
+        self.writer: Optional[asyncio.Task] = None
+        self.dropped = 0
+        self.stats_every = 1      # network_stats を何tickごとに受け取るか
+        self.stats_delta = False  # 変化したフィールドだけを受け取るか
+        self.stats_primed = False
+
+    def subscribe(self, guilds=None, types=None, interval=None, delta=None):
+        self.guilds = {str(g) for g in guilds} if guilds else None
+        self.types = set(types) if types else None
+        if interval is not None:
+            self.stats_every = NetworkStatsTicker.ticks_for(interval)
+        if delta is not None:
+            self.stats_delta = bool(delta)
+            self.stats_primed = False
+
+    def wants(self, event_type: str, guild_id) -> bool:
+        if self.types is not None and event_type not in self.types:
+            return False
+        if self.guilds is not None and guild_id is not None and str(guild_id) not in self.guilds:
+            return False
+        return True
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[WebSocket] = []
+    """WebSocketへのファンアウト配信
+
+    メッセージは1回だけシリアライズし、各クライアントの送信キューに積む。
+    送信は接続ごとのwriterタスクが行うため、遅いクライアントが他の配信を止めない。
+    キューが溢れた場合は古いメッセージを捨てる（WS_SLOW_CLIENT_POLICY=disconnect なら切断）。
+    """
+
+    def __init__(self, max_queue: int = None, slow_client_policy: str = None):
+        self.clients: Dict[WebSocket, ClientConnection] = {}
+        self.max_queue = max_queue or int(os.getenv('WS_CLIENT_QUEUE_SIZE', 100))
+        self.slow_client_policy = slow_client_policy or os.getenv('WS_SLOW_CLIENT_POLICY', 'drop')
         self.network_stats = {
             'rx_bytes': 0,
             'tx_bytes': 0,
@@ -34,29 +76,105 @@ class ConnectionManager:
             'connected_users': 0,
             'last_update': time.time()
         }
+        self.stats = {
+            'broadcasts': 0,
+            'delivered': 0,
+            'filtered': 0,
+            'dropped': 0,
+            'slow_disconnects': 0
+        }
 
-    async def connect(self, websocket: WebSocket):
+    @property
+    def active_connections(self) -> List[WebSocket]:
+        return list(self.clients)
+
+    async def connect(self, websocket: WebSocket, guilds=None, types=None,
+                      interval=None, delta=None) -> ClientConnection:
         await websocket.accept()
-        self.active_connections.append(websocket)
-        logger.info(f"WebSocket connected. Total connections: {len(self.active_connections)}")
+        client = ClientConnection(websocket, self.max_queue)
+        client.subscribe(guilds, types, interval, delta)
+        client.writer = asyncio.create_task(self._writer(client))
+        self.clients[websocket] = client
+        logger.info(f"WebSocket connected. Total connections: {len(self.clients)}")
+        return client
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        logger.info(f"WebSocket disconnected. Total connections: {len(self.active_connections)}")
-
-    async def broadcast(self, message: dict):
-        if self.active_connections:
-            disconnected = []
-            for connection in self.active_connections:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except:
-                    disconnected.append(connection)
-            
-            # Remove disconnected connections
-            for conn in disconnected:
-                self.disconnect(conn)
+        client = self.clients.pop(websocket, None)
+        if client is None:
+            return
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+        logger.info(f"WebSocket disconnected. Total connections: {len(self.clients)}")
+
+    def handle_client_message(self, client: ClientConnection, text: str):
+        """クライアントからの購読変更 {"action": "subscribe", "guilds": [...], "types": [...]}"""
+        try:
+            message = json.loads(text)
+        except ValueError:
+            return
+        if isinstance(message, dict) and message.get('action') == 'subscribe':
+            client.subscribe(message.get('guilds'), message.get('types'),
+                             message.get('interval'), message.get('delta'))
+
+    async def broadcast(self, message: dict) -> int:
+        """購読しているクライアントへ配信（送信完了は待たない）。配信したペイロードのバイト数を返す"""
+        if not self.clients:
+            return 0
+
+        event_type = message.get('type')
+        guild_id = message.get('guild_id')
+        if guild_id is None and isinstance(message.get('data'), dict):
+            guild_id = message['data'].get('guild_id')
+
+        self.stats['broadcasts'] += 1
+        text = None
+        for client in list(self.clients.values()):
+            if not client.wants(event_type, guild_id):
+                self.stats['filtered'] += 1
+                continue
+            if text is None:
+                text = json.dumps(message)
+            self.send(client, text)
+        return len(text) if text else 0
+
+    def send(self, client: ClientConnection, text: str):
+        """シリアライズ済みのテキストをクライアントの送信キューに積む"""
+        if client.queue.full():
+            if self.slow_client_policy == 'disconnect':
+                self.stats['slow_disconnects'] += 1
+                logger.warning("⚠️ Disconnecting slow WebSocket client")
+                self.disconnect(client.websocket)
+                asyncio.create_task(self._close(client.websocket))
+                return
+            client.queue.get_nowait()
+            client.dropped += 1
+            self.stats['dropped'] += 1
+        client.queue.put_nowait(text)
+        self.stats['delivered'] += 1
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'connections': len(self.clients),
+            'queued': sum(c.queue.qsize() for c in self.clients.values())
+        }
+
+    async def _writer(self, client: ClientConnection):
+        try:
+            while True:
+                text = await client.queue.get()
+                await client.websocket.send_text(text)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.disconnect(client.websocket)
+
+    @staticmethod
+    async def _close(websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)  # Try again later
+        except Exception:
+            pass
 
     def update_network_stats(self, rx_bytes: int, tx_bytes: int):
         self.network_stats['rx_bytes'] += rx_bytes
@@ -65,11 +183,136 @@ class ConnectionManager:
         self.network_stats['tx_packets'] += 1
         self.network_stats['last_update'] = time.time()
 
+class StreamSubscriber:
+    """SSEクライアント1つ分の受信キュー"""
+    __slots__ = ('queue', 'stats_every', 'stats_delta', 'stats_primed')
+
+    def __init__(self, every: int, delta: bool, max_queue: int = 10):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.stats_every = every
+        self.stats_delta = delta
+        self.stats_primed = False
+
+    def push(self, data: bytes):
+        if self.queue.full():
+            self.queue.get_nowait()  # 読めていないクライアントには最新だけ残す
+        self.queue.put_nowait(data)
+
+class NetworkStatsTicker:
+    """network_stats を1tickに1回だけ計算し、/ws と SSE の全購読者へ配る
+
+    エンコードは (送信間隔, 差分のみか) の組み合わせごとに1回だけ行う。
+    """
+
+    def __init__(self, api_server, interval: float = 1.0, max_every: int = 60):
+        self.api_server = api_server
+        self.interval = interval
+        self.max_every = max_every
+        self.history = deque(maxlen=max_every + 1)  # 過去のスナップショット（差分計算用）
+        self.streams: Set[StreamSubscriber] = set()
+        self.tick = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def ticks_for(interval) -> int:
+        """クライアントが希望する秒間隔をtick数に変換（1〜60）"""
+        try:
+            return max(1, min(60, int(round(float(interval)))))
+        except (TypeError, ValueError):
+            return 1
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def subscribe_stream(self, interval=None, delta: bool = False) -> StreamSubscriber:
+        self.start()
+        subscriber = StreamSubscriber(self.ticks_for(interval), delta)
+        self.streams.add(subscriber)
+        return subscriber
+
+    def unsubscribe_stream(self, subscriber: StreamSubscriber):
+        self.streams.discard(subscriber)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self._publish()
+            except Exception as e:
+                logger.error(f"Error publishing network stats: {e}")
+
+    def snapshot(self) -> Dict:
+        """実測値のスナップショット"""
+        manager = self.api_server.connection_manager
+        stats = manager.network_stats
+        latency = self.api_server.bot.latency
+        return {
+            "timestamp": datetime.now().isoformat(),
+            "rx_bytes": stats['rx_bytes'],
+            "tx_bytes": stats['tx_bytes'],
+            "rx_packets": stats['rx_packets'],
+            "tx_packets": stats['tx_packets'],
+            # Discordゲートウェイのハートビート遅延（未接続時はNone）
+            "latency": round(latency * 1000, 1) if latency == latency and latency != float('inf') else None,
+            # 接続中のダッシュボード（WebSocket + SSE）
+            "connected_users": len(manager.clients) + len(self.streams)
+        }
+
+    def _publish(self):
+        manager = self.api_server.connection_manager
+        ws_clients = [c for c in manager.clients.values() if c.wants('network_stats', None)]
+        self.tick += 1
+        if not ws_clients and not self.streams:
+            self.history.clear()
+            return
+
+        snapshot = self.snapshot()
+        self.history.append(snapshot)
+        encoded: Dict[tuple, str] = {}
+
+        def payload(every: int, delta: bool, primed: bool) -> Dict:
+            if not delta or not primed or len(self.history) <= every:
+                return snapshot
+            previous = self.history[-1 - every]
+            return {k: v for k, v in snapshot.items() if k == 'timestamp' or previous.get(k) != v}
+
+        for client in ws_clients:
+            if self.tick % client.stats_every:
+                continue
+            key = ('ws', client.stats_every, client.stats_delta and client.stats_primed)
+            if key not in encoded:
+                message = {"type": "network_stats",
+                           "data": payload(client.stats_every, client.stats_delta, client.stats_primed)}
+                if key[2]:
+                    message["delta"] = True
+                encoded[key] = json.dumps(message)
+            manager.send(client, encoded[key])
+            client.stats_primed = True
+
+        for subscriber in self.streams:
+            if self.tick % subscriber.stats_every:
+                continue
+            key = ('sse', subscriber.stats_every, subscriber.stats_delta and subscriber.stats_primed)
+            if key not in encoded:
+                data = payload(subscriber.stats_every, subscriber.stats_delta, subscriber.stats_primed)
+                if key[2]:
+                    data = {**data, "delta": True}
+                encoded[key] = f"data: {json.dumps(data)}\n\n".encode()
+            subscriber.push(encoded[key])
+            subscriber.stats_primed = True
+
 class APIServer:
     def __init__(self, bot):
         self.bot = bot
         self.app = FastAPI(title="Discord Bot API", version="1.0.0")
         self.connection_manager = ConnectionManager()
+        self.network_ticker = NetworkStatsTicker(self)
         
         # Socket.IO setup for real-time logs
         self.sio = socketio.AsyncServer(
@@ -181,11 +424,25 @@ class APIServer:
         @self.app.get("/api/health")
         async def health_check():
             """Health check endpoint"""
+            lyrics_cog = self.bot.get_cog('LyricsStreamer')
             return {
                 "status": "healthy",
                 "bot_ready": self.bot.is_ready(),
                 "guilds": len(self.bot.guilds),
-                "websocket_connections": len(self.connection_manager.active_connections)
+                "websocket_connections": len(self.connection_manager.active_connections),
+                "websocket_hub": self.connection_manager.get_stats(),
+                "persistence": self.bot.persistence.get_stats(),
+                "gemini_scheduler": self.bot.gemini_scheduler.get_stats(),
+                "supabase_io": self.bot.supabase_client.get_io_stats(),
+                "active_sessions": self.bot.supabase_client.session_coalescer.get_stats(),
+                "command_queue": self.bot.supabase_client.command_consumer.get_stats(),
+                "log_retention": self.bot.supabase_client.retention.get_stats(),
+                "stream_resolver": self.bot.stream_resolver.get_stats(),
+                "track_search": self.bot.track_search.get_stats(),
+                "analytics": self.bot.database.analytics.get_stats(),
+                "log_partitions": self.bot.database.partitions.get_stats(),
+                "event_loop_lag": self.bot.loop_monitor.get_stats(),
+                "lyrics_cache": lyrics_cog.lyrics_cache.get_stats() if lyrics_cog else None
             }
         
         @self.app.get("/api/stats")
@@ -441,43 +698,42 @@ class APIServer:
         
         @self.app.websocket("/ws")
         async def websocket_endpoint(websocket: WebSocket):
-            """WebSocket endpoint for real-time updates"""
-            await self.connection_manager.connect(websocket)
+            """WebSocket endpoint for real-time updates
+
+            Optional filters: /ws?guild_id=123&types=music_event,new_message&interval=5&delta=true,
+            or send {"action": "subscribe", "guilds": [...], "types": [...], "interval": 5, "delta": true}.
+            """
+            params = websocket.query_params
+            guilds = params.getlist('guild_id') or None
+            types = [t for t in params.get('types', '').split(',') if t] or None
+            delta = params.get('delta', '').lower() == 'true'
+            client = await self.connection_manager.connect(websocket, guilds, types, params.get('interval'), delta)
+            
+            # network_stats is pushed by the shared ticker
+            self.network_ticker.start()
             try:
                 while True:
-                    # Send periodic network stats
-                    network_data = {
-                        "type": "network_stats",
-                        "data": {
-                            "timestamp": datetime.now().isoformat(),
-                            "rx_bytes": self.connection_manager.network_stats['rx_bytes'],
-                            "tx_bytes": self.connection_manager.network_stats['tx_bytes'],
-                            "rx_packets": self.connection_manager.network_stats['rx_packets'],
-                            "tx_packets": self.connection_manager.network_stats['tx_packets'],
-                            "latency": 20 + (time.time() % 30),  # Mock latency
-                            "connected_users": len(self.bot.guilds) * 5  # Mock connected users
-                        }
-                    }
-                    await websocket.send_text(json.dumps(network_data))
-                    await asyncio.sleep(1)  # Send updates every second
-                    
+                    text = await websocket.receive_text()
+                    self.connection_manager.handle_client_message(client, text)
             except WebSocketDisconnect:
+                pass
+            finally:
                 self.connection_manager.disconnect(websocket)
         
         @self.app.get("/api/network/stream")
-        async def network_stream():
+        async def network_stream(interval: float = 1, delta: bool = False):
             """Server-Sent Events endpoint for network monitoring"""
+            subscriber = self.network_ticker.subscribe_stream(interval, delta)
+            
             async def generate():
-                while True:
-                    data = {
-                        "timestamp": datetime.now().isoformat(),
-                        "rx_bytes": self.connection_manager.network_stats['rx_bytes'],
-                        "tx_bytes": self.connection_manager.network_stats['tx_bytes'],
-                        "latency": 20 + (time.time() % 30),
-                        "connected_users": len(self.bot.guilds) * 5
-                    }
-                    yield f"data: {json.dumps(data)}\n\n"
-                    await asyncio.sleep(1)
+                try:
+                    # Send the current snapshot right away, then follow the shared ticker
+                    yield f"data: {json.dumps(self.network_ticker.snapshot())}\n\n".encode()
+                    subscriber.stats_primed = True
+                    while True:
+                        yield await subscriber.queue.get()
+                finally:
+                    self.network_ticker.unsubscribe_stream(subscriber)
             
             return StreamingResponse(
                 generate(),
@@ -492,14 +748,14 @@ class APIServer:
     
     async def broadcast_message_event(self, message_data: dict):
         """Broadcast new message event to connected clients"""
-        await self.connection_manager.broadcast({
+        message_size = await self.connection_manager.broadcast({
             "type": "new_message",
             "data": message_data
         })
         
         # Update network stats
-        message_size = len(json.dumps(message_data))
-        self.connection_manager.update_network_stats(message_size, message_size)
+        if message_size:
+            self.connection_manager.update_network_stats(message_size, message_size)
     
     async def start(self):
         """Start the API server"""
@@ -518,6 +774,9 @@ class APIServer:
             )
             server = uvicorn.Server(config)
             
+            # Shared network_stats producer for /ws and SSE clients
+            self.network_ticker.start()
+            
             # Start server
             await server.serve()
             
@@ -715,8 +974,10 @@ class APIServer:
                 
                 if action == "pause":
                     await vc.pause(True)
+                    self.bot.dispatch('playback_state_change', guild_id)
                 elif action == "resume":
                     await vc.pause(False)
+                    self.bot.dispatch('playback_state_change', guild_id)
                 elif action == "skip":
                     await vc.stop()
                 elif action == "stop":
@@ -776,32 +1037,24 @@ class APIServer:
         async def get_stream_url(track_uri: str):
             """Get high-quality stream URL for web playback"""
             try:
-                import yt_dlp
                 import urllib.parse
                 
                 # Decode URI
                 decoded_uri = urllib.parse.unquote(track_uri)
                 
-                ydl_opts = {
-                    'format': 'bestaudio[ext=m4a]/bestaudio/best',
-                    'noplaylist': True,
-                    'quiet': True,
-                    'no_warnings': True,
-                }
+                # Extraction runs in the resolver's worker processes (cached until the URL expires)
+                info = await self.bot.stream_resolver.resolve(decoded_uri, 'bestaudio[ext=m4a]/bestaudio/best')
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(decoded_uri, download=False)
-                    
-                    if info and 'url' in info:
-                        return {
-                            "success": True,
-                            "data": {
-                                "stream_url": info['url'],
-                                "format": info.get('ext', 'unknown'),
-                                "quality": info.get('abr', 'unknown'),
-                                "duration": info.get('duration', 0)
-                            }
+                if info:
+                    return {
+                        "success": True,
+                        "data": {
+                            "stream_url": info['url'],
+                            "format": info.get('ext') or 'unknown',
+                            "quality": info.get('abr') or 'unknown',
+                            "duration": info.get('duration', 0)
                         }
+                    }
                 
                 raise HTTPException(status_code=404, detail="Stream URL not found")
                 
@@ -835,7 +1088,7 @@ class APIServer:
                 {{"bass": 0, "mid": 0, "treble": 0, "presence": 0}}
                 """
                 
-                response = await self.bot.gemini_client.generate_response(
+                response = await self.bot.gemini_scheduler.generate_response(
                     prompt,
                     mode='music_dj'
                 )
@@ -989,10 +1242,11 @@ class APIServer:
                 raise HTTPException(status_code=500, detail="Failed to get now playing")
         
         @self.app.get("/api/guilds/{guild_id}/analytics")
-        async def get_guild_analytics(guild_id: int, period: str = "week"):
+        async def get_guild_analytics(guild_id: int, period: str = "week", bucket: Optional[str] = None,
+                                      points: Optional[int] = None):
             """サーバーの分析データを取得"""
             try:
-                data = await self.bot.database.get_analytics_data(guild_id, period)
+                data = await self.bot.database.get_analytics_data(guild_id, period, bucket, points)
                 summary = await self.bot.database.get_guild_summary(guild_id)
                 
                 return {
@@ -1003,6 +1257,8 @@ class APIServer:
                         "summary": summary
                     }
                 }
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
             except Exception as e:
                 logger.error(f'Error getting analytics: {e}')
                 raise HTTPException(status_code=500, detail="Failed to get analytics")
\ No newline at end of file
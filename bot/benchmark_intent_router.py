@@ -0,0 +1,57 @@
+"""Micro-benchmark: per-message intent classification cost (old keyword scans vs IntentRouter)"""
+import re
+import timeit
+
+from utils.intent_router import (
+    IntentRouter, CONTROL_TRIGGER_KEYWORDS, CONTROL_ACTION_KEYWORDS, PLAY_KEYWORDS
+)
+
+SIMPLE_RESPONSES = {
+    'こんにちは': 'こんにちは！',
+    'hello': 'こんにちは！',
+    'hi': 'こんにちは！',
+    'おはよう': 'おはようございます！',
+    'ありがとう': 'どういたしまして！',
+    'thanks': 'どういたしまして！',
+}
+
+MESSAGES = [
+    'こんにちは',
+    'YOASOBIの夜に駆けるを流して',
+    '音量を30にして',
+    '次の曲は何？',
+    'Pythonで非同期処理を使う方法を詳しく説明してください。asyncioとスレッドの違いも知りたいです。',
+    '今日はいい天気ですね、どこか出かけたいな',
+    'play lemon by kenshi yonezu',
+]
+
+
+def legacy_classify(content: str):
+    """handle_ai_response / handle_music_control / generate_response の旧ロジック"""
+    content_lower = content.lower()
+    is_control = any(k in content or k in content_lower for k in CONTROL_TRIGGER_KEYWORDS)
+    actions = [a for a, words in CONTROL_ACTION_KEYWORDS if any(w in content_lower for w in words)]
+    is_play = any(k in content or k in content_lower for k in PLAY_KEYWORDS)
+    if re.search(r'.+(を|の|)(流して|かけて|再生して|プレイして|聞かせて|きかせて)', content):
+        is_play = True
+    simple = None
+    for key, response in SIMPLE_RESPONSES.items():
+        if key in content_lower.strip() and len(content) < 20:
+            simple = response
+            break
+    return is_control, actions, is_play, simple
+
+
+def main():
+    router = IntentRouter(SIMPLE_RESPONSES)
+    number = 20000
+
+    print(f"{'message':<40} {'legacy (µs)':>12} {'router (µs)':>12}")
+    for message in MESSAGES:
+        legacy = timeit.timeit(lambda: legacy_classify(message), number=number) / number * 1e6
+        routed = timeit.timeit(lambda: router.classify(message), number=number) / number * 1e6
+        print(f"{message[:38]:<40} {legacy:>12.2f} {routed:>12.2f}  -> {router.classify(message).kind}")
+
+
+if __name__ == "__main__":
+    main()
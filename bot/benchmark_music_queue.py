@@ -0,0 +1,134 @@
+"""Micro-benchmark: 10k-track queue operations (old list-based MusicQueue vs ring buffer)"""
+import sys
+import time
+import tracemalloc
+
+from utils.music_queue import MusicQueue
+
+TRACKS = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+
+class FakeTrack:
+    """wavelink.Playable の代わり（表示に使う属性と raw_data だけ持つ）"""
+
+    def __init__(self, i: int):
+        self.title = f"Track {i}"
+        self.author = f"Artist {i % 97}"
+        self.length = 180_000 + i
+        self.uri = f"https://www.youtube.com/watch?v={i:011d}"
+        self.artwork = f"https://i.ytimg.com/vi/{i:011d}/hqdefault.jpg"
+        self.extras = {'requester_name': 'bench'}
+        self.raw_data = {
+            'encoded': 'Q' * 200,
+            'info': {
+                'title': self.title, 'author': self.author, 'length': self.length,
+                'uri': self.uri, 'artworkUrl': self.artwork
+            }
+        }
+
+
+def track_from_raw(raw):
+    """wavelink.Playable(raw) の代わり"""
+    track = FakeTrack.__new__(FakeTrack)
+    info = raw['info']
+    track.title, track.author, track.length = info['title'], info['author'], info['length']
+    track.uri, track.artwork = info['uri'], info['artworkUrl']
+    track.extras, track.raw_data = {}, raw
+    return track
+
+
+class RingMusicQueue(MusicQueue):
+    def __init__(self):
+        super().__init__(track_factory=track_from_raw)
+
+
+class LegacyMusicQueue:
+    """cogs/music_player.py の旧実装"""
+
+    def __init__(self):
+        self.queue = []
+        self.history = []
+        self.current = None
+        self.loop_mode = "off"
+
+    def add(self, track):
+        self.queue.append(track)
+
+    def get_next(self):
+        if self.loop_mode == "track" and self.current:
+            return self.current
+        if not self.queue:
+            if self.loop_mode == "queue" and self.history:
+                self.queue.extend(self.history)
+                self.history.clear()
+        if self.queue:
+            track = self.queue.pop(0)
+            if self.current:
+                self.history.append(self.current)
+            self.current = track
+            return track
+        return None
+
+
+def fill(queue_cls, tracks):
+    queue = queue_cls()
+    for track in tracks:
+        queue.add(track)
+    return queue
+
+
+def drain(queue):
+    while queue.get_next() is not None:
+        pass
+
+
+def rotate(queue, rounds):
+    queue.loop_mode = "queue"
+    for _ in range(rounds):
+        queue.get_next()
+
+
+def peek_ui(queue, rounds):
+    """/queue 表示と同じ参照（先頭10曲 + 件数）"""
+    for _ in range(rounds):
+        _ = [t.title for t in queue.queue[:10]], len(queue.queue)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def queue_memory(queue_cls, count):
+    """キューだけが参照を持つ状態（検索結果を追加した直後）での保持メモリ"""
+    tracemalloc.start()
+    tracks = [FakeTrack(i) for i in range(count)]
+    queue = fill(queue_cls, tracks)
+    del tracks
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return queue, retained / 1024
+
+
+def main():
+    tracks = [FakeTrack(i) for i in range(TRACKS)]
+    rows = []
+    for name, cls in (('legacy list', LegacyMusicQueue), ('ring buffer', RingMusicQueue)):
+        add_ms = timed(fill, cls, tracks)
+        drain_ms = timed(drain, fill(cls, tracks))
+        loop_queue = fill(cls, tracks)
+        loop_queue.get_next()
+        loop_ms = timed(rotate, loop_queue, TRACKS * 3)
+        ui_ms = timed(peek_ui, fill(cls, tracks), 1000)
+        _, mem_kb = queue_memory(cls, TRACKS)
+        rows.append((name, add_ms, drain_ms, loop_ms, ui_ms, mem_kb))
+
+    print(f"{TRACKS} tracks, Python {sys.version.split()[0]}")
+    print(f"{'queue':<12} {'add (ms)':>10} {'drain (ms)':>11} {'loop x3 (ms)':>13} {'ui x1000 (ms)':>14} {'queue mem (KiB)':>16}")
+    for name, add_ms, drain_ms, loop_ms, ui_ms, mem_kb in rows:
+        print(f"{name:<12} {add_ms:>10.1f} {drain_ms:>11.1f} {loop_ms:>13.1f} {ui_ms:>14.1f} {mem_kb:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
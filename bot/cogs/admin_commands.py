@@ -32,17 +32,19 @@ class AdminCommands(commands.Cog):
             
             # bot_logs
             try:
-                logs_count = self.bot.supabase_client.client.table('bot_logs')\
-                    .select('id', count='exact')\
-                    .execute()
+                logs_count = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('bot_logs')
+                    .select('id', count='exact')
+                )
                 logs_total = logs_count.count if hasattr(logs_count, 'count') else len(logs_count.data)
                 
                 # 今日のログ数
                 today = datetime.utcnow().date()
-                logs_today = self.bot.supabase_client.client.table('bot_logs')\
-                    .select('id', count='exact')\
-                    .gte('created_at', today.isoformat())\
-                    .execute()
+                logs_today = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('bot_logs')
+                    .select('id', count='exact')
+                    .gte('created_at', today.isoformat())
+                )
                 logs_today_count = logs_today.count if hasattr(logs_today, 'count') else len(logs_today.data)
                 
                 embed.add_field(
@@ -55,9 +57,10 @@ class AdminCommands(commands.Cog):
             
             # lyrics_logs
             try:
-                lyrics_count = self.bot.supabase_client.client.table('lyrics_logs')\
-                    .select('id', count='exact')\
-                    .execute()
+                lyrics_count = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('lyrics_logs')
+                    .select('id', count='exact')
+                )
                 lyrics_total = lyrics_count.count if hasattr(lyrics_count, 'count') else len(lyrics_count.data)
                 
                 embed.add_field(
@@ -70,16 +73,18 @@ class AdminCommands(commands.Cog):
             
             # music_history
             try:
-                music_count = self.bot.supabase_client.client.table('music_history')\
-                    .select('id', count='exact')\
-                    .execute()
+                music_count = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('music_history')
+                    .select('id', count='exact')
+                )
                 music_total = music_count.count if hasattr(music_count, 'count') else len(music_count.data)
                 
                 # 今日の再生数
-                music_today = self.bot.supabase_client.client.table('music_history')\
-                    .select('id', count='exact')\
-                    .gte('played_at', today.isoformat())\
-                    .execute()
+                music_today = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('music_history')
+                    .select('id', count='exact')
+                    .gte('played_at', today.isoformat())
+                )
                 music_today_count = music_today.count if hasattr(music_today, 'count') else len(music_today.data)
                 
                 embed.add_field(
@@ -92,16 +97,18 @@ class AdminCommands(commands.Cog):
             
             # conversation_logs
             try:
-                conv_count = self.bot.supabase_client.client.table('conversation_logs')\
-                    .select('id', count='exact')\
-                    .execute()
+                conv_count = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('conversation_logs')
+                    .select('id', count='exact')
+                )
                 conv_total = conv_count.count if hasattr(conv_count, 'count') else len(conv_count.data)
                 
                 # 今日の会話数
-                conv_today = self.bot.supabase_client.client.table('conversation_logs')\
-                    .select('id', count='exact')\
-                    .gte('created_at', today.isoformat())\
-                    .execute()
+                conv_today = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('conversation_logs')
+                    .select('id', count='exact')
+                    .gte('created_at', today.isoformat())
+                )
                 conv_today_count = conv_today.count if hasattr(conv_today, 'count') else len(conv_today.data)
                 
                 embed.add_field(
@@ -114,16 +121,18 @@ class AdminCommands(commands.Cog):
             
             # gemini_usage
             try:
-                gemini_count = self.bot.supabase_client.client.table('gemini_usage')\
-                    .select('id', count='exact')\
-                    .execute()
+                gemini_count = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('gemini_usage')
+                    .select('id', count='exact')
+                )
                 gemini_total = gemini_count.count if hasattr(gemini_count, 'count') else len(gemini_count.data)
                 
                 # 今日のトークン使用量
-                gemini_today = self.bot.supabase_client.client.table('gemini_usage')\
-                    .select('total_tokens')\
-                    .gte('created_at', today.isoformat())\
-                    .execute()
+                gemini_today = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('gemini_usage')
+                    .select('total_tokens')
+                    .gte('created_at', today.isoformat())
+                )
                 tokens_today = sum(row['total_tokens'] for row in gemini_today.data) if gemini_today.data else 0
                 
                 embed.add_field(
@@ -136,9 +145,10 @@ class AdminCommands(commands.Cog):
             
             # system_stats
             try:
-                stats_count = self.bot.supabase_client.client.table('system_stats')\
-                    .select('id', count='exact')\
-                    .execute()
+                stats_count = await self.bot.supabase_client.execute(
+                    self.bot.supabase_client.client.table('system_stats')
+                    .select('id', count='exact')
+                )
                 stats_total = stats_count.count if hasattr(stats_count, 'count') else len(stats_count.data)
                 
                 embed.add_field(
@@ -193,10 +203,11 @@ class AdminCommands(commands.Cog):
                 title = "📊 Network Stats - All Time"
             
             # データを取得
-            result = self.bot.supabase_client.client.table('network_stats')\
-                .select('mb_sent, mb_recv, mb_total')\
-                .gte('recorded_at', start_date.isoformat())\
-                .execute()
+            result = await self.bot.supabase_client.execute(
+                self.bot.supabase_client.client.table('network_stats')
+                .select('mb_sent, mb_recv, mb_total')
+                .gte('recorded_at', start_date.isoformat())
+            )
             
             if not result.data:
                 await interaction.followup.send("📊 データがありません。", ephemeral=True)
@@ -245,6 +256,38 @@ class AdminCommands(commands.Cog):
             traceback.print_exc()
             await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
 
+    @app_commands.command(name="dbindexes", description="Botのクエリがインデックスを使えているか確認")
+    @app_commands.default_permissions(administrator=True)
+    async def dbindexes(self, interaction: discord.Interaction):
+        """登録クエリを EXPLAIN し、シーケンシャルスキャンになるものを表示"""
+        await interaction.response.defer()
+
+        try:
+            results = await self.bot.database.check_query_plans()
+            failed = [r for r in results if not r['ok']]
+
+            embed = discord.Embed(
+                title="🔍 Query Index Check",
+                description=f"{len(results) - len(failed)}/{len(results)} queries use an index",
+                color=0xff4444 if failed else 0x00ff88,
+                timestamp=datetime.utcnow()
+            )
+
+            for result in failed[:25]:
+                detail = result.get('error') or f"Seq Scan: {', '.join(result['seq_scans'])}"
+                embed.add_field(name=f"❌ {result['query']}", value=detail[:1024], inline=False)
+
+            if not failed:
+                embed.add_field(name="✅ OK", value="シーケンシャルスキャンになるクエリはありません", inline=False)
+
+            embed.set_footer(text="PostgreSQL" if self.bot.database.pool else "SQLite")
+
+            await interaction.followup.send(embed=embed)
+
+        except Exception as e:
+            logger.error(f"Error in dbindexes command: {e}")
+            await interaction.followup.send(f"❌ エラーが発生しました: {str(e)}", ephemeral=True)
+
 
 async def setup(bot):
     await bot.add_cog(AdminCommands(bot))
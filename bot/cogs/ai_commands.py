@@ -3,6 +3,7 @@ from discord.ext import commands
 from discord import app_commands
 import logging
 from typing import Optional
+from utils.streaming_reply import StreamingReply
 
 logger = logging.getLogger(__name__)
 
@@ -23,23 +24,33 @@ class AiCommands(commands.Cog):
             # Get AI mode for this guild
             mode = await self.bot.database.get_ai_mode(interaction.guild.id)
             
+            def make_embed(text: str) -> discord.Embed:
+                embed = discord.Embed(
+                    title="🤖 AI Response",
+                    description=text,
+                    color=0xff66aa
+                )
+                embed.set_footer(text=f"Mode: {mode.title()}")
+                return embed
+            
+            # Stream the reply into the embed as it is generated
+            reply = StreamingReply(
+                send=lambda text: interaction.followup.send(embed=make_embed(text), wait=True),
+                edit=lambda msg, text: msg.edit(embed=make_embed(text)),
+                max_length=4096
+            )
+            
             # Generate response
-            response = await self.bot.gemini_client.generate_response(
+            response = await self.bot.gemini_scheduler.generate_response(
                 message,
                 history=history,
-                mode=mode
+                mode=mode,
+                guild_id=interaction.guild.id,
+                on_chunk=reply.on_chunk if self.bot.streaming_replies else None
             )
             
             if response:
-                # Create embed for better formatting
-                embed = discord.Embed(
-                    title="🤖 AI Response",
-                    description=response,
-                    color=0xff66aa
-                )
-                embed.set_footer(text=f"Mode: {mode.title()}")
-                
-                await interaction.followup.send(embed=embed)
+                await reply.finish(response)
                 
                 # Update conversation history
                 self.bot.database.update_user_history(
@@ -56,6 +67,10 @@ class AiCommands(commands.Cog):
                     message_type='slash_command'
                 )
             else:
+                if reply.message:
+                    # Stream failed midway: keep what was generated, drop the cursor
+                    await reply.finish(reply.text)
+                
                 # Handle case where no response is generated
                 embed = discord.Embed(
                     title="❌ エラー",
@@ -1,14 +1,15 @@
 """リアルタイム歌詞配信システム"""
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from discord import app_commands
 import wavelink
 import aiohttp
 import re
 import logging
-from typing import Optional, List, Dict, Tuple
+from typing import Optional, List, Dict, Set, Tuple
 import asyncio
 import os
+from lyrics_cache import LyricsCache
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +20,18 @@ NETEASE_API = "https://netease-cloud-music-api-phi-gules-69.vercel.app"
 
 OFFSET = 0.5  # 0.5秒早めに送信
 
+# プロバイダーのタイムアウト（秒）
+LRCLIB_TIMEOUT = 5
+NETEASE_TIMEOUT = 10
+GENIUS_TIMEOUT = 10
+
+# 最優先のLRCLIBが応答しない場合に他のプロバイダーへ並列で問い合わせるまでの待ち時間（秒）
+HEDGE_DELAY = float(os.getenv('LYRICS_HEDGE_DELAY', 0.3))
+
+
+class LyricsProviderError(Exception):
+    """プロバイダーの一時的な失敗（タイムアウト・通信エラー・5xxなど）。「見つからない」とは区別する"""
+
 
 class LyricsLine:
     """歌詞の1行を表すクラス"""
@@ -39,73 +52,144 @@ class LyricsStreamer(commands.Cog):
         self.current_lyrics: Dict[int, List[LyricsLine]] = {}  # guild_id -> lyrics
         self.current_track_info: Dict[int, Dict] = {}  # guild_id -> track info
         self.lyrics_index: Dict[int, int] = {}  # guild_id -> current index
+        self.line_timers: Dict[int, asyncio.TimerHandle] = {}  # guild_id -> 次の行の送信タイマー
+        self.line_tasks: Dict[int, Set[asyncio.Task]] = {}  # guild_id -> 送信中の歌詞行タスク
         
-        # レコード数管理
-        self.update_counter = 0
-        self.cleanup_interval = 100  # 100回の更新ごとにクリーンアップ
+        # 歌詞API用の共有HTTPセッション（keep-alive接続を再利用）
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.genius = None  # lyricsgenius.Genius（初回使用時に作成）
+        
+        # パース済み歌詞のキャッシュ（リピート再生では再取得しない）
+        self.lyrics_cache = LyricsCache()
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """共有HTTPセッションを取得（未作成・クローズ済みなら作成）"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=20, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
     
     async def cog_load(self):
-        """Cog読み込み時に歌詞配信ループを開始"""
-        if not self.lyrics_stream_loop.is_running():
-            self.lyrics_stream_loop.start()
+        """Cog読み込み時にHTTPセッションとキャッシュを準備"""
+        self._get_session()
+        await self.lyrics_cache.start()
         logger.info("✅ Lyrics streamer loaded")
     
     async def cog_unload(self):
-        """Cog削除時にループを停止"""
-        if self.lyrics_stream_loop.is_running():
-            self.lyrics_stream_loop.cancel()
+        """Cog削除時にタイマーを止めて接続を閉じる"""
+        for guild_id in set(self.line_timers) | set(self.line_tasks):
+            self._stop_line_schedule(guild_id)
+        if self.session and not self.session.closed:
+            await self.session.close()
+        await self.lyrics_cache.close()
         logger.info("✅ Lyrics streamer unloaded")
     
-    @tasks.loop(seconds=0.1)
-    async def lyrics_stream_loop(self):
-        """0.1秒ごとに歌詞を送信"""
+    # ------------------------------------------------------------------
+    # 歌詞行のスケジューリング
+    #
+    # 再生位置と次の行のタイムスタンプから送信時刻を計算し、イベントループの
+    # タイマー（call_later）を1ギルドにつき1つだけ張る。再生していない間は
+    # タイマーを持たないため、アイドル時は何も動かない。
+    # 一時停止・再開・シーク・プレイヤー更新のたびに再計算する。
+    # ------------------------------------------------------------------
+    
+    def _cancel_line_timer(self, guild_id: int):
+        timer = self.line_timers.pop(guild_id, None)
+        if timer:
+            timer.cancel()
+    
+    def _stop_line_schedule(self, guild_id: int):
+        """タイマーと送信中のタスクをどちらも止める（曲の切り替え・停止時）"""
+        self._cancel_line_timer(guild_id)
+        for task in self.line_tasks.pop(guild_id, set()):
+            if task is not asyncio.current_task():
+                task.cancel()
+    
+    def _start_line_task(self, guild_id: int):
+        """タイマー発火時に送信タスクを作成（参照を保持してGCされないようにする）"""
+        tasks = self.line_tasks.setdefault(guild_id, set())
+        task = asyncio.create_task(self._emit_due_line(guild_id))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    
+    def _get_playing_vc(self, guild_id: int):
+        """歌詞配信中で再生中のVCを返す（それ以外は None）"""
+        if not self.lyrics_enabled.get(guild_id) or guild_id not in self.current_lyrics:
+            return None
+        guild = self.bot.get_guild(guild_id)
+        if not guild or not guild.voice_client:
+            return None
+        vc = guild.voice_client
+        if not vc.playing or vc.paused:
+            return None
+        return vc
+    
+    def schedule_next_line(self, guild_id: int):
+        """現在の再生位置から次の歌詞行の送信タイマーを設定し直す"""
+        self._cancel_line_timer(guild_id)
+        
+        vc = self._get_playing_vc(guild_id)
+        if not vc:
+            return
+        
+        lyrics = self.current_lyrics[guild_id]
+        index = self.lyrics_index.get(guild_id, 0)
+        if index >= len(lyrics):
+            return
+        
+        position = vc.position / 1000.0
+        
+        # シークなどで既に過ぎた行は飛ばし、直近の1行だけを送る
+        while index + 1 < len(lyrics) and position >= lyrics[index + 1].timestamp - OFFSET:
+            index += 1
+        self.lyrics_index[guild_id] = index
+        
+        # OFFSETを適用して少し早めに送信
+        delay = max(0.0, lyrics[index].timestamp - OFFSET - position)
+        self.line_timers[guild_id] = asyncio.get_running_loop().call_later(
+            delay, self._start_line_task, guild_id
+        )
+    
+    async def _emit_due_line(self, guild_id: int):
+        """タイマー発火時に歌詞行を送信して次をスケジュール"""
+        self.line_timers.pop(guild_id, None)
         try:
-            for guild_id, enabled in list(self.lyrics_enabled.items()):
-                if not enabled:
-                    continue
-                
-                # ギルドのVCを取得
-                guild = self.bot.get_guild(guild_id)
-                if not guild or not guild.voice_client:
-                    continue
-                
-                vc = guild.voice_client
-                if not vc.playing or vc.paused:
-                    continue
-                
-                # 現在の再生位置を取得（ミリ秒→秒）
-                position = vc.position / 1000.0
-                
-                # 歌詞があるか確認
-                if guild_id not in self.current_lyrics:
-                    continue
-                
-                lyrics = self.current_lyrics[guild_id]
-                current_index = self.lyrics_index.get(guild_id, 0)
-                
-                # 次の歌詞行を探す
-                while current_index < len(lyrics):
-                    line = lyrics[current_index]
-                    
-                    # OFFSETを適用して少し早めに送信
-                    if position >= (line.timestamp - OFFSET) and not line.sent:
-                        await self._send_lyrics_line(guild_id, line)
-                        line.sent = True
-                        self.lyrics_index[guild_id] = current_index + 1
-                        break
-                    elif position < (line.timestamp - OFFSET):
-                        # まだ時間じゃない
-                        break
-                    
-                    current_index += 1
-                
+            vc = self._get_playing_vc(guild_id)
+            if not vc:
+                return
+            
+            lyrics = self.current_lyrics[guild_id]
+            index = self.lyrics_index.get(guild_id, 0)
+            if index >= len(lyrics):
+                return
+            
+            line = lyrics[index]
+            position = vc.position / 1000.0
+            
+            # 後方シークなどでまだ時間になっていなければ再計算
+            if position >= line.timestamp - OFFSET - 0.05:
+                # 送信中に再スケジュールされても同じ行を二重に送らないよう、先に進めておく
+                self.lyrics_index[guild_id] = index + 1
+                if not line.sent:
+                    line.sent = True
+                    await self._send_lyrics_line(guild_id, line)
         except Exception as e:
-            logger.error(f"❌ Lyrics stream loop error: {e}")
+            logger.error(f"❌ Lyrics scheduler error: {e}")
+        
+        if guild_id not in self.line_timers:
+            self.schedule_next_line(guild_id)
+    
+    @commands.Cog.listener()
+    async def on_playback_state_change(self, guild_id: int):
+        """一時停止・再開・シーク時に送信タイミングを再計算"""
+        self.schedule_next_line(guild_id)
     
-    @lyrics_stream_loop.before_loop
-    async def before_lyrics_stream(self):
-        """ループ開始前にBotの準備を待つ"""
-        await self.bot.wait_until_ready()
+    @commands.Cog.listener()
+    async def on_wavelink_player_update(self, payload: wavelink.PlayerUpdateEventPayload):
+        """Lavalinkからの位置更新でずれを補正"""
+        player = payload.player
+        if player and player.guild and player.guild.id in self.current_lyrics:
+            self.schedule_next_line(player.guild.id)
     
     async def _send_lyrics_line(self, guild_id: int, line: LyricsLine):
         """Webhookで歌詞を送信"""
@@ -133,7 +217,7 @@ class LyricsStreamer(commands.Cog):
             logger.error(f"❌ Failed to send lyrics line: {e}")
     
     async def _log_lyrics_to_supabase(self, guild_id: int, text: str, timestamp: float):
-        """歌詞をSupabaseに記録（レコード数管理付き）"""
+        """歌詞をSupabaseに記録（古いレコードの削除は SupabaseRetentionManager が行う）"""
         try:
             if not self.bot.supabase_client or not self.bot.supabase_client.client:
                 return
@@ -146,15 +230,7 @@ class LyricsStreamer(commands.Cog):
                 'track_title': self.current_track_info.get(guild_id, {}).get('title', 'Unknown')
             }
             
-            self.bot.supabase_client.client.table('lyrics_logs').insert(data).execute()
-            
-            # カウンターを増やす
-            self.update_counter += 1
-            
-            # 一定回数ごとにクリーンアップ
-            if self.update_counter >= self.cleanup_interval:
-                await self._cleanup_old_records()
-                self.update_counter = 0
+            await self.bot.supabase_client.execute(self.bot.supabase_client.client.table('lyrics_logs').insert(data))
             
         except Exception as e:
             # テーブルが存在しない場合は警告のみ（エラーを無視）
@@ -163,83 +239,98 @@ class LyricsStreamer(commands.Cog):
             else:
                 logger.error(f"❌ Failed to log lyrics to Supabase: {e}")
     
-    async def _cleanup_old_records(self):
-        """古いレコードを削除して10万件以下に保つ"""
-        try:
-            if not self.bot.supabase_client or not self.bot.supabase_client.client:
-                return
-            
-            # レコード数を取得
-            count_result = self.bot.supabase_client.client.table('lyrics_logs')\
-                .select('id', count='exact')\
-                .execute()
-            
-            total_count = count_result.count if hasattr(count_result, 'count') else len(count_result.data)
-            
-            if total_count > 100000:
-                # 削除する件数
-                delete_count = total_count - 100000
-                
-                logger.info(f"🗑️ Cleaning up {delete_count} old lyrics records...")
-                
-                # 古い順にIDを取得
-                old_records = self.bot.supabase_client.client.table('lyrics_logs')\
-                    .select('id')\
-                    .order('created_at', desc=False)\
-                    .limit(delete_count)\
-                    .execute()
-                
-                if old_records.data:
-                    # IDのリストを作成
-                    ids_to_delete = [record['id'] for record in old_records.data]
-                    
-                    # バッチ削除（1000件ずつ）
-                    batch_size = 1000
-                    for i in range(0, len(ids_to_delete), batch_size):
-                        batch = ids_to_delete[i:i + batch_size]
-                        self.bot.supabase_client.client.table('lyrics_logs')\
-                            .delete()\
-                            .in_('id', batch)\
-                            .execute()
-                    
-                    logger.info(f"✅ Deleted {len(ids_to_delete)} old lyrics records")
-            
-        except Exception as e:
-            # テーブルが存在しない場合は警告のみ
-            if 'does not exist' in str(e) or 'PGRST204' in str(e):
-                logger.warning(f"⚠️ lyrics_logs table does not exist. Skipping cleanup.")
-            else:
-                logger.error(f"❌ Failed to cleanup old records: {e}")
-                import traceback
-                traceback.print_exc()
+    async def get_cached_lyrics(self, track_title: str, artist: str, duration: int) -> Tuple[bool, Optional[List[LyricsLine]]]:
+        """キャッシュから歌詞を取得（ネットワークアクセスなし）。(ヒットしたか, 歌詞) を返す"""
+        key = LyricsCache.make_key(self._clean_query(track_title), self._clean_query(artist), duration)
+        hit, parsed = await self.lyrics_cache.get(key)
+        if not hit or not parsed:
+            return hit, None
+        # 送信済みフラグを持つので再生ごとに新しいLyricsLineを作る
+        return True, [LyricsLine(timestamp, text) for timestamp, text in parsed]
     
-    async def fetch_lyrics(self, track_title: str, artist: str, duration: int) -> Optional[List[LyricsLine]]:
-        """複数のAPIから歌詞を取得（LRCLIB → NetEase → Genius フォールバック）"""
+    async def fetch_lyrics(self, track_title: str, artist: str, duration: int,
+                           check_cache: bool = True) -> Optional[List[LyricsLine]]:
+        """複数のAPIに並列で問い合わせて歌詞を取得
+        
+        LRCLIBを先に開始し、HEDGE_DELAY秒以内に結果がなければNetEaseにも問い合わせる。
+        タイムスタンプ付き（LRCLIB / NetEase）の最初の有効な結果を採用して残りはキャンセルし、
+        どちらも見つからない場合のみGenius（推定タイムスタンプ）に問い合わせる。
+        結果はキャッシュに保存する。見つからなかった結果を保存するのは、
+        すべてのプロバイダーが「見つからない」と確定的に応答した場合のみ
+        （タイムアウトやエラーがあった場合は次回また問い合わせる）。
+        """
+        if check_cache:
+            hit, lyrics = await self.get_cached_lyrics(track_title, artist, duration)
+            if hit:
+                return lyrics
         
         # クエリをクリーンアップ
         clean_title = self._clean_query(track_title)
         clean_artist = self._clean_query(artist)
         
-        # 1. LRCLIB API（最優先、タイムスタンプ付き）
-        lyrics = await self._fetch_from_lrclib(clean_title, clean_artist, duration)
-        if lyrics:
-            logger.info(f"✅ Lyrics found on LRCLIB: {len(lyrics)} lines")
-            return lyrics
+        lyrics, definitive = await self._fetch_from_providers(track_title, artist, clean_title, clean_artist, duration)
+        
+        if definitive:
+            cache_key = LyricsCache.make_key(clean_title, clean_artist, duration)
+            await self.lyrics_cache.put(cache_key, [(line.timestamp, line.text) for line in lyrics] if lyrics else None)
+        
+        return lyrics
+    
+    async def _fetch_from_providers(self, track_title: str, artist: str, clean_title: str,
+                                    clean_artist: str, duration: int) -> Tuple[Optional[List[LyricsLine]], bool]:
+        """タイムスタンプ付きのプロバイダーへヘッジ付きで並列に問い合わせ、なければGeniusに問い合わせる
         
-        # 2. NetEase Cloud Music API（日本語の曲に強い）
-        lyrics = await self._fetch_from_netease(clean_title, clean_artist)
-        if lyrics:
-            logger.info(f"✅ Lyrics found on NetEase: {len(lyrics)} lines")
-            return lyrics
+        Geniusはスレッドで実行されキャンセルできず、APIの利用枠も消費するため、
+        LRCLIB・NetEaseの両方が空または失敗で終わってから開始する。
+        (歌詞, 確定したか) を返す。タイムスタンプ付きの歌詞が見つかった場合は確定。
+        それ以外はいずれかのプロバイダーが失敗していれば未確定（キャッシュしない）。
+        """
+        async def hedged(fetch, delay: float):
+            if delay:
+                await asyncio.sleep(delay)
+            return await fetch()
         
-        # 3. Genius API（フォールバック、タイムスタンプ推定）
-        lyrics = await self._fetch_from_genius(clean_title, clean_artist, duration)
-        if lyrics:
-            logger.info(f"✅ Lyrics found on Genius: {len(lyrics)} lines (estimated timestamps)")
-            return lyrics
+        providers = {
+            asyncio.create_task(hedged(lambda: self._fetch_from_lrclib(clean_title, clean_artist, duration), 0)): 'LRCLIB',
+            asyncio.create_task(hedged(lambda: self._fetch_from_netease(clean_title, clean_artist), HEDGE_DELAY)): 'NetEase',
+        }
+        
+        failed = []
+        pending = set(providers)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = providers[task]
+                    try:
+                        lyrics = task.result()
+                    except Exception as e:
+                        logger.debug(f"{name} error: {e}")
+                        failed.append(name)
+                        continue
+                    if lyrics:
+                        logger.info(f"✅ Lyrics found on {name}: {len(lyrics)} lines")
+                        return lyrics, True
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        fallback = None
+        try:
+            fallback = await self._fetch_from_genius(clean_title, clean_artist, duration)
+        except Exception as e:
+            logger.debug(f"Genius error: {e}")
+            failed.append('Genius')
+        
+        if failed:
+            logger.warning(f"⚠️ Lyrics providers failed ({', '.join(failed)}), result will not be cached")
+        
+        if fallback:
+            logger.info(f"✅ Lyrics found on Genius: {len(fallback)} lines (estimated timestamps)")
+            return fallback, not failed
         
         logger.warning(f"❌ No lyrics found for: {track_title} by {artist}")
-        return None
+        return None, not failed
     
     def _clean_query(self, query: str) -> str:
         """クエリから余計な文字列を削除"""
@@ -299,27 +390,31 @@ class LyricsStreamer(commands.Cog):
                 'duration': duration // 1000  # ミリ秒→秒
             }
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(LRCLIB_API, params=params, timeout=aiohttp.ClientTimeout(total=5)) as response:
-                    if response.status != 200:
-                        logger.debug(f"LRCLIB returned {response.status} for: {search_query}")
-                        return None
-                    
-                    data = await response.json()
-                    synced_lyrics = data.get('syncedLyrics')
-                    
-                    if not synced_lyrics:
-                        logger.debug(f"No synced lyrics on LRCLIB for: {search_query}")
-                        return None
-                    
-                    return self._parse_lrc(synced_lyrics)
+            session = self._get_session()
+            async with session.get(LRCLIB_API, params=params, timeout=aiohttp.ClientTimeout(total=LRCLIB_TIMEOUT)) as response:
+                if response.status == 404:
+                    logger.debug(f"LRCLIB returned 404 for: {search_query}")
+                    return None
+                if response.status != 200:
+                    raise LyricsProviderError(f"LRCLIB returned {response.status}")
+                
+                data = await response.json()
+                synced_lyrics = data.get('syncedLyrics')
+                
+                if not synced_lyrics:
+                    logger.debug(f"No synced lyrics on LRCLIB for: {search_query}")
+                    return None
+                
+                return self._parse_lrc(synced_lyrics)
             
         except asyncio.TimeoutError:
             logger.warning("⚠️ LRCLIB timeout")
-            return None
+            raise LyricsProviderError("LRCLIB timeout")
+        except LyricsProviderError:
+            raise
         except Exception as e:
             logger.debug(f"LRCLIB error: {e}")
-            return None
+            raise LyricsProviderError(f"LRCLIB error: {e}") from e
     
     async def _fetch_from_netease(self, track_title: str, artist: str) -> Optional[List[LyricsLine]]:
         """NetEase Cloud Music APIから歌詞を取得"""
@@ -327,69 +422,66 @@ class LyricsStreamer(commands.Cog):
             # Artist Name - Song Title 形式で検索
             search_query = f"{artist} - {track_title}" if artist and artist != "Unknown" else track_title
             
-            async with aiohttp.ClientSession() as session:
-                # 1. 曲を検索
-                search_url = f"{NETEASE_API}/cloudsearch"
-                search_params = {
-                    'keywords': search_query,
-                    'type': 1,  # 1 = 曲
-                    'limit': 5
-                }
+            session = self._get_session()
+            
+            # 1. 曲を検索
+            search_url = f"{NETEASE_API}/cloudsearch"
+            search_params = {
+                'keywords': search_query,
+                'type': 1,  # 1 = 曲
+                'limit': 5
+            }
+            
+            async with session.get(search_url, params=search_params, timeout=aiohttp.ClientTimeout(total=NETEASE_TIMEOUT)) as response:
+                if response.status != 200:
+                    raise LyricsProviderError(f"NetEase search returned {response.status}")
+                
+                data = await response.json()
+                
+                if data.get('code') != 200:
+                    raise LyricsProviderError(f"NetEase API error: {data.get('code')}")
+                
+                songs = data.get('result', {}).get('songs', [])
+                
+                if not songs:
+                    logger.debug(f"No songs found on NetEase for: {search_query}")
+                    return None
+                
+                # 最初の曲のIDを取得
+                song_id = songs[0]['id']
+                logger.debug(f"Found NetEase song ID: {song_id} for: {search_query}")
+            
+            # 2. 歌詞を取得
+            lyrics_url = f"{NETEASE_API}/lyric"
+            lyrics_params = {'id': song_id}
+            
+            async with session.get(lyrics_url, params=lyrics_params, timeout=aiohttp.ClientTimeout(total=NETEASE_TIMEOUT)) as response:
+                if response.status != 200:
+                    raise LyricsProviderError(f"NetEase lyrics returned {response.status}")
+                
+                data = await response.json()
+                
+                if data.get('code') != 200:
+                    raise LyricsProviderError(f"NetEase lyrics API error: {data.get('code')}")
                 
-                async with session.get(search_url, params=search_params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status != 200:
-                        logger.debug(f"NetEase search returned {response.status} for: {search_query}")
-                        return None
-                    
-                    data = await response.json()
-                    
-                    if data.get('code') != 200:
-                        logger.debug(f"NetEase API error: {data.get('code')}")
-                        return None
-                    
-                    songs = data.get('result', {}).get('songs', [])
-                    
-                    if not songs:
-                        logger.debug(f"No songs found on NetEase for: {search_query}")
-                        return None
-                    
-                    # 最初の曲のIDを取得
-                    song_id = songs[0]['id']
-                    logger.debug(f"Found NetEase song ID: {song_id} for: {search_query}")
+                # LRC形式の歌詞を取得
+                lrc_data = data.get('lrc', {}).get('lyric')
                 
-                # 2. 歌詞を取得
-                lyrics_url = f"{NETEASE_API}/lyric"
-                lyrics_params = {'id': song_id}
+                if not lrc_data:
+                    logger.debug("No LRC lyrics in NetEase response")
+                    return None
                 
-                async with session.get(lyrics_url, params=lyrics_params, timeout=aiohttp.ClientTimeout(total=10)) as response:
-                    if response.status != 200:
-                        logger.debug(f"NetEase lyrics returned {response.status}")
-                        return None
-                    
-                    data = await response.json()
-                    
-                    if data.get('code') != 200:
-                        logger.debug(f"NetEase lyrics API error: {data.get('code')}")
-                        return None
-                    
-                    # LRC形式の歌詞を取得
-                    lrc_data = data.get('lrc', {}).get('lyric')
-                    
-                    if not lrc_data:
-                        logger.debug("No LRC lyrics in NetEase response")
-                        return None
-                    
-                    # LRC形式をパース
-                    return self._parse_lrc(lrc_data)
+                # LRC形式をパース
+                return self._parse_lrc(lrc_data)
         
         except asyncio.TimeoutError:
             logger.warning("⚠️ NetEase timeout")
-            return None
+            raise LyricsProviderError("NetEase timeout")
+        except LyricsProviderError:
+            raise
         except Exception as e:
             logger.debug(f"NetEase error: {e}")
-            import traceback
-            traceback.print_exc()
-            return None
+            raise LyricsProviderError(f"NetEase error: {e}") from e
     
     async def _fetch_from_genius(self, track_title: str, artist: str, duration: int) -> Optional[List[LyricsLine]]:
         """Genius APIから歌詞を取得（lyricsgenius使用）"""
@@ -407,17 +499,21 @@ class LyricsStreamer(commands.Cog):
                 logger.warning("lyricsgenius not installed. Run: pip install lyricsgenius")
                 return None
             
-            # Geniusクライアントを作成
-            genius = lyricsgenius.Genius(
-                api_key,
-                verbose=False,
-                remove_section_headers=True,
-                skip_non_songs=True,
-                timeout=5
-            )
+            # Geniusクライアントを作成（初回のみ）
+            if self.genius is None:
+                self.genius = lyricsgenius.Genius(
+                    api_key,
+                    verbose=False,
+                    remove_section_headers=True,
+                    skip_non_songs=True,
+                    timeout=5
+                )
             
-            # 曲を検索
-            song = genius.search_song(track_title, artist)
+            # 曲を検索（lyricsgeniusはブロッキングなのでスレッドで実行）
+            song = await asyncio.wait_for(
+                asyncio.to_thread(self.genius.search_song, track_title, artist),
+                timeout=GENIUS_TIMEOUT
+            )
             
             if not song or not song.lyrics:
                 logger.debug(f"No lyrics found on Genius for: {track_title}")
@@ -426,9 +522,12 @@ class LyricsStreamer(commands.Cog):
             # タイムスタンプなしの歌詞を推定タイムスタンプ付きに変換
             return self._estimate_timestamps(song.lyrics, duration)
         
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Genius timeout")
+            raise LyricsProviderError("Genius timeout")
         except Exception as e:
             logger.debug(f"Genius error: {e}")
-            return None
+            raise LyricsProviderError(f"Genius error: {e}") from e
     
     def _estimate_timestamps(self, lyrics_text: str, duration: int = 180000) -> List[LyricsLine]:
         """タイムスタンプなしの歌詞に推定タイムスタンプを付与"""
@@ -498,6 +597,10 @@ class LyricsStreamer(commands.Cog):
             if guild_id not in self.lyrics_enabled or not self.lyrics_enabled[guild_id]:
                 return
             
+            # 前の曲の歌詞を止める（取得中に古い行が送られないように）
+            self._stop_line_schedule(guild_id)
+            self.current_lyrics.pop(guild_id, None)
+            
             # トラック情報を保存
             self.current_track_info[guild_id] = {
                 'title': track.title,
@@ -519,30 +622,40 @@ class LyricsStreamer(commands.Cog):
             if not lyrics_channel:
                 return
             
-            # 歌詞を取得中メッセージ
-            try:
-                searching_msg = await lyrics_channel.send(f"🔍 歌詞を検索中: **{track.title}**")
-            except:
-                searching_msg = None
-            
-            # 歌詞を取得
-            logger.info(f"🎤 Fetching lyrics for: {track.title}")
-            lyrics = await self.fetch_lyrics(
-                track.title,
-                getattr(track, 'author', 'Unknown'),
-                track.length
-            )
+            artist = getattr(track, 'author', 'Unknown')
             
-            # 検索中メッセージを削除
-            if searching_msg:
+            # キャッシュにあれば即座に配信（外部APIを呼ばない）
+            cached, lyrics = await self.get_cached_lyrics(track.title, artist, track.length)
+            
+            if cached:
+                logger.info(f"🎤 Lyrics cache hit for: {track.title}")
+            else:
+                # 歌詞を取得中メッセージ
                 try:
-                    await searching_msg.delete()
+                    searching_msg = await lyrics_channel.send(f"🔍 歌詞を検索中: **{track.title}**")
                 except:
-                    pass
+                    searching_msg = None
+                
+                # 歌詞を取得
+                logger.info(f"🎤 Fetching lyrics for: {track.title}")
+                lyrics = await self.fetch_lyrics(
+                    track.title,
+                    artist,
+                    track.length,
+                    check_cache=False
+                )
+                
+                # 検索中メッセージを削除
+                if searching_msg:
+                    try:
+                        await searching_msg.delete()
+                    except:
+                        pass
             
             if lyrics:
                 self.current_lyrics[guild_id] = lyrics
                 self.lyrics_index[guild_id] = 0
+                self.schedule_next_line(guild_id)
                 
                 # 成功メッセージ
                 embed = discord.Embed(
@@ -561,6 +674,7 @@ class LyricsStreamer(commands.Cog):
                 logger.info(f"✅ Lyrics loaded: {len(lyrics)} lines")
             else:
                 # 歌詞が見つからない
+                self._stop_line_schedule(guild_id)
                 self.current_lyrics.pop(guild_id, None)
                 self.lyrics_index.pop(guild_id, None)
                 
@@ -584,6 +698,7 @@ class LyricsStreamer(commands.Cog):
     
     async def stop_lyrics_for_guild(self, guild_id: int):
         """ギルドの歌詞配信を停止"""
+        self._stop_line_schedule(guild_id)
         self.current_lyrics.pop(guild_id, None)
         self.lyrics_index.pop(guild_id, None)
         self.current_track_info.pop(guild_id, None)
@@ -697,7 +812,7 @@ class LyricsStreamer(commands.Cog):
                     description=f"歌詞は {channel.mention} にリアルタイムで配信されます。",
                     color=0x00ff88
                 )
-                embed.add_field(name="精度", value="0.1秒間隔", inline=True)
+                embed.add_field(name="精度", value="行ごとのタイマー", inline=True)
                 embed.add_field(name="オフセット", value=f"{OFFSET}秒早め", inline=True)
                 
                 await interaction.followup.send(embed=embed)
@@ -9,6 +9,8 @@ import re
 from youtubesearchpython import VideosSearch
 import json
 
+from utils.music_queue import MusicQueue
+
 logger = logging.getLogger(__name__)
 
 # URL patterns
@@ -16,39 +18,6 @@ YOUTUBE_REGEX = re.compile(r'(https?://)?(www\.)?(youtube\.com|youtu\.be)/.+')
 SPOTIFY_REGEX = re.compile(r'(https?://)?(open\.)?spotify\.com/(track|album|playlist|artist)/([a-zA-Z0-9]+)')
 SOUNDCLOUD_REGEX = re.compile(r'(https?://)?(www\.)?soundcloud\.com/.+')
 
-class MusicQueue:
-    def __init__(self):
-        self.queue: List[wavelink.Playable] = []
-        self.history: List[wavelink.Playable] = []
-        self.current: Optional[wavelink.Playable] = None
-        self.loop_mode = "off"  # off, track, queue
-    
-    def add(self, track: wavelink.Playable):
-        self.queue.append(track)
-    
-    def get_next(self) -> Optional[wavelink.Playable]:
-        if self.loop_mode == "track" and self.current:
-            return self.current
-        
-        if not self.queue:
-            if self.loop_mode == "queue" and self.history:
-                self.queue.extend(self.history)
-                self.history.clear()
-        
-        if self.queue:
-            track = self.queue.pop(0)
-            if self.current:
-                self.history.append(self.current)
-            self.current = track
-            return track
-        
-        return None
-    
-    def clear(self):
-        self.queue.clear()
-        self.history.clear()
-        self.current = None
-
 class MusicPlayer(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -279,7 +248,7 @@ class MusicPlayer(commands.Cog):
 
 検索クエリ:"""
                 
-                response = await self.bot.gemini_client.generate_response(
+                response = await self.bot.gemini_scheduler.generate_response(
                     prompt,
                     mode='assistant'
                 )
@@ -339,7 +308,7 @@ class MusicPlayer(commands.Cog):
                 # URL detected - try direct search
                 logger.info(f"Detected URL: {query}")
                 try:
-                    result = await wavelink.Playable.search(query)
+                    result = await self.bot.track_search.search(query)
                     if isinstance(result, wavelink.Playlist):
                         is_playlist = True
                         playlist_name = result.name
@@ -368,7 +337,7 @@ class MusicPlayer(commands.Cog):
                     tracks, _, _ = await self.search_spotify(query, search_mode=True)
                     tracks = tracks[:15] if tracks else []
                 elif source == "soundcloud":
-                    tracks = await wavelink.Playable.search(f"scsearch:{query}")
+                    tracks = await self.bot.track_search.search(f"scsearch:{query}")
                     tracks = tracks[:15] if isinstance(tracks, list) else ([tracks] if tracks else [])
                 else:
                     # Default: YouTube search - get 15 results
@@ -377,12 +346,12 @@ class MusicPlayer(commands.Cog):
                         search_query = await self.ai_music_recommendation(query)
                     
                     logger.info(f"Searching YouTube: {search_query}")
-                    tracks = await wavelink.Playable.search(f"ytsearch15:{search_query}")
+                    tracks = await self.bot.track_search.search(f"ytsearch15:{search_query}")
                     
                     if not tracks or len(tracks) == 0:
                         # Retry with simpler query
                         logger.info(f"Retrying with original query: {query}")
-                        tracks = await wavelink.Playable.search(f"ytsearch15:{query}")
+                        tracks = await self.bot.track_search.search(f"ytsearch15:{query}")
                     
                     tracks = tracks[:15] if isinstance(tracks, list) else ([tracks] if tracks else [])
                     logger.info(f"Found {len(tracks)} tracks")
@@ -541,7 +510,7 @@ class MusicPlayer(commands.Cog):
             
             if search_mode:
                 # Search mode: use spsearch
-                tracks = await wavelink.Playable.search(f"spsearch:{query}")
+                tracks = await self.bot.track_search.search(f"spsearch:{query}")
                 return (tracks if tracks else [], False, None)
             
             # URL mode: detect type
@@ -553,7 +522,7 @@ class MusicPlayer(commands.Cog):
                     is_playlist = True
                 
                 # Load via wavelink (LavaSrc handles Spotify)
-                result = await wavelink.Playable.search(query)
+                result = await self.bot.track_search.search(query)
                 
                 if isinstance(result, wavelink.Playlist):
                     playlist_name = result.name
@@ -676,7 +645,7 @@ class MusicPlayer(commands.Cog):
             )
             
             # Search and play
-            tracks = await wavelink.Playable.search(recommendation_query)
+            tracks = await self.bot.track_search.search(recommendation_query)
             
             if not tracks:
                 await interaction.followup.send("❌ 推薦曲が見つかりませんでした。", ephemeral=True)
@@ -1028,21 +997,9 @@ class PlaybackModeView(discord.ui.View):
 async def get_high_quality_stream(self, uri: str) -> Optional[str]:
     """Get high-quality stream URL for web playback"""
     try:
-        import yt_dlp
-        
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'noplaylist': True,
-            'quiet': True,
-            'no_warnings': True,
-        }
-        
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(uri, download=False)
-            if info and 'url' in info:
-                return info['url']
-        
-        return None
+        # yt-dlpの抽出はプロセスプールで実行（キャッシュ・同時リクエストの集約あり）
+        info = await self.bot.stream_resolver.resolve(uri, 'bestaudio/best')
+        return info['url'] if info else None
         
     except Exception as e:
         logger.error(f"Error getting high-quality stream: {e}")
@@ -1064,7 +1021,7 @@ async def generate_ai_lyrics(self, title: str, artist: str) -> Optional[List[str
         - 日本語の楽曲の場合は日本語で、英語の楽曲の場合は英語で
         """
         
-        response = await self.bot.gemini_client.generate_response(
+        response = await self.bot.gemini_scheduler.generate_response(
             prompt,
             mode='creative'
         )
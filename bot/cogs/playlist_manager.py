@@ -2,8 +2,11 @@
 import discord
 from discord.ext import commands
 from discord import app_commands
+import os
+import time
+import asyncio
 import logging
-from typing import Optional, List
+from typing import Awaitable, Callable, Dict, Optional, List, Set
 import wavelink
 
 logger = logging.getLogger(__name__)
@@ -12,6 +15,9 @@ logger = logging.getLogger(__name__)
 class PlaylistManager(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.load_concurrency = int(os.getenv('PLAYLIST_LOAD_CONCURRENCY', 5))
+        self.encoded_column_available = True  # playlist_tracks.encoded_track（未マイグレーションならFalse）
+        self.background_tasks: Set[asyncio.Task] = set()  # GCで消えないよう保存タスクの参照を保持
     
     async def get_user_playlists(self, guild_id: int, user_id: int = None) -> List[dict]:
         """ユーザーまたはギルドのプレイリストを取得"""
@@ -40,7 +46,7 @@ class PlaylistManager(commands.Cog):
                 # ギルドの全プレイリスト
                 query = query.eq('guild_id', str(guild_id))
             
-            result = query.order('created_at', desc=True).execute()
+            result = await self.bot.supabase_client.execute(query.order('created_at', desc=True))
             return result.data if result.data else []
         except Exception as e:
             logger.error(f"Error fetching playlists: {e}")
@@ -75,7 +81,7 @@ class PlaylistManager(commands.Cog):
             }
             
             logger.info(f"Creating playlist: {data}")
-            result = self.bot.supabase_client.client.table('playlists').insert(data).execute()
+            result = await self.bot.supabase_client.execute(self.bot.supabase_client.client.table('playlists').insert(data))
             
             if result.data and len(result.data) > 0:
                 logger.info(f"Playlist created successfully: {result.data[0]['id']}")
@@ -90,7 +96,8 @@ class PlaylistManager(commands.Cog):
             return None
     
     async def add_track_to_playlist(self, playlist_id: str, track_title: str, track_url: str,
-                                   track_author: str, duration_ms: int, added_by: str, added_by_id: int) -> bool:
+                                   track_author: str, duration_ms: int, added_by: str, added_by_id: int,
+                                   encoded_track: Optional[str] = None) -> bool:
         """プレイリストに曲を追加"""
         try:
             if not self.bot.supabase_client:
@@ -107,10 +114,11 @@ class PlaylistManager(commands.Cog):
                 return False
             
             # 現在の曲数を取得してpositionを決定
-            count_result = self.bot.supabase_client.client.table('playlist_tracks')\
-                .select('id', count='exact')\
-                .eq('playlist_id', playlist_id)\
-                .execute()
+            count_result = await self.bot.supabase_client.execute(
+                self.bot.supabase_client.client.table('playlist_tracks')
+                .select('id', count='exact')
+                .eq('playlist_id', playlist_id)
+            )
             
             position = len(count_result.data) if count_result.data else 0
             
@@ -125,8 +133,19 @@ class PlaylistManager(commands.Cog):
                 'position': position
             }
             
+            # ✅ Lavalinkのエンコード済みトラックも保存（再生時に検索が不要になる）
+            if encoded_track and self.encoded_column_available:
+                data['encoded_track'] = encoded_track
+            
             logger.info(f"Adding track to playlist: {track_title}")
-            self.bot.supabase_client.client.table('playlist_tracks').insert(data).execute()
+            try:
+                await self.bot.supabase_client.execute(self.bot.supabase_client.client.table('playlist_tracks').insert(data))
+            except Exception as e:
+                if 'encoded_track' not in data or 'encoded_track' not in str(e):
+                    raise
+                self._disable_encoded_column(e)
+                data.pop('encoded_track')
+                await self.bot.supabase_client.execute(self.bot.supabase_client.client.table('playlist_tracks').insert(data))
             logger.info("Track added successfully")
             return True
         except Exception as e:
@@ -151,11 +170,12 @@ class PlaylistManager(commands.Cog):
                 logger.error("Failed to initialize Supabase client")
                 return []
             
-            result = self.bot.supabase_client.client.table('playlist_tracks')\
-                .select('*')\
-                .eq('playlist_id', playlist_id)\
-                .order('position')\
-                .execute()
+            result = await self.bot.supabase_client.execute(
+                self.bot.supabase_client.client.table('playlist_tracks')
+                .select('*')
+                .eq('playlist_id', playlist_id)
+                .order('position')
+            )
             
             return result.data if result.data else []
         except Exception as e:
@@ -164,6 +184,112 @@ class PlaylistManager(commands.Cog):
             traceback.print_exc()
             return []
     
+    def _disable_encoded_column(self, error: Exception):
+        logger.warning(f"⚠️ playlist_tracks.encoded_track is not available, run add_playlist_encoded_tracks.sql: {error}")
+        self.encoded_column_available = False
+    
+    async def decode_tracks(self, encoded: List[str]) -> List[Optional[wavelink.Playable]]:
+        """エンコード済みトラックを1回のリクエストでまとめてデコード（検索不要）"""
+        if not encoded:
+            return []
+        try:
+            node = wavelink.Pool.get_node()
+            data = await node.send('POST', path='v4/decodetracks', data=encoded)
+            return [wavelink.Playable(track) for track in data]
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to decode stored tracks, falling back to search: {e}")
+            return [None] * len(encoded)
+    
+    async def _search_track(self, track_data: dict) -> Optional[wavelink.Playable]:
+        """URLから曲を取得"""
+        try:
+            tracks = await self.bot.track_search.search(track_data['track_url'], limit=1)
+            if not tracks:
+                return None
+            return tracks[0] if isinstance(tracks, list) else tracks
+        except Exception as e:
+            logger.error(f"Error loading track: {e}")
+            return None
+    
+    async def resolve_playlist_tracks(self, tracks_data: List[dict],
+                                      on_track: Callable[[int, Optional[wavelink.Playable]], Awaitable[None]]
+                                      ) -> List[Optional[wavelink.Playable]]:
+        """保存済みの曲を解決し、プレイリスト順に on_track(index, track) を呼ぶ
+        
+        1曲目を先に解決して即座に渡し、残りは encoded_track の一括デコードと
+        URL検索（セマフォで同時数を制限）を並行して行う。
+        """
+        total = len(tracks_data)
+        results: List[Optional[wavelink.Playable]] = [None] * total
+        ready = [False] * total
+        next_index = 0
+        flush_lock = asyncio.Lock()
+        
+        async def complete(index: int, track: Optional[wavelink.Playable]):
+            nonlocal next_index
+            results[index] = track
+            ready[index] = True
+            # 先頭から連続して解決済みの曲だけを順番通りに渡す
+            async with flush_lock:
+                while next_index < total and ready[next_index]:
+                    current = next_index
+                    next_index += 1
+                    await on_track(current, results[current])
+        
+        async def resolve_one(track_data: dict, decoded: Optional[wavelink.Playable] = None):
+            if decoded is None and track_data.get('encoded_track'):
+                decoded = (await self.decode_tracks([track_data['encoded_track']]))[0]
+            return decoded or await self._search_track(track_data)
+        
+        # 1曲目は単独で解決して再生を始める
+        await complete(0, await resolve_one(tracks_data[0]))
+        
+        # 残りのエンコード済みトラックは1回でデコード
+        rest = list(range(1, total))
+        encoded_indexes = [i for i in rest if tracks_data[i].get('encoded_track')]
+        decoded = await self.decode_tracks([tracks_data[i]['encoded_track'] for i in encoded_indexes])
+        decoded_by_index: Dict[int, Optional[wavelink.Playable]] = dict(zip(encoded_indexes, decoded))
+        
+        semaphore = asyncio.Semaphore(self.load_concurrency)
+        
+        async def load(index: int):
+            track = decoded_by_index.get(index)
+            if track is None:
+                async with semaphore:
+                    track = await self._search_track(tracks_data[index])
+            await complete(index, track)
+        
+        await asyncio.gather(*(load(i) for i in rest))
+        
+        # 次回以降は検索不要になるよう、エンコード済みトラックを保存
+        missing = [
+            {**track_data, 'encoded_track': track.encoded}
+            for track_data, track in zip(tracks_data, results)
+            if track is not None and not track_data.get('encoded_track') and track_data.get('id')
+        ]
+        if missing and self.encoded_column_available:
+            task = asyncio.create_task(self.store_encoded_tracks(missing))
+            self.background_tasks.add(task)
+            task.add_done_callback(self.background_tasks.discard)
+        
+        return results
+    
+    async def store_encoded_tracks(self, rows: List[dict]):
+        """encoded_track を設定した playlist_tracks の行を1回のリクエストでまとめて保存
+        
+        upsert は INSERT として NOT NULL 制約を検査するため、get_playlist_tracks で取得した行全体を渡す。
+        """
+        client = self.bot.supabase_client
+        try:
+            await client.execute(
+                client.client.table('playlist_tracks').upsert(rows, on_conflict='id')
+            )
+        except Exception as e:
+            if 'encoded_track' in str(e):
+                self._disable_encoded_column(e)
+                return
+            logger.error(f"Error storing encoded tracks: {e}")
+    
     async def delete_playlist(self, playlist_id: str) -> bool:
         """プレイリストを削除"""
         try:
@@ -180,7 +306,7 @@ class PlaylistManager(commands.Cog):
                 logger.error("Failed to initialize Supabase client")
                 return False
             
-            self.bot.supabase_client.client.table('playlists').delete().eq('id', playlist_id).execute()
+            await self.bot.supabase_client.execute(self.bot.supabase_client.client.table('playlists').delete().eq('id', playlist_id))
             logger.info(f"Playlist deleted: {playlist_id}")
             return True
         except Exception as e:
@@ -205,7 +331,7 @@ class PlaylistManager(commands.Cog):
                 logger.error("Failed to initialize Supabase client")
                 return False
             
-            self.bot.supabase_client.client.table('playlist_tracks').delete().eq('id', track_id).execute()
+            await self.bot.supabase_client.execute(self.bot.supabase_client.client.table('playlist_tracks').delete().eq('id', track_id))
             logger.info(f"Track deleted from playlist: {track_id}")
             return True
         except Exception as e:
@@ -404,40 +530,57 @@ class PlaylistSelectView(discord.ui.View):
                 vc = interaction.guild.voice_client
             
             queue = music_cog.get_queue(interaction.guild.id)
-            
-            # 曲を検索してキューに追加
+            total = len(tracks_data)
             added_count = 0
-            for track_data in tracks_data:
-                try:
-                    # URLから曲を取得
-                    tracks = await wavelink.Playable.search(track_data['track_url'])
-                    if tracks:
-                        track = tracks[0] if isinstance(tracks, list) else tracks
-                        
-                        # リクエスト情報を保存
-                        if not hasattr(track, 'extras'):
-                            track.extras = {}
-                        track.extras['requester_name'] = interaction.user.display_name
-                        track.extras['requester_id'] = interaction.user.id
-                        
-                        if not vc.playing and added_count == 0:
-                            await vc.play(track)
-                            queue.current = track
-                        else:
-                            queue.add(track)
-                        
-                        added_count += 1
-                except Exception as e:
-                    logger.error(f"Error loading track: {e}")
-                    continue
+            message = None
+            last_edit = 0.0
             
-            embed = discord.Embed(
-                title="🎵 プレイリストを再生",
-                description=f"**{playlist['name']}**\n{added_count}曲をキューに追加しました",
-                color=0x00ff88
-            )
+            def progress_embed(done: bool) -> discord.Embed:
+                if done:
+                    description = f"**{playlist['name']}**\n{added_count}曲をキューに追加しました"
+                else:
+                    description = f"**{playlist['name']}**\n{added_count}/{total}曲を読み込み中..."
+                return discord.Embed(title="🎵 プレイリストを再生", description=description, color=0x00ff88)
             
-            await interaction.followup.send(embed=embed)
+            async def on_track(index: int, track: Optional[wavelink.Playable]):
+                """解決できた曲をプレイリスト順に受け取り、再生・キュー追加する"""
+                nonlocal added_count, message, last_edit
+                if track is None:
+                    return
+                
+                # リクエスト情報を保存
+                if not hasattr(track, 'extras'):
+                    track.extras = {}
+                track.extras['requester_name'] = interaction.user.display_name
+                track.extras['requester_id'] = interaction.user.id
+                
+                if not vc.playing and added_count == 0:
+                    await vc.play(track)
+                    queue.current = track
+                else:
+                    queue.add(track)
+                
+                added_count += 1
+                
+                # 進捗を表示（編集は1.5秒に1回まで）
+                if added_count < total:
+                    if message is None:
+                        message = await interaction.followup.send(embed=progress_embed(False), wait=True)
+                        last_edit = time.monotonic()
+                    elif time.monotonic() - last_edit >= 1.5:
+                        last_edit = time.monotonic()
+                        try:
+                            await message.edit(embed=progress_embed(False))
+                        except Exception:
+                            pass
+            
+            # 1曲目が解決した時点で再生を開始し、残りは並行して読み込む
+            await self.playlist_manager.resolve_playlist_tracks(tracks_data, on_track)
+            
+            if message is None:
+                await interaction.followup.send(embed=progress_embed(True))
+            else:
+                await message.edit(embed=progress_embed(True))
         
         except Exception as e:
             logger.error(f"Error playing playlist: {e}")
@@ -512,7 +655,8 @@ class AddToPlaylistView(discord.ui.View):
             track_author=getattr(self.track, 'author', 'Unknown'),
             duration_ms=self.track.length if hasattr(self.track, 'length') else 0,
             added_by=interaction.user.display_name,
-            added_by_id=interaction.user.id
+            added_by_id=interaction.user.id,
+            encoded_track=getattr(self.track, 'encoded', None)
         )
         
         if success:
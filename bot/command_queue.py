@@ -0,0 +1,278 @@
+"""ダッシュボードからのコマンドキューをプッシュ通知で受け取るコンシューマー"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'command_queue'
+
+# pending のコマンドを原子的に取得して processing にする（複数プロセスでも二重実行しない）
+CLAIM_SQL = '''
+    UPDATE command_queue SET status = 'processing', updated_at = NOW()
+    WHERE id IN (
+        SELECT id FROM command_queue
+        WHERE status = 'pending'
+        ORDER BY created_at
+        LIMIT $1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING *
+'''
+
+
+class CommandQueueConsumer:
+    """command_queue を LISTEN/NOTIFY で監視し、取得したコマンドを実行する
+
+    - Postgresに直接接続できる場合は LISTEN で即座に起床し、UPDATE ... RETURNING で取得
+    - 接続できない場合は PostgREST 経由のポーリング（空振りのたびに間隔を倍にする）
+    - コマンドはギルド間では並行、同じギルド内では到着順に1つずつ実行
+    """
+
+    def __init__(self, supabase_client, dsn: str = None, batch_size: int = 10,
+                 min_interval: float = None, max_interval: float = None, listen_interval: float = 60):
+        self.supabase_client = supabase_client
+        self.dsn = dsn or os.getenv('SUPABASE_DB_URL') or os.getenv('DATABASE_URL')
+        self.batch_size = batch_size
+        self.min_interval = min_interval or float(os.getenv('COMMAND_POLL_MIN_INTERVAL', 1))
+        self.max_interval = max_interval or float(os.getenv('COMMAND_POLL_MAX_INTERVAL', 15))
+        self.listen_interval = listen_interval  # LISTEN中の取りこぼし確認間隔
+
+        self.listener = None  # asyncpg.Connection
+        self._listener_retry_at = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.is_running = False
+        self.interval = self.min_interval
+
+        self.guild_queues: Dict[str, Deque[Dict[str, Any]]] = {}
+        self.guild_workers: Dict[str, asyncio.Task] = {}
+
+        # 統計
+        self.stats = {
+            'claimed': 0,
+            'completed': 0,
+            'failed': 0,
+            'notifications': 0,
+            'polls': 0,
+            'empty_polls': 0,
+            'avg_latency_ms': 0.0
+        }
+
+    async def start(self):
+        """監視ループを開始"""
+        if self.is_running:
+            return
+        self._wakeup = asyncio.Event()
+        self.is_running = True
+        await self._connect_listener()
+        self.task = asyncio.create_task(self._run())
+        mode = 'LISTEN/NOTIFY' if self.listener else 'adaptive polling'
+        logger.info(f"✅ Command queue consumer started ({mode})")
+
+    async def close(self):
+        """監視を止め、実行中のコマンドを待つ"""
+        self.is_running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        workers = list(self.guild_workers.values())
+        if workers:
+            await asyncio.wait(workers, timeout=5)
+
+        await self._close_listener()
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'mode': 'listen' if self.listener else 'polling',
+            'poll_interval': self.listen_interval if self.listener else self.interval,
+            'active_guilds': len(self.guild_workers),
+            'queued': sum(len(q) for q in self.guild_queues.values())
+        }
+
+    # ------------------------------------------------------------------
+    # LISTEN/NOTIFY
+    # ------------------------------------------------------------------
+
+    async def _connect_listener(self):
+        """Postgresに専用接続を張って LISTEN する（失敗時はポーリングのみ）"""
+        if not self.dsn or time.monotonic() < self._listener_retry_at:
+            return
+        self._listener_retry_at = time.monotonic() + 30
+
+        try:
+            import asyncpg
+            conn = await asyncpg.connect(self.dsn)
+            if not await conn.fetchval("SELECT to_regclass('public.command_queue') IS NOT NULL"):
+                # DATABASE_URL が Supabase 以外のDBを指している
+                await conn.close()
+                self.dsn = None
+                return
+            await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+            conn.add_termination_listener(self._on_listener_lost)
+            self.listener = conn
+            logger.info("✅ Listening for command_queue notifications")
+        except Exception as e:
+            logger.warning(f"⚠️ Command queue LISTEN unavailable, using polling: {e}")
+            self.listener = None
+
+    async def _close_listener(self):
+        conn, self.listener = self.listener, None
+        if conn:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.stats['notifications'] += 1
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _on_listener_lost(self, connection):
+        logger.warning("⚠️ Command queue listener connection lost, falling back to polling")
+        self.listener = None
+        if self._wakeup:
+            self._wakeup.set()
+
+    # ------------------------------------------------------------------
+    # 取得ループ
+    # ------------------------------------------------------------------
+
+    async def _run(self):
+        while self.is_running:
+            # 取得前にクリアしておき、取得中に届いた通知を取りこぼさない
+            self._wakeup.clear()
+            try:
+                commands = await self._claim()
+            except Exception as e:
+                logger.error(f"❌ Command queue claim error: {e}")
+                commands = []
+
+            for command in commands:
+                self._dispatch(command)
+
+            if len(commands) >= self.batch_size:
+                continue  # まだ残っている可能性がある
+
+            if commands:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+
+            if not self.listener:
+                await self._connect_listener()
+
+            timeout = self.listen_interval if self.listener else self.interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                self.interval = self.min_interval
+            except asyncio.TimeoutError:
+                pass
+
+    async def _claim(self) -> List[Dict[str, Any]]:
+        """pending のコマンドを processing にして取得する"""
+        self.stats['polls'] += 1
+
+        if self.listener:
+            try:
+                rows = await self.listener.fetch(CLAIM_SQL, self.batch_size)
+                commands = [self._from_record(row) for row in rows]
+            except Exception as e:
+                logger.error(f"❌ Command claim over LISTEN connection failed: {e}")
+                await self._close_listener()
+                commands = await self._claim_via_rest()
+        else:
+            commands = await self._claim_via_rest()
+
+        if not commands:
+            self.stats['empty_polls'] += 1
+            return []
+
+        commands.sort(key=lambda c: str(c.get('created_at') or ''))
+        self.stats['claimed'] += len(commands)
+        return commands
+
+    async def _claim_via_rest(self) -> List[Dict[str, Any]]:
+        """PostgREST経由：候補を読み、status='pending' を条件に更新できた行だけを取得"""
+        client = self.supabase_client
+        if not client.client:
+            return []
+
+        result = await client.execute(
+            client.client.table('command_queue')
+            .select('id')
+            .eq('status', 'pending')
+            .order('created_at', desc=False)
+            .limit(self.batch_size)
+        )
+        if not result.data:
+            return []
+
+        claimed = await client.execute(
+            client.client.table('command_queue')
+            .update({'status': 'processing'})
+            .in_('id', [row['id'] for row in result.data])
+            .eq('status', 'pending')
+        )
+        return claimed.data or []
+
+    @staticmethod
+    def _from_record(record) -> Dict[str, Any]:
+        command = dict(record)
+        command['id'] = str(command['id'])
+        if isinstance(command.get('payload'), str):
+            command['payload'] = json.loads(command['payload'])
+        return command
+
+    # ------------------------------------------------------------------
+    # 実行（ギルド内は直列、ギルド間は並行）
+    # ------------------------------------------------------------------
+
+    def _dispatch(self, command: Dict[str, Any]):
+        payload = command.get('payload') or {}
+        guild_key = str(payload.get('guild_id') or '')
+
+        queue = self.guild_queues.setdefault(guild_key, deque())
+        queue.append(command)
+        if guild_key not in self.guild_workers:
+            self.guild_workers[guild_key] = asyncio.create_task(self._drain_guild(guild_key))
+
+    async def _drain_guild(self, guild_key: str):
+        queue = self.guild_queues[guild_key]
+        try:
+            while queue:
+                command = queue.popleft()
+                self._record_latency(command.get('created_at'))
+                ok = await self.supabase_client._process_command(command)
+                self.stats['completed' if ok else 'failed'] += 1
+        finally:
+            self.guild_workers.pop(guild_key, None)
+            if not queue:
+                self.guild_queues.pop(guild_key, None)
+
+    def _record_latency(self, created_at):
+        """作成から実行開始までの遅延を記録"""
+        try:
+            if isinstance(created_at, str):
+                created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+            if not isinstance(created_at, datetime):
+                return
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            latency_ms = (datetime.now(timezone.utc) - created_at).total_seconds() * 1000
+        except ValueError:
+            return
+        done = self.stats['completed'] + self.stats['failed'] + 1
+        self.stats['avg_latency_ms'] += (latency_ms - self.stats['avg_latency_ms']) / done
@@ -1,9 +1,16 @@
 import os
+import time
+import asyncio
 import logging
-from typing import List, Dict, Optional
-from datetime import datetime
+from typing import List, Dict, Optional, Set
+from datetime import datetime, timedelta
 from collections import deque
 import asyncpg
+from utils.unique_users import UniqueUserTracker
+from stats_rollup import StatsRollup, EMPTY_SUMMARY
+from analytics_engine import AnalyticsEngine
+from log_partitions import LogPartitionManager
+from db_indexes import ensure_indexes_pg, ensure_indexes_sqlite, check_query_plans_pg, check_query_plans_sqlite
 
 logger = logging.getLogger(__name__)
 
@@ -11,8 +18,30 @@ class Database:
     def __init__(self):
         self.database_url = os.getenv('DATABASE_URL')
         self.pool = None
+        self.sqlite = None  # SQLiteEngine (fallback mode)
         self.user_histories = {}
         
+        # チャットチャンネルのインメモリインデックス（write-through）
+        self.chat_channel_ids: Set[int] = set()
+        self._chat_channels_loaded = False
+        self._chat_channel_version = 0
+        
+        # ギルドごとの日次・時間別ユニークユーザー（COUNT(DISTINCT)の代わり）
+        self.unique_users = UniqueUserTracker()
+        self._unique_users_pruned_at = datetime.now()
+        
+        # 全体・ギルドごとの累計（/api/stats 用）
+        self.rollup = StatsRollup()
+        
+        # daily_stats / hourly_stats の時系列集計（/api/guilds/{id}/analytics 用）
+        self.analytics = AnalyticsEngine(self)
+        
+        # ログテーブルの月別パーティションと保持期間
+        self.partitions = LogPartitionManager(self)
+        
+        # get_chat_users が集計する期間（日数、0 は全期間）
+        self.chat_users_window_days = int(os.getenv('CHAT_USERS_WINDOW_DAYS', 90))
+        
     async def initialize(self):
         """Initialize database connection pool and tables"""
         if self.database_url:
@@ -21,6 +50,7 @@ class Database:
                 logger.info(f"🔌 Connecting to PostgreSQL database...")
                 self.pool = await asyncpg.create_pool(self.database_url, min_size=1, max_size=10)
                 await self._create_tables_pg()
+                self.partitions.start()
                 logger.info("✅ PostgreSQL database initialized successfully")
                 
                 # Test connection
@@ -31,16 +61,12 @@ class Database:
                 logger.error(f"❌ Failed to initialize PostgreSQL: {e}")
                 logger.warning("⚠️  Falling back to SQLite...")
                 self.pool = None
-                import aiosqlite
-                self.db_path = os.getenv('DATABASE_PATH', 'bot.db')
-                await self._create_tables_sqlite()
+                await self._init_sqlite()
                 logger.info("✅ SQLite database initialized (fallback)")
         else:
             logger.warning("⚠️  DATABASE_URL not set, using SQLite fallback")
             # Fallback to SQLite
-            import aiosqlite
-            self.db_path = os.getenv('DATABASE_PATH', 'bot.db')
-            await self._create_tables_sqlite()
+            await self._init_sqlite()
             logger.info("✅ SQLite database initialized")
     
     async def _create_tables_pg(self):
@@ -65,34 +91,8 @@ class Database:
                 )
             ''')
             
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS chat_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    guild_id BIGINT NOT NULL,
-                    channel_id BIGINT,
-                    user_message TEXT NOT NULL,
-                    ai_response TEXT NOT NULL,
-                    username TEXT,
-                    channel_name TEXT,
-                    guild_name TEXT,
-                    tokens_used REAL DEFAULT 0,
-                    ai_mode TEXT DEFAULT 'standard',
-                    response_time REAL DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS usage_logs (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT NOT NULL,
-                    guild_id BIGINT NOT NULL,
-                    tokens_used REAL NOT NULL,
-                    message_type TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            # ログテーブル（月別パーティション）
+            await self.partitions.ensure_tables(conn)
             
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS music_channels (
@@ -119,11 +119,6 @@ class Database:
                 )
             ''')
             
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_daily_stats_guild_date 
-                ON daily_stats(guild_id, date)
-            ''')
-            
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS hourly_stats (
                     id SERIAL PRIMARY KEY,
@@ -138,81 +133,127 @@ class Database:
                 )
             ''')
             
+            # AI response cache table
             await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_hourly_stats_guild_hour 
-                ON hourly_stats(guild_id, hour)
-            ''')
-            
-            # Playback history table
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS playback_history (
-                    id SERIAL PRIMARY KEY,
-                    guild_id BIGINT NOT NULL,
-                    track_title TEXT NOT NULL,
-                    track_author TEXT,
-                    track_artwork TEXT,
-                    track_uri TEXT,
-                    track_length INTEGER,
-                    requester_id BIGINT,
-                    requester_name TEXT,
-                    played_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    mode TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    expires_at DOUBLE PRECISION NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
             
-            await conn.execute('''
-                CREATE INDEX IF NOT EXISTS idx_playback_history_guild 
-                ON playback_history(guild_id, played_at DESC)
-            ''')
+            # Botのクエリ用インデックス（db_indexes.INDEXES）
+            await ensure_indexes_pg(conn)
+            
+            # 累計統計のロールアップ（初回は既存データから集計）
+            await self.rollup.create_tables(conn)
+    
+    async def _init_sqlite(self):
+        """Open the persistent SQLite engine and create tables"""
+        from sqlite_engine import SQLiteEngine
+        self.db_path = os.getenv('DATABASE_PATH', 'bot.db')
+        self.sqlite = SQLiteEngine(
+            self.db_path,
+            readers=int(os.getenv('SQLITE_READ_POOL_SIZE', 4))
+        )
+        await self.sqlite.start()
+        await self._create_tables_sqlite()
+    
+    async def close(self):
+        """Close database connections (flushes pending SQLite writes)"""
+        await self.partitions.close()
+        if self.sqlite:
+            await self.sqlite.close()
+            self.sqlite = None
+        if self.pool:
+            await self.pool.close()
+            self.pool = None
     
     async def _create_tables_sqlite(self):
         """Create SQLite tables (fallback)"""
-        import aiosqlite
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS chat_channels (
-                    id INTEGER PRIMARY KEY,
-                    guild_id INTEGER NOT NULL,
-                    channel_id INTEGER NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(guild_id, channel_id)
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS ai_modes (
-                    id INTEGER PRIMARY KEY,
-                    guild_id INTEGER NOT NULL UNIQUE,
-                    mode TEXT NOT NULL DEFAULT 'standard',
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS chat_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    guild_id INTEGER NOT NULL,
-                    channel_id INTEGER,
-                    user_message TEXT NOT NULL,
-                    ai_response TEXT NOT NULL,
-                    username TEXT,
-                    channel_name TEXT,
-                    guild_name TEXT,
-                    tokens_used REAL DEFAULT 0,
-                    ai_mode TEXT DEFAULT 'standard',
-                    response_time REAL DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            await db.execute('''
-                CREATE TABLE IF NOT EXISTS usage_logs (
-                    id INTEGER PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    guild_id INTEGER NOT NULL,
-                    tokens_used REAL NOT NULL,
-                    message_type TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            await db.commit()
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS chat_channels (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                channel_id INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(guild_id, channel_id)
+            )
+        ''')
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS ai_modes (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL UNIQUE,
+                mode TEXT NOT NULL DEFAULT 'standard',
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS chat_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                channel_id INTEGER,
+                user_message TEXT NOT NULL,
+                ai_response TEXT NOT NULL,
+                username TEXT,
+                channel_name TEXT,
+                guild_name TEXT,
+                tokens_used REAL DEFAULT 0,
+                ai_mode TEXT DEFAULT 'standard',
+                response_time REAL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS usage_logs (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                guild_id INTEGER NOT NULL,
+                tokens_used REAL NOT NULL,
+                message_type TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                cache_key TEXT PRIMARY KEY,
+                mode TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                message_count INTEGER DEFAULT 0,
+                user_count INTEGER DEFAULT 0,
+                token_count INTEGER DEFAULT 0,
+                music_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(guild_id, date)
+            )
+        ''')
+        await self.sqlite.execute('''
+            CREATE TABLE IF NOT EXISTS hourly_stats (
+                id INTEGER PRIMARY KEY,
+                guild_id INTEGER NOT NULL,
+                hour TEXT NOT NULL,
+                message_count INTEGER DEFAULT 0,
+                user_count INTEGER DEFAULT 0,
+                token_count INTEGER DEFAULT 0,
+                music_count INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(guild_id, hour)
+            )
+        ''')
+        await ensure_indexes_sqlite(self.sqlite)
+        await self.sqlite.optimize()
     
     async def _execute(self, query: str, *args):
         """Execute query with PostgreSQL or SQLite"""
@@ -220,10 +261,7 @@ class Database:
             async with self.pool.acquire() as conn:
                 return await conn.execute(query, *args)
         else:
-            import aiosqlite
-            async with aiosqlite.connect(self.db_path) as db:
-                await db.execute(query, args)
-                await db.commit()
+            return await self.sqlite.execute(query, args)
     
     async def _fetchone(self, query: str, *args):
         """Fetch one row"""
@@ -231,10 +269,7 @@ class Database:
             async with self.pool.acquire() as conn:
                 return await conn.fetchrow(query, *args)
         else:
-            import aiosqlite
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(query, args)
-                return await cursor.fetchone()
+            return await self.sqlite.fetchone(query, args)
     
     async def _fetchall(self, query: str, *args):
         """Fetch all rows"""
@@ -242,12 +277,30 @@ class Database:
             async with self.pool.acquire() as conn:
                 return await conn.fetch(query, *args)
         else:
-            import aiosqlite
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute(query, args)
-                return await cursor.fetchall()
+            return await self.sqlite.fetchall(query, args)
+    
+    async def load_chat_channels(self) -> int:
+        """chat_channelsテーブルからチャンネルインデックスを再構築"""
+        version = self._chat_channel_version
+        rows = await self._fetchall('SELECT channel_id FROM chat_channels')
+        if self.pool:
+            channel_ids = {row['channel_id'] for row in rows}
+        else:
+            channel_ids = {row[0] for row in rows}
+        
+        # 読み込み中に追加・削除があった場合はインデックスを上書きしない
+        if version != self._chat_channel_version:
+            logger.debug("Chat channel index changed during reload, skipping")
+            return len(self.chat_channel_ids)
+        
+        self.chat_channel_ids = channel_ids
+        self._chat_channels_loaded = True
+        return len(channel_ids)
     
     async def is_chat_channel(self, channel_id: int) -> bool:
+        if self._chat_channels_loaded:
+            return channel_id in self.chat_channel_ids
+        
         if self.pool:
             row = await self._fetchone('SELECT 1 FROM chat_channels WHERE channel_id = $1', channel_id)
         else:
@@ -266,6 +319,8 @@ class Database:
                     'INSERT OR IGNORE INTO chat_channels (guild_id, channel_id) VALUES (?, ?)',
                     guild_id, channel_id
                 )
+            self.chat_channel_ids.add(channel_id)
+            self._chat_channel_version += 1
             return True
         except Exception as e:
             logger.error(f'Error adding chat channel: {e}')
@@ -277,6 +332,8 @@ class Database:
                 await self._execute('DELETE FROM chat_channels WHERE guild_id = $1 AND channel_id = $2', guild_id, channel_id)
             else:
                 await self._execute('DELETE FROM chat_channels WHERE guild_id = ? AND channel_id = ?', guild_id, channel_id)
+            self.chat_channel_ids.discard(channel_id)
+            self._chat_channel_version += 1
             return True
         except Exception as e:
             logger.error(f'Error removing chat channel: {e}')
@@ -377,12 +434,15 @@ class Database:
             logger.info(f"💾 Saving chat log for {username} (user_id: {user_id})")
             
             if self.pool:
-                await self._execute('''
-                    INSERT INTO chat_logs (user_id, guild_id, channel_id, user_message, ai_response,
-                                          username, channel_name, guild_name, tokens_used, ai_mode, response_time)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
-                ''', user_id, guild_id, channel_id, user_message, ai_response,
-                     username, channel_name, guild_name, tokens_used, ai_mode, response_time)
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.execute('''
+                            INSERT INTO chat_logs (user_id, guild_id, channel_id, user_message, ai_response,
+                                                  username, channel_name, guild_name, tokens_used, ai_mode, response_time)
+                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+                        ''', user_id, guild_id, channel_id, user_message, ai_response,
+                             username, channel_name, guild_name, tokens_used, ai_mode, response_time)
+                        await self.rollup.record_chats(conn, [(guild_id, user_id, tokens_used)])
                 logger.info(f"✅ Chat log saved to PostgreSQL for {username}")
             else:
                 await self._execute('''
@@ -445,21 +505,27 @@ class Database:
             logger.error(f'Error getting chat logs: {e}')
             return []
     
-    async def get_chat_users(self) -> List[Dict]:
+    async def get_chat_users(self, days: Optional[int] = None) -> List[Dict]:
+        """直近 days 日（既定は CHAT_USERS_WINDOW_DAYS、0 は全期間）に発言したユーザー"""
+        days = self.chat_users_window_days if days is None else days
+        since = datetime.now() - timedelta(days=days) if days > 0 else None
         try:
             if self.pool:
-                rows = await self._fetchall('''
+                # 期間を絞ると古いパーティションは読まれない
+                where = 'WHERE created_at >= $1' if since else ''
+                rows = await self._fetchall(f'''
                     SELECT user_id, username, COUNT(*) as count, SUM(tokens_used) as tokens, MAX(created_at) as last
-                    FROM chat_logs GROUP BY user_id, username ORDER BY last DESC
-                ''')
+                    FROM chat_logs {where} GROUP BY user_id, username ORDER BY last DESC
+                ''', *([since] if since else []))
                 return [{'user_id': str(r['user_id']), 'username': r['username'], 
                         'message_count': r['count'], 'total_tokens': r['tokens'], 
                         'last_message': r['last'].isoformat() if r['last'] else None} for r in rows]
             else:
-                rows = await self._fetchall('''
+                where = 'WHERE created_at >= ?' if since else ''
+                rows = await self._fetchall(f'''
                     SELECT user_id, username, COUNT(*), SUM(tokens_used), MAX(created_at)
-                    FROM chat_logs GROUP BY user_id ORDER BY MAX(created_at) DESC
-                ''')
+                    FROM chat_logs {where} GROUP BY user_id ORDER BY MAX(created_at) DESC
+                ''', *([str(since)] if since else []))
                 return [{'user_id': str(r[0]), 'username': r[1], 'message_count': r[2],
                         'total_tokens': r[3], 'last_message': r[4]} for r in rows]
         except Exception as e:
@@ -523,6 +589,39 @@ class Database:
             'timestamp': datetime.now().isoformat()
         })
     
+    async def get_cached_response(self, cache_key: str):
+        """AI応答キャッシュを取得（期限切れは無視）。(response, expires_at) を返す"""
+        now = time.time()
+        if self.pool:
+            row = await self._fetchone('''
+                SELECT response, expires_at FROM response_cache
+                WHERE cache_key = $1 AND expires_at > $2
+            ''', cache_key, now)
+            return (row['response'], row['expires_at']) if row else None
+        else:
+            row = await self._fetchone('''
+                SELECT response, expires_at FROM response_cache
+                WHERE cache_key = ? AND expires_at > ?
+            ''', cache_key, now)
+            return (row[0], row[1]) if row else None
+    
+    async def save_cached_response(self, cache_key: str, mode: str, response: str, expires_at: float):
+        """AI応答キャッシュを保存し、期限切れの行を削除"""
+        if self.pool:
+            await self._execute('''
+                INSERT INTO response_cache (cache_key, mode, response, expires_at)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (cache_key)
+                DO UPDATE SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+            ''', cache_key, mode, response, expires_at)
+            await self._execute('DELETE FROM response_cache WHERE expires_at <= $1', time.time())
+        else:
+            await self._execute('''
+                INSERT OR REPLACE INTO response_cache (cache_key, mode, response, expires_at)
+                VALUES (?, ?, ?, ?)
+            ''', cache_key, mode, response, expires_at)
+            await self._execute('DELETE FROM response_cache WHERE expires_at <= ?', time.time())
+    
     async def save_music_channel(self, guild_id: int, channel_id: int, creator_id: int) -> bool:
         try:
             if self.pool:
@@ -550,6 +649,71 @@ class Database:
             logger.error(f'Error removing music channel: {e}')
             return False
     
+    async def _observe_unique_users(self, conn, observations: List[tuple]):
+        """(guild_id, user_id, created_at) をユニークユーザーカウンタに反映し、更新後の件数を返す"""
+        daily_counts: Dict[tuple, int] = {}
+        hourly_counts: Dict[tuple, int] = {}
+
+        for guild_id, user_id, created_at in observations:
+            day = created_at.date()
+            hour = created_at.replace(minute=0, second=0, microsecond=0)
+            day_start = datetime.combine(day, datetime.min.time())
+
+            for key, start, end in (
+                ((guild_id, 'day', day), day_start, day_start + timedelta(days=1)),
+                ((guild_id, 'hour', hour), hour, hour + timedelta(hours=1)),
+            ):
+                if not self.unique_users.has_bucket(key):
+                    # 再起動後の初回のみ、その期間の既存ユーザーを読み込む
+                    rows = await conn.fetch('''
+                        SELECT DISTINCT user_id FROM chat_logs
+                        WHERE guild_id = $1 AND created_at >= $2 AND created_at < $3
+                    ''', guild_id, start, end)
+                    self.unique_users.seed(key, [row['user_id'] for row in rows])
+                self.unique_users.add(key, user_id)
+
+            daily_counts[(guild_id, day)] = self.unique_users.count((guild_id, 'day', day))
+            hourly_counts[(guild_id, hour)] = self.unique_users.count((guild_id, 'hour', hour))
+
+        self._prune_unique_users()
+        return daily_counts, hourly_counts
+
+    async def _upsert_unique_user_counts(self, conn, daily_counts: Dict[tuple, int], hourly_counts: Dict[tuple, int]):
+        """ユニークユーザー数を daily_stats / hourly_stats に書き込む"""
+        if daily_counts:
+            await conn.executemany('''
+                INSERT INTO daily_stats (guild_id, date, user_count)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id, date)
+                DO UPDATE SET user_count = GREATEST(daily_stats.user_count, EXCLUDED.user_count)
+            ''', [(guild_id, day, count) for (guild_id, day), count in daily_counts.items()])
+
+        if hourly_counts:
+            await conn.executemany('''
+                INSERT INTO hourly_stats (guild_id, hour, user_count)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id, hour)
+                DO UPDATE SET user_count = GREATEST(hourly_stats.user_count, EXCLUDED.user_count)
+            ''', [(guild_id, hour, count) for (guild_id, hour), count in hourly_counts.items()])
+
+    def _prune_unique_users(self):
+        """前日・2時間前より古いバケットを破棄（1分に1回）"""
+        now = datetime.now()
+        if now - self._unique_users_pruned_at < timedelta(minutes=1):
+            return
+        self._unique_users_pruned_at = now
+
+        oldest_day = (now - timedelta(days=1)).date()
+        oldest_hour = (now - timedelta(hours=2)).replace(minute=0, second=0, microsecond=0)
+
+        def keep(key):
+            _, kind, bucket = key
+            return bucket >= oldest_day if kind == 'day' else bucket >= oldest_hour
+
+        removed = self.unique_users.prune(keep)
+        if removed:
+            logger.debug(f"Pruned {removed} unique user buckets")
+
     async def increment_daily_stat(self, guild_id: int, stat_type: str, user_id: Optional[int] = None):
         """日次統計をインクリメント"""
         try:
@@ -557,202 +721,170 @@ class Database:
             
             if self.pool:
                 if stat_type == 'user_count' and user_id:
-                    # ユーザー数は重複カウントしない
-                    row = await self._fetchone('''
-                        SELECT user_count FROM daily_stats 
-                        WHERE guild_id = $1 AND date = $2
-                    ''', guild_id, today)
-                    
-                    # 今日のユニークユーザー数を取得
-                    unique_users = await self._fetchone('''
-                        SELECT COUNT(DISTINCT user_id) as count
-                        FROM chat_logs
-                        WHERE guild_id = $1 AND DATE(created_at) = $2
-                    ''', guild_id, today)
-                    
-                    user_count = unique_users['count'] if unique_users else 0
-                    
-                    await self._execute(f'''
-                        INSERT INTO daily_stats (guild_id, date, user_count)
-                        VALUES ($1, $2, $3)
-                        ON CONFLICT (guild_id, date)
-                        DO UPDATE SET user_count = $3
-                    ''', guild_id, today, user_count)
-                else:
-                    await self._execute(f'''
-                        INSERT INTO daily_stats (guild_id, date, {stat_type})
-                        VALUES ($1, $2, 1)
-                        ON CONFLICT (guild_id, date)
-                        DO UPDATE SET {stat_type} = daily_stats.{stat_type} + 1
-                    ''', guild_id, today)
+                    # ユーザー数は重複カウントしない（メモリ上のカウンタで集計）
+                    async with self.pool.acquire() as conn:
+                        daily_counts, hourly_counts = await self._observe_unique_users(
+                            conn, [(guild_id, user_id, datetime.now())]
+                        )
+                        await self._upsert_unique_user_counts(conn, daily_counts, hourly_counts)
+                    return
+                await self._execute(f'''
+                    INSERT INTO daily_stats (guild_id, date, {stat_type})
+                    VALUES ($1, $2, 1)
+                    ON CONFLICT (guild_id, date)
+                    DO UPDATE SET {stat_type} = daily_stats.{stat_type} + 1
+                ''', guild_id, today)
                 
                 # 時間別統計も更新
                 current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
-                if stat_type == 'user_count' and user_id:
-                    unique_users_hour = await self._fetchone('''
-                        SELECT COUNT(DISTINCT user_id) as count
-                        FROM chat_logs
-                        WHERE guild_id = $1 AND created_at >= $2
-                    ''', guild_id, current_hour)
-                    
-                    user_count_hour = unique_users_hour['count'] if unique_users_hour else 0
-                    
-                    await self._execute(f'''
-                        INSERT INTO hourly_stats (guild_id, hour, user_count)
-                        VALUES ($1, $2, $3)
-                        ON CONFLICT (guild_id, hour)
-                        DO UPDATE SET user_count = $3
-                    ''', guild_id, current_hour, user_count_hour)
-                else:
-                    await self._execute(f'''
-                        INSERT INTO hourly_stats (guild_id, hour, {stat_type})
-                        VALUES ($1, $2, 1)
-                        ON CONFLICT (guild_id, hour)
-                        DO UPDATE SET {stat_type} = hourly_stats.{stat_type} + 1
-                    ''', guild_id, current_hour)
+                await self._execute(f'''
+                    INSERT INTO hourly_stats (guild_id, hour, {stat_type})
+                    VALUES ($1, $2, 1)
+                    ON CONFLICT (guild_id, hour)
+                    DO UPDATE SET {stat_type} = hourly_stats.{stat_type} + 1
+                ''', guild_id, current_hour)
+            elif stat_type != 'user_count':
+                # SQLiteでは日付を文字列で保存（ユニークユーザー数は集計しない）
+                current_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+                await self._execute(f'''
+                    INSERT INTO daily_stats (guild_id, date, {stat_type})
+                    VALUES (?, ?, 1)
+                    ON CONFLICT (guild_id, date)
+                    DO UPDATE SET {stat_type} = daily_stats.{stat_type} + 1
+                ''', guild_id, str(today))
+                await self._execute(f'''
+                    INSERT INTO hourly_stats (guild_id, hour, {stat_type})
+                    VALUES (?, ?, 1)
+                    ON CONFLICT (guild_id, hour)
+                    DO UPDATE SET {stat_type} = hourly_stats.{stat_type} + 1
+                ''', guild_id, str(current_hour))
         except Exception as e:
             logger.error(f'Error incrementing daily stat: {e}')
     
-    async def get_analytics_data(self, guild_id: int, period: str = "week"):
-        """分析データを取得"""
+    async def save_interactions(self, records: List[Dict]):
+        """AI応答レコードをまとめて保存（chat_logs / usage_logs / 統計を1トランザクションで）"""
+        if not records:
+            return
+
+        chat_rows = [(
+            r['user_id'], r['guild_id'], r['channel_id'], r['user_message'], r['ai_response'],
+            r['username'], r['channel_name'], r['guild_name'], r['tokens_used'],
+            r['ai_mode'], r['response_time'], r['created_at']
+        ) for r in records]
+        usage_rows = [(
+            r['user_id'], r['guild_id'], r['tokens_used'], r.get('message_type', 'auto_response'), r['created_at']
+        ) for r in records]
+
+        # 日次・時間別のメッセージ数をまとめて集計
+        daily: Dict[tuple, int] = {}
+        hourly: Dict[tuple, int] = {}
+        for r in records:
+            day = r['created_at'].date()
+            hour = r['created_at'].replace(minute=0, second=0, microsecond=0)
+            daily[(r['guild_id'], day)] = daily.get((r['guild_id'], day), 0) + 1
+            hourly[(r['guild_id'], hour)] = hourly.get((r['guild_id'], hour), 0) + 1
+
+        if not self.pool:
+            await asyncio.gather(*[self._execute('''
+                INSERT INTO chat_logs (user_id, guild_id, channel_id, user_message, ai_response,
+                                      username, channel_name, guild_name, tokens_used, ai_mode, response_time, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', *row) for row in chat_rows])
+            await asyncio.gather(*[self._execute('''
+                INSERT INTO usage_logs (user_id, guild_id, tokens_used, message_type, created_at) VALUES (?, ?, ?, ?, ?)
+            ''', *row) for row in usage_rows])
+            await asyncio.gather(*[self._execute('''
+                INSERT INTO daily_stats (guild_id, date, message_count, token_count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (guild_id, date)
+                DO UPDATE SET message_count = daily_stats.message_count + excluded.message_count,
+                              token_count = daily_stats.token_count + excluded.token_count
+            ''', guild_id, str(day), count, count) for (guild_id, day), count in daily.items()])
+            await asyncio.gather(*[self._execute('''
+                INSERT INTO hourly_stats (guild_id, hour, message_count, token_count)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (guild_id, hour)
+                DO UPDATE SET message_count = hourly_stats.message_count + excluded.message_count,
+                              token_count = hourly_stats.token_count + excluded.token_count
+            ''', guild_id, str(hour), count, count) for (guild_id, hour), count in hourly.items()])
+            return
+
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.executemany('''
+                    INSERT INTO chat_logs (user_id, guild_id, channel_id, user_message, ai_response,
+                                          username, channel_name, guild_name, tokens_used, ai_mode, response_time, created_at)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+                ''', chat_rows)
+
+                await conn.executemany('''
+                    INSERT INTO usage_logs (user_id, guild_id, tokens_used, message_type, created_at)
+                    VALUES ($1, $2, $3, $4, $5)
+                ''', usage_rows)
+
+                # message_count / token_count は従来通り1メッセージにつき+1
+                await conn.executemany('''
+                    INSERT INTO daily_stats (guild_id, date, message_count, token_count)
+                    VALUES ($1, $2, $3, $3)
+                    ON CONFLICT (guild_id, date)
+                    DO UPDATE SET message_count = daily_stats.message_count + EXCLUDED.message_count,
+                                  token_count = daily_stats.token_count + EXCLUDED.token_count
+                ''', [(guild_id, day, count) for (guild_id, day), count in daily.items()])
+
+                await conn.executemany('''
+                    INSERT INTO hourly_stats (guild_id, hour, message_count, token_count)
+                    VALUES ($1, $2, $3, $3)
+                    ON CONFLICT (guild_id, hour)
+                    DO UPDATE SET message_count = hourly_stats.message_count + EXCLUDED.message_count,
+                                  token_count = hourly_stats.token_count + EXCLUDED.token_count
+                ''', [(guild_id, hour, count) for (guild_id, hour), count in hourly.items()])
+
+                # ユニークユーザー数はメモリ上のカウンタから反映
+                daily_counts, hourly_counts = await self._observe_unique_users(
+                    conn, [(r['guild_id'], r['user_id'], r['created_at']) for r in records]
+                )
+                await self._upsert_unique_user_counts(conn, daily_counts, hourly_counts)
+
+                await self.rollup.record_chats(
+                    conn, [(r['guild_id'], r['user_id'], r['tokens_used']) for r in records]
+                )
+
+        logger.info(f"✅ Saved {len(records)} interactions to PostgreSQL")
+
+    async def get_analytics_data(self, guild_id: int, period: str = "week", bucket: str = None,
+                                 max_points: int = None):
+        """分析データを取得（period: day / week / month / all、bucket: hour / day / week / month）"""
         try:
-            if self.pool:
-                if period == "day":
-                    # 過去24時間
-                    rows = await self._fetchall('''
-                        SELECT 
-                            TO_CHAR(hour, 'HH24:MI') as time,
-                            message_count,
-                            user_count,
-                            token_count,
-                            music_count
-                        FROM hourly_stats
-                        WHERE guild_id = $1 AND hour >= NOW() - INTERVAL '24 hours'
-                        ORDER BY hour
-                    ''', guild_id)
-                    return [{
-                        'date': r['time'],
-                        'message_count': r['message_count'],
-                        'user_count': r['user_count'],
-                        'token_count': r['token_count'],
-                        'music_count': r['music_count']
-                    } for r in rows]
-                elif period == "week":
-                    # 過去7日
-                    rows = await self._fetchall('''
-                        SELECT 
-                            TO_CHAR(date, 'MM/DD') as date,
-                            message_count,
-                            user_count,
-                            token_count,
-                            music_count
-                        FROM daily_stats
-                        WHERE guild_id = $1 AND date >= CURRENT_DATE - INTERVAL '7 days'
-                        ORDER BY date
-                    ''', guild_id)
-                    return [{
-                        'date': r['date'],
-                        'message_count': r['message_count'],
-                        'user_count': r['user_count'],
-                        'token_count': r['token_count'],
-                        'music_count': r['music_count']
-                    } for r in rows]
-                elif period == "month":
-                    # 過去30日
-                    rows = await self._fetchall('''
-                        SELECT 
-                            TO_CHAR(date, 'MM/DD') as date,
-                            message_count,
-                            user_count,
-                            token_count,
-                            music_count
-                        FROM daily_stats
-                        WHERE guild_id = $1 AND date >= CURRENT_DATE - INTERVAL '30 days'
-                        ORDER BY date
-                    ''', guild_id)
-                    return [{
-                        'date': r['date'],
-                        'message_count': r['message_count'],
-                        'user_count': r['user_count'],
-                        'token_count': r['token_count'],
-                        'music_count': r['music_count']
-                    } for r in rows]
-                else:  # all
-                    # 全期間
-                    rows = await self._fetchall('''
-                        SELECT 
-                            TO_CHAR(date, 'YYYY/MM/DD') as date,
-                            message_count,
-                            user_count,
-                            token_count,
-                            music_count
-                        FROM daily_stats
-                        WHERE guild_id = $1
-                        ORDER BY date
-                    ''', guild_id)
-                    return [{
-                        'date': r['date'],
-                        'message_count': r['message_count'],
-                        'user_count': r['user_count'],
-                        'token_count': r['token_count'],
-                        'music_count': r['music_count']
-                    } for r in rows]
-            else:
-                # SQLite fallback - simplified
-                return []
+            return await self.analytics.get_period(guild_id, period, bucket, max_points)
+        except ValueError:
+            raise
         except Exception as e:
             logger.error(f'Error getting analytics data: {e}')
             return []
     
     async def get_guild_summary(self, guild_id: int):
-        """サーバーの統計サマリーを取得"""
+        """サーバーの統計サマリーを取得（ロールアップの1行を読むだけ）"""
+        empty = {
+            'total_messages': 0,
+            'total_users': 0,
+            'total_tokens': 0,
+            'total_music': 0
+        }
         try:
             if self.pool:
-                # 総メッセージ数
-                total_messages = await self._fetchone('''
-                    SELECT COALESCE(SUM(message_count), 0) as total
-                    FROM daily_stats WHERE guild_id = $1
-                ''', guild_id)
-                
-                # 総ユーザー数（ユニーク）
-                total_users = await self._fetchone('''
-                    SELECT COUNT(DISTINCT user_id) as total
-                    FROM chat_logs WHERE guild_id = $1
-                ''', guild_id)
-                
-                # 総トークン数
-                total_tokens = await self._fetchone('''
-                    SELECT COALESCE(SUM(token_count), 0) as total
-                    FROM daily_stats WHERE guild_id = $1
-                ''', guild_id)
-                
-                # 総音楽再生回数
-                total_music = await self._fetchone('''
-                    SELECT COALESCE(SUM(music_count), 0) as total
-                    FROM daily_stats WHERE guild_id = $1
-                ''', guild_id)
-                
+                async with self.pool.acquire() as conn:
+                    summary = await self.rollup.fetch(conn, guild_id)
                 return {
-                    'total_messages': total_messages['total'] if total_messages else 0,
-                    'total_users': total_users['total'] if total_users else 0,
-                    'total_tokens': total_tokens['total'] if total_tokens else 0,
-                    'total_music': total_music['total'] if total_music else 0
+                    'total_messages': summary['total_messages'],
+                    'total_users': summary['unique_users'],
+                    'total_tokens': summary['total_tokens'],
+                    'total_music': summary['total_music']
                 }
             else:
-                return {
-                    'total_messages': 0,
-                    'total_users': 0,
-                    'total_tokens': 0,
-                    'total_music': 0
-                }
+                return empty
         except Exception as e:
             logger.error(f'Error getting guild summary: {e}')
-            return {
-                'total_messages': 0,
-                'total_users': 0,
-                'total_tokens': 0,
-                'total_music': 0
-            }
+            return empty
     
     async def save_playback_history(self, guild_id: int, track_title: str, track_author: str = None,
                                    track_artwork: str = None, track_uri: str = None, track_length: int = 0,
@@ -760,11 +892,14 @@ class Database:
         """再生履歴を保存"""
         try:
             if self.pool:
-                await self._execute('''
-                    INSERT INTO playback_history 
-                    (guild_id, track_title, track_author, track_artwork, track_uri, track_length, requester_id, requester_name)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-                ''', guild_id, track_title, track_author, track_artwork, track_uri, track_length, requester_id, requester_name)
+                async with self.pool.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.execute('''
+                            INSERT INTO playback_history 
+                            (guild_id, track_title, track_author, track_artwork, track_uri, track_length, requester_id, requester_name)
+                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+                        ''', guild_id, track_title, track_author, track_artwork, track_uri, track_length, requester_id, requester_name)
+                        await self.rollup.record_playback(conn, guild_id)
                 logger.info(f"✅ Saved playback history: {track_title}")
         except Exception as e:
             logger.error(f'Error saving playback history: {e}')
@@ -810,48 +945,26 @@ class Database:
             return []
     
     async def get_global_stats(self):
-        """グローバル統計を取得"""
+        """グローバル統計を取得（ロールアップのギルド行の合計を読むだけ）"""
         try:
             if self.pool:
-                # 総メッセージ数
-                total_messages = await self._fetchone('''
-                    SELECT COUNT(*) as total FROM chat_logs
-                ''')
-                
-                # ユニークユーザー数
-                unique_users = await self._fetchone('''
-                    SELECT COUNT(DISTINCT user_id) as total FROM chat_logs
-                ''')
-                
-                # 総トークン数
-                total_tokens = await self._fetchone('''
-                    SELECT COALESCE(SUM(tokens_used), 0) as total FROM chat_logs
-                ''')
-                
-                # 総音楽再生回数
-                total_music = await self._fetchone('''
-                    SELECT COUNT(*) as total FROM playback_history
-                ''')
-                
-                return {
-                    'total_messages': total_messages['total'] if total_messages else 0,
-                    'unique_users': unique_users['total'] if unique_users else 0,
-                    'total_tokens': int(total_tokens['total']) if total_tokens else 0,
-                    'total_music': total_music['total'] if total_music else 0
-                }
+                async with self.pool.acquire() as conn:
+                    return await self.rollup.fetch(conn)
             else:
-                return {
-                    'total_messages': 0,
-                    'unique_users': 0,
-                    'total_tokens': 0,
-                    'total_music': 0
-                }
+                return dict(EMPTY_SUMMARY)
         except Exception as e:
             logger.error(f'Error getting global stats: {e}')
-            return {
-                'total_messages': 0,
-                'unique_users': 0,
-                'total_tokens': 0,
-                'total_music': 0
-            }
-
+            return dict(EMPTY_SUMMARY)
+    
+    async def check_query_plans(self, min_rows: int = None) -> List[Dict]:
+        """登録クエリ（db_indexes.REGISTERED_QUERIES）がインデックスを使えるか EXPLAIN で確認"""
+        if self.pool:
+            async with self.pool.acquire() as conn:
+                results = await check_query_plans_pg(conn, min_rows)
+        else:
+            results = await check_query_plans_sqlite(self.sqlite, min_rows)
+        
+        failed = [r['query'] for r in results if not r['ok']]
+        if failed:
+            logger.warning(f"⚠️ Queries without a usable index: {', '.join(failed)}")
+        return results
@@ -0,0 +1,248 @@
+"""Botが発行するクエリ用のインデックス定義と、EXPLAINによるインデックス利用チェック"""
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+# SQLiteフォールバックにも存在するテーブル
+SQLITE_TABLES = {'chat_channels', 'ai_modes', 'chat_logs', 'usage_logs', 'response_cache',
+                 'daily_stats', 'hourly_stats'}
+
+# インデックス名 -> (テーブル, 列)。起動時に CREATE INDEX IF NOT EXISTS で作成する
+# （パーティションテーブルでは親に作成すると全パーティションに伝播する）
+INDEXES = {
+    # get_user_history_from_db / get_user_chat_history（ユーザーごとの最新・最古N件）
+    'idx_chat_logs_user_created': ('chat_logs', 'user_id, created_at DESC'),
+    # get_chat_logs(guild_id) / _observe_unique_users（ギルド + 期間）
+    'idx_chat_logs_guild_created': ('chat_logs', 'guild_id, created_at DESC'),
+    # get_chat_logs() / get_chat_users（全体の最新N件・期間指定）
+    'idx_chat_logs_created_at': ('chat_logs', 'created_at DESC'),
+    # get_usage_stats(guild_id)（集計に必要な列を含め、ヒープを読まずに済ませる）
+    'idx_usage_logs_guild': ('usage_logs', 'guild_id, user_id, tokens_used'),
+    'idx_usage_logs_created_at': ('usage_logs', 'created_at DESC'),
+    # is_chat_channel（UNIQUE(guild_id, channel_id) は channel_id 単独の検索に使えない）
+    'idx_chat_channels_channel': ('chat_channels', 'channel_id'),
+    # remove_music_channel
+    'idx_music_channels_guild': ('music_channels', 'guild_id'),
+    'idx_daily_stats_guild_date': ('daily_stats', 'guild_id, date'),
+    'idx_hourly_stats_guild_hour': ('hourly_stats', 'guild_id, hour'),
+    # get_playback_history(guild_id) / get_playback_history()
+    'idx_playback_history_guild': ('playback_history', 'guild_id, played_at DESC'),
+    'idx_playback_history_played_at': ('playback_history', 'played_at DESC'),
+    # save_cached_response の期限切れ削除
+    'idx_response_cache_expires': ('response_cache', 'expires_at'),
+}
+
+
+def _since(days: int) -> datetime:
+    return datetime.now() - timedelta(days=days)
+
+
+# クエリ名 -> (SQL, サンプル引数の生成関数)
+# database_pg.py / stats_rollup.py のホットパスと同じ形のクエリを登録する。
+# 全件集計（期間指定なしの get_usage_stats / get_chat_users、load_chat_channels）は
+# もともと全件を読むクエリなので対象外。
+REGISTERED_QUERIES = {
+    'is_chat_channel': (
+        'SELECT 1 FROM chat_channels WHERE channel_id = $1',
+        lambda: (0,)
+    ),
+    'get_chat_channels': (
+        'SELECT channel_id FROM chat_channels WHERE guild_id = $1',
+        lambda: (0,)
+    ),
+    'remove_chat_channel': (
+        'DELETE FROM chat_channels WHERE guild_id = $1 AND channel_id = $2',
+        lambda: (0, 0)
+    ),
+    'get_ai_mode': (
+        'SELECT mode FROM ai_modes WHERE guild_id = $1',
+        lambda: (0,)
+    ),
+    'get_usage_stats': (
+        '''SELECT COUNT(*), SUM(tokens_used), AVG(tokens_used), COUNT(DISTINCT user_id)
+           FROM usage_logs WHERE guild_id = $1''',
+        lambda: (0,)
+    ),
+    'get_chat_logs_guild': (
+        'SELECT id, user_message, ai_response FROM chat_logs WHERE guild_id = $1 ORDER BY created_at DESC LIMIT $2',
+        lambda: (0, 50)
+    ),
+    'get_chat_logs': (
+        'SELECT id, user_message, ai_response FROM chat_logs ORDER BY created_at DESC LIMIT $1',
+        lambda: (50,)
+    ),
+    'get_chat_users': (
+        '''SELECT user_id, username, COUNT(*), SUM(tokens_used), MAX(created_at)
+           FROM chat_logs WHERE created_at >= $1 GROUP BY user_id, username''',
+        lambda: (_since(1),)
+    ),
+    'get_user_chat_history': (
+        'SELECT id, user_message, ai_response FROM chat_logs WHERE user_id = $1 ORDER BY created_at ASC LIMIT $2',
+        lambda: (0, 100)
+    ),
+    'get_user_history_from_db': (
+        'SELECT user_message, ai_response, created_at FROM chat_logs WHERE user_id = $1 ORDER BY created_at DESC LIMIT $2',
+        lambda: (0, 5)
+    ),
+    'observe_unique_users': (
+        'SELECT DISTINCT user_id FROM chat_logs WHERE guild_id = $1 AND created_at >= $2 AND created_at < $3',
+        lambda: (0, _since(1), datetime.now())
+    ),
+    'get_cached_response': (
+        'SELECT response, expires_at FROM response_cache WHERE cache_key = $1 AND expires_at > $2',
+        lambda: ('', time.time())
+    ),
+    'expire_cached_responses': (
+        'DELETE FROM response_cache WHERE expires_at <= $1',
+        lambda: (time.time() - 86400,)
+    ),
+    'remove_music_channel': (
+        'DELETE FROM music_channels WHERE guild_id = $1',
+        lambda: (0,)
+    ),
+    'analytics_daily': (
+        'SELECT date, message_count FROM daily_stats WHERE guild_id = $1 AND date >= $2 AND date < $3 ORDER BY date',
+        lambda: (0, _since(7).date(), datetime.now().date())
+    ),
+    'analytics_hourly': (
+        'SELECT hour, message_count FROM hourly_stats WHERE guild_id = $1 AND hour >= $2 AND hour < $3 ORDER BY hour',
+        lambda: (0, _since(1), datetime.now())
+    ),
+    'get_playback_history_guild': (
+        'SELECT id, track_title FROM playback_history WHERE guild_id = $1 ORDER BY played_at DESC LIMIT $2',
+        lambda: (0, 10)
+    ),
+    'get_playback_history': (
+        'SELECT id, track_title FROM playback_history ORDER BY played_at DESC LIMIT $1',
+        lambda: (10,)
+    ),
+    'stats_rollup': (
+        'SELECT total_messages, total_tokens, unique_users, total_music FROM stats_rollup WHERE scope_id = $1',
+        lambda: (0,)
+    ),
+}
+
+TABLE_RE = re.compile(r'\b(?:FROM|UPDATE|INTO)\s+(\w+)', re.IGNORECASE)
+PLACEHOLDER_RE = re.compile(r'\$\d+')
+
+
+def query_tables(sql: str) -> set:
+    return set(TABLE_RE.findall(sql))
+
+
+async def ensure_indexes_pg(conn):
+    """INDEXES をすべて作成（既にあるものはそのまま）"""
+    for name, (table, columns) in INDEXES.items():
+        await conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+
+
+async def ensure_indexes_sqlite(engine):
+    for name, (table, columns) in INDEXES.items():
+        if table in SQLITE_TABLES:
+            await engine.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table}({columns})')
+
+
+def _full_scans(plan: Dict, limited: bool = False) -> List[str]:
+    """プラン木から全件走査しているリレーション名を集める
+
+    Seq Scan に加え、Index Cond のない Index Scan / Index Only Scan もインデックス全体を
+    読むため対象にする。ただし Limit の下にあるものは並び順どおりに読んで途中で止まるため除外する。
+    """
+    found = []
+    node = plan.get('Node Type')
+    if node == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    elif node in ('Index Scan', 'Index Only Scan') and 'Index Cond' not in plan and not limited:
+        found.append(plan.get('Relation Name'))
+    limited = limited or node == 'Limit'
+    for child in plan.get('Plans', []):
+        found.extend(_full_scans(child, limited))
+    return found
+
+
+async def check_query_plans_pg(conn, min_rows: int = None) -> List[Dict]:
+    """登録クエリを EXPLAIN し、インデックスで処理できないクエリを報告する
+
+    通常の設定で計画させ、全件走査（Seq Scan、条件なしの Index Scan）になるリレーションのうち
+    推定行数（reltuples と n_live_tup の大きい方）が min_rows 以上のものを報告する。
+    小さいテーブルではプランナーが正しく Seq Scan を選ぶため問題にしない。
+    """
+    if min_rows is None:
+        min_rows = int(os.getenv('INDEX_CHECK_MIN_ROWS', 10000))
+
+    results = []
+    sizes: Dict[str, float] = {}
+    for name, (sql, make_args) in REGISTERED_QUERIES.items():
+        try:
+            raw = await conn.fetchval(f'EXPLAIN (FORMAT JSON) {sql}', *make_args())
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+        except Exception as e:
+            results.append({'query': name, 'ok': False, 'seq_scans': [], 'error': str(e)})
+            continue
+
+        scans = sorted(set(_full_scans(plan)))
+        missing = [s for s in scans if s not in sizes]
+        if missing:
+            rows = await conn.fetch('''
+                SELECT c.relname, GREATEST(c.reltuples, COALESCE(s.n_live_tup, 0)) AS estimate
+                FROM pg_class c
+                LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+                WHERE c.relname = ANY($1::text[])
+            ''', missing)
+            sizes.update({r['relname']: r['estimate'] for r in rows})
+        scans = [s for s in scans if sizes.get(s, 0) >= min_rows]
+
+        results.append({
+            'query': name,
+            'ok': not scans,
+            'seq_scans': scans,
+            'cost': plan.get('Total Cost')
+        })
+    return results
+
+
+async def check_query_plans_sqlite(engine, min_rows: int = None) -> List[Dict]:
+    """SQLite版：EXPLAIN QUERY PLAN でインデックスを使わない SCAN を報告する
+
+    SQLiteのプランナーは統計（ANALYZE）がないとインデックスより並び順を優先することがあるため、
+    先に統計を更新し、行数が max(min_rows, 1) 未満のテーブルの SCAN は問題にしない。
+    """
+    if min_rows is None:
+        min_rows = int(os.getenv('INDEX_CHECK_MIN_ROWS', 0))
+
+    # 起動後に増えたテーブルの統計を更新してから計画させる
+    await engine.optimize()
+
+    results = []
+    sizes: Dict[str, int] = {}
+    for name, (sql, make_args) in REGISTERED_QUERIES.items():
+        if not query_tables(sql) <= SQLITE_TABLES:
+            continue
+        try:
+            rows = await engine.fetchall('EXPLAIN QUERY PLAN ' + PLACEHOLDER_RE.sub('?', sql), make_args())
+        except Exception as e:
+            results.append({'query': name, 'ok': False, 'seq_scans': [], 'error': str(e)})
+            continue
+
+        # detail の例: "SEARCH chat_logs USING INDEX idx_... (user_id=?)" / "SCAN chat_logs"
+        # （古いSQLiteでは "SCAN TABLE chat_logs"）
+        # SCAN はインデックス経由でも全件走査。LIMIT 付きで順序どおりに読む場合だけ許容する
+        ordered_limit = 'LIMIT' in sql.upper()
+        scans = sorted({
+            row[3].replace('SCAN TABLE ', 'SCAN ').split()[1] for row in rows
+            if row[3].startswith('SCAN') and not (ordered_limit and 'USING' in row[3])
+        })
+        for table in scans:
+            if table not in sizes:
+                count = await engine.fetchone(f'SELECT COUNT(*) FROM {table}')
+                sizes[table] = count[0] if count else 0
+        scans = [table for table in scans if sizes[table] >= max(min_rows, 1)]
+
+        results.append({'query': name, 'ok': not scans, 'seq_scans': scans})
+    return results
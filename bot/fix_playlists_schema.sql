@@ -32,6 +32,7 @@ CREATE TABLE playlist_tracks (
     added_by TEXT NOT NULL,
     added_by_id TEXT NOT NULL,
     position INTEGER DEFAULT 0,
+    encoded_track TEXT,  -- Lavalinkのエンコード済みトラック（再生時の検索を省略）
     created_at TIMESTAMPTZ DEFAULT NOW()
 );
 
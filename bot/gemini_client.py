@@ -1,10 +1,139 @@
 import os
+import re
+import time
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Optional
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Dict, Optional, Tuple
 import google.generativeai as genai
 
 logger = logging.getLogger(__name__)
 
+HISTORY_WINDOW = 5  # number of past exchanges sent to the model (and hashed into cache keys)
+
+
+class ResponseCache:
+    """LRU + TTL cache for model responses with a memory budget.
+
+    Keys are built from (mode, normalized prompt, hash of the history window),
+    so the same question asked in the same context is answered without a network call.
+    Optionally backed by the bot database so entries survive restarts.
+    """
+
+    _WHITESPACE_RE = re.compile(r'\s+')
+    _TRAILING_PUNCT = ' !?.,~…。、〜'
+
+    def __init__(self, max_entries: int = 2000, ttl: float = 3600, max_bytes: int = 8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Tuple[str, float, int]]" = OrderedDict()  # key -> (response, expires_at, size)
+        self.total_bytes = 0
+        self.store = None  # Database with get_cached_response / save_cached_response
+        self._pending_writes = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.store_hits = 0
+        self.evictions = 0
+
+    def attach_store(self, database):
+        """Persist entries to the bot database"""
+        self.store = database
+        logger.info("✅ Response cache persistence enabled")
+
+    @classmethod
+    def normalize(cls, prompt: str) -> str:
+        text = unicodedata.normalize('NFKC', prompt).lower()
+        text = cls._WHITESPACE_RE.sub(' ', text)
+        return text.strip().rstrip(cls._TRAILING_PUNCT)
+
+    def make_key(self, mode: str, prompt: str, history: Optional[List[Dict]] = None) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(mode.encode())
+        digest.update(b'\x00')
+        digest.update(self.normalize(prompt).encode())
+        for h in (history or [])[-HISTORY_WINDOW:]:
+            digest.update(b'\x00')
+            digest.update(h.get('user_message', '').encode())
+            digest.update(b'\x01')
+            digest.update(h.get('ai_response', '').encode())
+        return digest.hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            response, expires_at, _ = entry
+            if expires_at > time.time():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return response
+            self._remove(key)
+
+        if self.store:
+            try:
+                row = await self.store.get_cached_response(key)
+                if row:
+                    response, expires_at = row
+                    self._insert(key, response, expires_at)
+                    self.hits += 1
+                    self.store_hits += 1
+                    return response
+            except Exception as e:
+                logger.error(f"Error reading response cache store: {e}")
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, mode: str, response: str):
+        expires_at = time.time() + self.ttl
+        self._insert(key, response, expires_at)
+
+        if self.store:
+            task = asyncio.create_task(self._persist(key, mode, response, expires_at))
+            self._pending_writes.add(task)
+            task.add_done_callback(self._pending_writes.discard)
+
+    async def _persist(self, key: str, mode: str, response: str, expires_at: float):
+        try:
+            await self.store.save_cached_response(key, mode, response, expires_at)
+        except Exception as e:
+            logger.error(f"Error writing response cache store: {e}")
+
+    def _insert(self, key: str, response: str, expires_at: float):
+        size = len(key) + len(response.encode()) + 64
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (response, expires_at, size)
+        self.total_bytes += size
+        while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, size = self.entries.pop(key)
+        self.total_bytes -= size
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'store_hits': self.store_hits,
+            'hit_rate': (self.hits / lookups) * 100 if lookups else 0.0,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+            'persistent': self.store is not None
+        }
+
+
 class GeminiClient:
     def __init__(self):
         api_key = os.getenv('GEMINI_API_KEY')
@@ -120,6 +249,16 @@ class GeminiClient:
         self.daily_requests = 0
         self.daily_tokens = 0
         
+        # Time-to-first-token per mode (streaming only)
+        self.ttft_stats: Dict[str, Dict] = {}
+        
+        # Response cache (skips the network for repeated questions)
+        self.response_cache = ResponseCache(
+            max_entries=int(os.getenv('GEMINI_CACHE_MAX_ENTRIES', 2000)),
+            ttl=float(os.getenv('GEMINI_CACHE_TTL', 3600)),
+            max_bytes=int(os.getenv('GEMINI_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+        )
+        
         logger.info("GeminiClient initialized successfully")
     
     def get_model(self, mode: str = 'standard'):
@@ -238,21 +377,43 @@ class GeminiClient:
         
         logger.info("GeminiClient initialized successfully")
     
+    def get_simple_response(self, prompt: str) -> Optional[str]:
+        """Return a canned response for short greetings, or None"""
+        if len(prompt) >= 20:
+            return None
+        prompt_lower = prompt.lower().strip()
+        for key, response in self.simple_responses.items():
+            if key in prompt_lower:
+                logger.info(f"Using simple response for: {prompt}")
+                return response
+        return None
+    
     async def generate_response(
         self, 
         prompt: str, 
         history: Optional[List[Dict]] = None,
         mode: str = 'standard',
-        model: Optional[str] = None
+        model: Optional[str] = None,
+        check_cache: bool = True,
+        on_chunk: Optional[Callable[[str], Awaitable[None]]] = None
     ) -> Optional[str]:
-        """Generate AI response"""
+        """Generate AI response
+
+        If on_chunk is given the response is streamed and on_chunk is awaited
+        with the accumulated text after every chunk.
+        """
         try:
             # Check for simple responses first (cost optimization)
-            prompt_lower = prompt.lower().strip()
-            for key, response in self.simple_responses.items():
-                if key in prompt_lower and len(prompt) < 20:
-                    logger.info(f"Using simple response for: {prompt}")
-                    return response
+            simple = self.get_simple_response(prompt)
+            if simple:
+                return simple
+            
+            cache_key = self.response_cache.make_key(mode, prompt, history)
+            if check_cache:
+                cached = await self.response_cache.get(cache_key)
+                if cached:
+                    logger.info(f"Using cached response for: {prompt[:50]}")
+                    return cached
             
             mode_config = self.modes.get(mode, self.modes['standard'])
             
@@ -263,7 +424,7 @@ class GeminiClient:
             conversation_history = []
             if history and len(history) > 0:
                 # Use last 5 messages for better context
-                for h in history[-5:]:
+                for h in history[-HISTORY_WINDOW:]:
                     conversation_history.append({
                         'role': 'user',
                         'parts': [h.get('user_message', '')]
@@ -278,29 +439,39 @@ class GeminiClient:
             # Create chat session with history
             chat = model.start_chat(history=conversation_history)
             
-            # Generate response using async method
-            response = await chat.send_message_async(
-                prompt,
-                generation_config=genai.GenerationConfig(
-                    temperature=mode_config['temperature'],
-                    max_output_tokens=512,  # Shorter responses
-                    top_p=0.95,
-                    top_k=40,
-                ),
-                safety_settings={
-                    'HARASSMENT': 'BLOCK_NONE',
-                    'HATE_SPEECH': 'BLOCK_NONE',
-                    'SEXUALLY_EXPLICIT': 'BLOCK_NONE',
-                    'DANGEROUS_CONTENT': 'BLOCK_NONE',
-                }
+            generation_config = genai.GenerationConfig(
+                temperature=mode_config['temperature'],
+                max_output_tokens=512,  # Shorter responses
+                top_p=0.95,
+                top_k=40,
             )
+            safety_settings = {
+                'HARASSMENT': 'BLOCK_NONE',
+                'HATE_SPEECH': 'BLOCK_NONE',
+                'SEXUALLY_EXPLICIT': 'BLOCK_NONE',
+                'DANGEROUS_CONTENT': 'BLOCK_NONE',
+            }
             
-            if response and response.text:
+            if on_chunk:
+                # Streaming: hand partial text to the caller as it arrives
+                text = await self._stream_response(chat, prompt, mode, generation_config, safety_settings, on_chunk)
+            else:
+                # Generate response using async method
+                response = await chat.send_message_async(
+                    prompt,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings
+                )
+                text = response.text if response else None
+            
+            if text:
                 self.daily_requests += 1
-                self.daily_tokens += len(prompt.split()) + len(response.text.split())
+                self.daily_tokens += len(prompt.split()) + len(text.split())
                 
                 # Clean up response
-                result = response.text.strip()
+                result = text.strip()
+                
+                self.response_cache.put(cache_key, mode, result)
                 
                 logger.info(f"Response generated successfully: {result[:50]}...")
                 return result
@@ -314,6 +485,52 @@ class GeminiClient:
             traceback.print_exc()
             return None
     
+    async def _stream_response(self, chat, prompt: str, mode: str, generation_config,
+                               safety_settings, on_chunk) -> str:
+        """Consume a streamed completion, reporting partial text and time-to-first-token"""
+        start = time.perf_counter()
+        response = await chat.send_message_async(
+            prompt,
+            generation_config=generation_config,
+            safety_settings=safety_settings,
+            stream=True
+        )
+        
+        text = ''
+        async for chunk in response:
+            try:
+                piece = chunk.text
+            except ValueError:
+                # Chunks without text parts (e.g. safety metadata)
+                continue
+            if not piece:
+                continue
+            if not text:
+                self._record_ttft(mode, (time.perf_counter() - start) * 1000)
+            text += piece
+            try:
+                await on_chunk(text)
+            except Exception as e:
+                logger.error(f"Error in stream chunk callback: {e}")
+        return text
+    
+    def _record_ttft(self, mode: str, ttft_ms: float):
+        """Track time-to-first-token per mode"""
+        stats = self.ttft_stats.setdefault(mode, {'count': 0, 'avg_ms': 0.0, 'last_ms': 0.0})
+        stats['count'] += 1
+        stats['avg_ms'] += (ttft_ms - stats['avg_ms']) / stats['count']
+        stats['last_ms'] = ttft_ms
+        logger.info(f"⏱️ Time to first token ({mode}): {ttft_ms:.0f}ms (avg {stats['avg_ms']:.0f}ms)")
+    
+    async def get_cached_response(
+        self,
+        prompt: str,
+        history: Optional[List[Dict]] = None,
+        mode: str = 'standard'
+    ) -> Optional[str]:
+        """Look up a cached response without calling the API"""
+        return await self.response_cache.get(self.response_cache.make_key(mode, prompt, history))
+    
     async def get_available_modes(self) -> Dict[str, str]:
         """Get available AI modes"""
         return {
@@ -337,5 +554,7 @@ class GeminiClient:
             'usage_percentage': {
                 'requests': (self.daily_requests / 1500) * 100,
                 'tokens': (self.daily_tokens / 1000000) * 100
-            }
+            },
+            'cache': self.response_cache.get_stats(),
+            'ttft': self.ttft_stats
         }
\ No newline at end of file
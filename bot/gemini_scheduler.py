@@ -0,0 +1,298 @@
+"""Gemini APIへのリクエストを並列数・レート・ギルド間の公平性を保って実行するスケジューラ"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from utils.cost_optimizer import cost_optimizer
+
+logger = logging.getLogger(__name__)
+
+
+class _PendingRequest:
+    __slots__ = ('guild_id', 'prompt', 'history', 'mode', 'model', 'on_chunk', 'deadline', 'enqueued_at', 'future')
+
+    def __init__(self, guild_id, prompt, history, mode, model, on_chunk, deadline, future):
+        self.guild_id = guild_id
+        self.prompt = prompt
+        self.history = history
+        self.mode = mode
+        self.model = model
+        self.on_chunk = on_chunk
+        self.deadline = deadline
+        self.enqueued_at = time.monotonic()
+        self.future = future
+
+
+class GeminiScheduler:
+    """GeminiClient の前段に置くリクエストスケジューラ
+
+    - 同時実行数の上限（セマフォ）
+    - トークンバケットによるレート制限（モデルのRPMに合わせる）
+    - ギルドごとのキューを重み付きラウンドロビンで処理（1ギルドの連投で他が詰まらない）
+    - 期限切れのリクエストは実行せずに破棄
+    - 1日のクォータ（cost_optimizer.api_usage）を超えたら実行しない
+    """
+
+    def __init__(self, gemini_client, max_concurrency: int = None, requests_per_minute: float = None,
+                 burst: int = None, queue_timeout: float = None, max_queue_per_guild: int = 20):
+        self.client = gemini_client
+        self.max_concurrency = max_concurrency or int(os.getenv('GEMINI_MAX_CONCURRENCY', 4))
+        self.requests_per_minute = requests_per_minute or float(os.getenv('GEMINI_RPM', 15))
+        self.burst = burst or int(os.getenv('GEMINI_BURST', 5))
+        self.queue_timeout = queue_timeout or float(os.getenv('GEMINI_QUEUE_TIMEOUT', 30))
+        self.max_queue_per_guild = max_queue_per_guild
+
+        # ギルドごとの重み（未設定は1）
+        self.guild_weights: Dict[int, int] = {}
+
+        # トークンバケット
+        self._tokens = float(self.burst)
+        self._refill_rate = self.requests_per_minute / 60.0
+        self._last_refill = time.monotonic()
+
+        # ギルドごとのキュー + ラウンドロビン順
+        self._queues: Dict[Optional[int], Deque[_PendingRequest]] = {}
+        self._active: Deque[Optional[int]] = deque()
+        self._credits: Dict[Optional[int], int] = {}
+
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._has_work: Optional[asyncio.Event] = None
+        self._dispatch_task: Optional[asyncio.Task] = None
+        self._in_flight: set = set()
+        self.is_running = False
+
+        # 統計
+        self.stats = {
+            'submitted': 0,
+            'dispatched': 0,
+            'completed': 0,
+            'failed': 0,
+            'expired': 0,
+            'rejected': 0,
+            'quota_blocked': 0,
+            'simple_responses': 0,
+            'cache_hits': 0,
+            'avg_wait_ms': 0.0,
+            'max_wait_ms': 0.0
+        }
+
+    async def start(self):
+        """ディスパッチループを開始"""
+        if self.is_running:
+            return
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._has_work = asyncio.Event()
+        self.is_running = True
+        self._dispatch_task = asyncio.create_task(self._dispatch_loop())
+        logger.info(f"✅ Gemini scheduler started (concurrency={self.max_concurrency}, "
+                    f"rpm={self.requests_per_minute:g}, burst={self.burst})")
+
+    async def generate_response(self, prompt: str, history: Optional[List[Dict]] = None,
+                                mode: str = 'standard', model: Optional[str] = None,
+                                guild_id: Optional[int] = None, timeout: Optional[float] = None,
+                                on_chunk: Optional[Callable[[str], Awaitable[None]]] = None) -> Optional[str]:
+        """GeminiClient.generate_response と同じ引数でキューに積み、結果を待つ
+
+        on_chunk を渡すとストリーミングで生成し、途中経過のテキストで呼び出す
+        （定型応答・キャッシュヒット時は呼ばれない）。
+        """
+        # 定型応答はAPIを使わないのでキューを通さない
+        simple = self.client.get_simple_response(prompt)
+        if simple:
+            self.stats['simple_responses'] += 1
+            return simple
+
+        # キャッシュヒットはAPIを使わないのでキューを通さない
+        cached = await self.client.get_cached_response(prompt, history=history, mode=mode)
+        if cached:
+            self.stats['cache_hits'] += 1
+            return cached
+
+        if not self.is_running:
+            return await self.client.generate_response(prompt, history=history, mode=mode, model=model,
+                                                       check_cache=False, on_chunk=on_chunk)
+
+        queue = self._queues.get(guild_id)
+        if queue is not None and len(queue) >= self.max_queue_per_guild:
+            self.stats['rejected'] += 1
+            logger.warning(f"⚠️ Gemini queue full for guild {guild_id}, rejecting request")
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        deadline = time.monotonic() + (timeout or self.queue_timeout)
+        request = _PendingRequest(guild_id, prompt, history, mode, model, on_chunk, deadline, future)
+
+        if queue is None:
+            queue = self._queues[guild_id] = deque()
+            self._active.append(guild_id)
+        queue.append(request)
+        self.stats['submitted'] += 1
+        self._has_work.set()
+
+        return await future
+
+    def set_guild_weight(self, guild_id: int, weight: int):
+        """ギルドの重みを設定（1ラウンドで処理できるリクエスト数）"""
+        self.guild_weights[guild_id] = max(1, int(weight))
+
+    def get_stats(self) -> Dict:
+        """スケジューラの統計を取得"""
+        self._refill()
+        depths = {str(g): len(q) for g, q in self._queues.items() if q}
+        return {
+            **self.stats,
+            'queue_depth': sum(depths.values()),
+            'queued_guilds': len(depths),
+            'guild_queue_depths': depths,
+            'in_flight': len(self._in_flight),
+            'max_concurrency': self.max_concurrency,
+            'tokens_available': round(self._tokens, 2),
+            'requests_per_minute': self.requests_per_minute
+        }
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.burst), self._tokens + (now - self._last_refill) * self._refill_rate)
+        self._last_refill = now
+
+    async def _wait_for_token(self):
+        """トークンが1つ貯まるまで待機（消費はしない）"""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                return
+            await asyncio.sleep((1 - self._tokens) / self._refill_rate)
+
+    def _pending_count(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def _next_request(self) -> Optional[_PendingRequest]:
+        """重み付きラウンドロビンで次のリクエストを選ぶ（期限切れはここで破棄）"""
+        now = time.monotonic()
+        while self._active:
+            guild_id = self._active[0]
+            queue = self._queues[guild_id]
+
+            while queue and (queue[0].future.done() or queue[0].deadline <= now):
+                self._expire(queue.popleft())
+
+            if not queue:
+                self._active.popleft()
+                del self._queues[guild_id]
+                self._credits.pop(guild_id, None)
+                continue
+
+            credit = self._credits.get(guild_id, 0)
+            if credit < 1:
+                self._credits[guild_id] = credit + self.guild_weights.get(guild_id, 1)
+                self._active.rotate(-1)
+                continue
+
+            self._credits[guild_id] = credit - 1
+            return queue.popleft()
+        return None
+
+    def _expire(self, request: _PendingRequest):
+        if request.future.done():
+            return
+        self.stats['expired'] += 1
+        logger.warning(f"⚠️ Dropping stale Gemini request for guild {request.guild_id} "
+                       f"(waited {time.monotonic() - request.enqueued_at:.1f}s)")
+        request.future.set_result(None)
+
+    async def _dispatch_loop(self):
+        """並列数とレートの範囲でリクエストを取り出して実行"""
+        while self.is_running:
+            try:
+                if not self._pending_count():
+                    self._has_work.clear()
+                    await self._has_work.wait()
+                    continue
+
+                await self._semaphore.acquire()
+                try:
+                    await self._wait_for_token()
+                    request = self._next_request()
+                except BaseException:
+                    self._semaphore.release()
+                    raise
+                if request is None:
+                    self._semaphore.release()
+                    continue
+
+                if not cost_optimizer.check_daily_limits():
+                    self._semaphore.release()
+                    self.stats['quota_blocked'] += 1
+                    request.future.set_result(None)
+                    continue
+
+                self._tokens -= 1
+                task = asyncio.create_task(self._run(request))
+                self._in_flight.add(task)
+                task.add_done_callback(self._in_flight.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Gemini scheduler dispatch error: {e}")
+                await asyncio.sleep(1)
+
+    async def _run(self, request: _PendingRequest):
+        """1件のリクエストを実行して結果を返す"""
+        wait_ms = (time.monotonic() - request.enqueued_at) * 1000
+        self.stats['dispatched'] += 1
+        self.stats['avg_wait_ms'] += (wait_ms - self.stats['avg_wait_ms']) / self.stats['dispatched']
+        self.stats['max_wait_ms'] = max(self.stats['max_wait_ms'], wait_ms)
+
+        try:
+            response = await self.client.generate_response(
+                request.prompt,
+                history=request.history,
+                mode=request.mode,
+                model=request.model,
+                check_cache=False,
+                on_chunk=request.on_chunk
+            )
+            if response:
+                self.stats['completed'] += 1
+                cost_optimizer.record_api_usage(
+                    self.client.estimate_tokens(request.prompt) + self.client.estimate_tokens(response)
+                )
+            else:
+                self.stats['failed'] += 1
+            if not request.future.done():
+                request.future.set_result(response)
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.error(f"❌ Gemini request failed: {e}")
+            if not request.future.done():
+                request.future.set_result(None)
+        finally:
+            self._semaphore.release()
+
+    async def close(self):
+        """ディスパッチを停止し、待機中のリクエストを破棄"""
+        if not self.is_running:
+            return
+        self.is_running = False
+
+        if self._dispatch_task:
+            self._dispatch_task.cancel()
+            try:
+                await self._dispatch_task
+            except asyncio.CancelledError:
+                pass
+
+        for queue in self._queues.values():
+            for request in queue:
+                if not request.future.done():
+                    request.future.set_result(None)
+        self._queues.clear()
+        self._active.clear()
+
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+        logger.info("✅ Gemini scheduler stopped")
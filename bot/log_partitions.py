@@ -0,0 +1,448 @@
+"""chat_logs / usage_logs / playback_history の月別パーティションと保持期間管理（PostgreSQL）"""
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from db_indexes import ensure_indexes_pg
+
+logger = logging.getLogger(__name__)
+
+# テーブル名 -> (パーティションキー, 列定義)
+LOG_TABLES = {
+    'chat_logs': ('created_at', '''
+        id SERIAL,
+        user_id BIGINT NOT NULL,
+        guild_id BIGINT NOT NULL,
+        channel_id BIGINT,
+        user_message TEXT NOT NULL,
+        ai_response TEXT NOT NULL,
+        username TEXT,
+        channel_name TEXT,
+        guild_name TEXT,
+        tokens_used REAL DEFAULT 0,
+        ai_mode TEXT DEFAULT 'standard',
+        response_time REAL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    '''),
+    'usage_logs': ('created_at', '''
+        id SERIAL,
+        user_id BIGINT NOT NULL,
+        guild_id BIGINT NOT NULL,
+        tokens_used REAL NOT NULL,
+        message_type TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    '''),
+    'playback_history': ('played_at', '''
+        id SERIAL,
+        guild_id BIGINT NOT NULL,
+        track_title TEXT NOT NULL,
+        track_author TEXT,
+        track_artwork TEXT,
+        track_uri TEXT,
+        track_length INTEGER,
+        requester_id BIGINT,
+        requester_name TEXT,
+        played_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    '''),
+}
+
+EXPIRE_BATCH_SIZE = 50000  # legacy パーティションから期限切れの行を削除する1回あたりの件数
+MAINTENANCE_DELAY = 300  # 起動直後の負荷を避けるため、初回メンテナンスはこの秒数だけ待つ
+
+# pg_get_expr(relpartbound) の例: FOR VALUES FROM ('2026-10-01 00:00:00') TO ('2026-11-01 00:00:00')
+BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+# 変換用のCHECK制約の上限（pg_get_constraintdef の出力から読む）
+CHECK_BOUND_RE = re.compile(r"< '([^']+)'")
+
+
+def month_start(value: datetime, offset: int = 0) -> datetime:
+    """value の月初（offset ヶ月ずらす）"""
+    month = value.year * 12 + value.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def parse_bound(text: str) -> Optional[datetime]:
+    """パーティション境界の値（MINVALUE / MAXVALUE は None）"""
+    text = text.strip().strip("'")
+    if text in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(text)
+
+
+class LogPartitionManager:
+    """ログテーブルを created_at（playback_history は played_at）で月別にパーティション分割する
+
+    - 新規作成時はパーティションテーブルとして作成する。既存の通常テーブルは
+      LOG_PARTITION_CONVERT=true の場合のみ、起動後のメンテナンスで変換する
+      （既存データは <table>_legacy パーティションとして残し、保持期間を過ぎた行から
+      アーカイブして削除する）
+    - 当月から数ヶ月先までのパーティションを事前に作成。範囲外の行は DEFAULT パーティションへ
+    - 保持期間を過ぎたパーティションは CSV（gzip）に書き出してから DETACH / DROP
+    - メンテナンスは定期タスクで実行し、複数プロセスが同時に動いても advisory lock で1つだけ実行
+    """
+
+    def __init__(self, database, enabled: bool = None, retention_months: int = None,
+                 months_ahead: int = None, archive_dir: str = None, interval: float = None,
+                 convert_legacy: bool = None):
+        self.database = database
+        self.enabled = enabled if enabled is not None else os.getenv('LOG_PARTITIONING', 'true').lower() == 'true'
+        # 既存の通常テーブルを変換するか（大きなテーブルでは時間がかかるため明示的に有効にする）
+        if convert_legacy is None:
+            convert_legacy = os.getenv('LOG_PARTITION_CONVERT', 'false').lower() == 'true'
+        self.convert_legacy = convert_legacy
+        # 0 の場合は削除しない
+        self.retention_months = retention_months if retention_months is not None else int(os.getenv('LOG_RETENTION_MONTHS', 12))
+        self.months_ahead = months_ahead or int(os.getenv('LOG_PARTITION_MONTHS_AHEAD', 3))
+        self.archive_dir = archive_dir or os.getenv('LOG_ARCHIVE_DIR', 'archives')
+        self.interval = interval or float(os.getenv('LOG_MAINTENANCE_INTERVAL', 6 * 3600))
+
+        self.task: Optional[asyncio.Task] = None
+
+        # 統計
+        self.stats = {
+            'runs': 0,
+            'partitions_created': 0,
+            'partitions_archived': 0,
+            'rows_archived': 0,
+            'errors': 0,
+            'last_run_ms': 0.0,
+            'last_run_at': None
+        }
+
+    # ------------------------------------------------------------------
+    # スキーマ
+    # ------------------------------------------------------------------
+
+    async def ensure_tables(self, conn):
+        """ログテーブルを作成（必要なら既存テーブルをパーティション化）
+
+        インデックスは db_indexes.INDEXES で親テーブルにまとめて作成する
+        """
+        for table, (column, columns) in LOG_TABLES.items():
+            kind = await conn.fetchval(
+                "SELECT relkind FROM pg_class WHERE oid = to_regclass($1)", f'public.{table}'
+            )
+            if kind is None:
+                if self.enabled:
+                    await conn.execute(f'''
+                        CREATE TABLE IF NOT EXISTS {table} ({columns}, PRIMARY KEY (id, {column}))
+                        PARTITION BY RANGE ({column})
+                    ''')
+                    kind = 'p'
+                else:
+                    await conn.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columns}, PRIMARY KEY (id))')
+            elif kind == 'r' and self.enabled:
+                # 変換は起動を止めないようメンテナンスで行う
+                if self.convert_legacy:
+                    logger.info(f"ℹ️ {table} will be converted to a partitioned table during maintenance")
+                else:
+                    logger.info(f"ℹ️ {table} is a regular table. Set LOG_PARTITION_CONVERT=true to partition it")
+
+            if kind == 'p':
+                await self.ensure_partitions(conn, table, column)
+
+    async def _convert_legacy(self, conn, table: str, column: str):
+        """通常テーブルをパーティションテーブルに変換（既存データは legacy パーティションになる）
+
+        重い処理（NULLの補完、(id, 列) の一意インデックス作成、境界のCHECK制約の検証）は
+        書き込みを止めないロックで先に済ませる。ACCESS EXCLUSIVE を取るのは名前の付け替えと
+        ATTACH の間だけで、検証済みのCHECK制約があるため SET NOT NULL と ATTACH は全件を走査しない。
+        """
+        legacy = f'{table}_legacy'
+        bound = f'{table}_partition_bound'
+        logger.info(f"🔄 Converting {table} to a partitioned table...")
+        start = time.perf_counter()
+
+        # 変換中に月が替わっても新しい行がCHECKに違反しないよう、月末1日以内なら翌月も含める
+        newest = await conn.fetchval(f'SELECT MAX({column}) FROM {table}')
+        upper = month_start(max(newest or datetime.min, datetime.now() + timedelta(days=1)), 1)
+
+        await conn.execute(f'UPDATE {table} SET {column} = CURRENT_TIMESTAMP WHERE {column} IS NULL')
+        # 親の PRIMARY KEY (id, 列) に対応するインデックス（ATTACH 時にそのまま使われる）
+        await conn.execute(f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {table}_id_{column}_key ON {table} (id, {column})')
+
+        # 前回の変換が途中で止まっていた場合は、その時の境界を使う
+        existing = await conn.fetchval(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = $1::regclass AND conname = $2",
+            table, bound
+        )
+        match = CHECK_BOUND_RE.search(existing or '')
+        if match:
+            upper = datetime.fromisoformat(match.group(1))
+        else:
+            await conn.execute(f'''
+                ALTER TABLE {table} ADD CONSTRAINT {bound}
+                CHECK ({column} IS NOT NULL AND {column} < '{upper.isoformat(sep=' ')}') NOT VALID
+            ''')
+        # VALIDATE は SHARE UPDATE EXCLUSIVE なので書き込みを止めない
+        await conn.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {bound}')
+
+        async with conn.transaction():
+            await conn.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+            await conn.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+
+            # 親テーブルで同じ名前を使えるよう、制約・インデックス名を付け替える
+            pkey = await conn.fetchval(
+                "SELECT conname FROM pg_constraint WHERE conrelid = $1::regclass AND contype = 'p'", legacy
+            )
+            if pkey:
+                await conn.execute(f'ALTER TABLE {legacy} RENAME CONSTRAINT {pkey} TO {legacy}_pkey')
+            index_names = await conn.fetch('''
+                SELECT i.relname FROM pg_index x
+                JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = $1::regclass AND NOT x.indisprimary
+            ''', legacy)
+            for row in index_names:
+                name = row['relname']
+                await conn.execute(f'ALTER INDEX {name} RENAME TO {name[:55]}_legacy')
+
+            # 検証済みの CHECK ({column} IS NOT NULL ...) があるので全件を走査しない
+            await conn.execute(f'ALTER TABLE {legacy} ALTER COLUMN {column} SET NOT NULL')
+
+            await conn.execute(f'''
+                CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS)
+                PARTITION BY RANGE ({column})
+            ''')
+            await conn.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, {column})')
+
+            # legacy を DROP しても id の採番が消えないよう、シーケンスの所有者を親に移す
+            sequence = await conn.fetchval("SELECT pg_get_serial_sequence($1, 'id')", legacy)
+            if sequence:
+                await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.id')
+
+            # CHECK制約がパーティション境界を含意するため、ATTACH も検証の走査を省略する
+            await conn.execute(f'''
+                ALTER TABLE {table} ATTACH PARTITION {legacy}
+                FOR VALUES FROM (MINVALUE) TO ('{upper.isoformat(sep=' ')}')
+            ''')
+
+        logger.info(f"✅ Converted {table} to monthly partitions in {time.perf_counter() - start:.1f}s")
+
+    async def ensure_partitions(self, conn, table: str, column: str) -> int:
+        """当月から months_ahead ヶ月先までのパーティションと DEFAULT パーティションを作成"""
+        created = 0
+        partitions, has_default = await self._partitions(conn, table)
+        if not has_default:
+            await conn.execute(f'CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT')
+
+        now = datetime.now()
+        for offset in range(self.months_ahead + 1):
+            lower, upper = month_start(now, offset), month_start(now, offset + 1)
+            if any(self._overlaps(lower, upper, lo, hi) for _, lo, hi in partitions):
+                continue
+            await self._create_partition(conn, table, column, lower, upper)
+            created += 1
+
+        if created:
+            self.stats['partitions_created'] += created
+        return created
+
+    async def _create_partition(self, conn, table: str, column: str, lower: datetime, upper: datetime):
+        name = f'{table}_p{lower.year:04d}_{lower.month:02d}'
+        bounds = f"FROM ('{lower.isoformat(sep=' ')}') TO ('{upper.isoformat(sep=' ')}')"
+
+        async with conn.transaction():
+            stray = await conn.fetchval(f'''
+                SELECT EXISTS (SELECT 1 FROM {table}_default WHERE {column} >= $1 AND {column} < $2)
+            ''', lower, upper)
+            if not stray:
+                await conn.execute(f'CREATE TABLE {name} PARTITION OF {table} FOR VALUES {bounds}')
+                return
+
+            # メンテナンスが遅れて DEFAULT に入った行を新しいパーティションへ移す
+            await conn.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)')
+            await conn.execute(f'''
+                WITH moved AS (
+                    DELETE FROM {table}_default WHERE {column} >= $1 AND {column} < $2 RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            ''', lower, upper)
+            await conn.execute(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {bounds}')
+        logger.info(f"✅ Created partition {name}")
+
+    async def _partitions(self, conn, table: str) -> Tuple[List[Tuple[str, Optional[datetime], Optional[datetime]]], bool]:
+        """(パーティション名, 下限, 上限) の一覧と DEFAULT パーティションの有無"""
+        rows = await conn.fetch('''
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = $1::regclass
+        ''', table)
+
+        partitions, has_default = [], False
+        for row in rows:
+            if row['bound'] == 'DEFAULT':
+                has_default = True
+                continue
+            match = BOUND_RE.search(row['bound'] or '')
+            if match:
+                partitions.append((row['relname'], parse_bound(match.group(1)), parse_bound(match.group(2))))
+        return partitions, has_default
+
+    @staticmethod
+    def _overlaps(lower: datetime, upper: datetime, lo: Optional[datetime], hi: Optional[datetime]) -> bool:
+        return (lo is None or lo < upper) and (hi is None or lower < hi)
+
+    # ------------------------------------------------------------------
+    # 保持期間・アーカイブ
+    # ------------------------------------------------------------------
+
+    async def run_maintenance(self) -> Dict:
+        """パーティションの先行作成と、期限切れパーティションのアーカイブ"""
+        pool = self.database.pool
+        if not pool or not self.enabled:
+            return {}
+
+        start = time.perf_counter()
+        result = {'created': 0, 'archived': 0, 'rows': 0}
+        async with pool.acquire() as conn:
+            # 他のプロセスが実行中ならスキップ
+            if not await conn.fetchval("SELECT pg_try_advisory_lock(hashtext('log_partition_maintenance'))"):
+                return result
+            try:
+                for table, (column, _) in LOG_TABLES.items():
+                    try:
+                        kind = await conn.fetchval(
+                            "SELECT relkind FROM pg_class WHERE oid = to_regclass($1)", f'public.{table}'
+                        )
+                        if kind == 'r' and self.convert_legacy:
+                            await self._convert_legacy(conn, table, column)
+                            # 親テーブルにインデックスを作成（legacy の同じ定義のインデックスはそのまま取り込まれる）
+                            await ensure_indexes_pg(conn)
+                        elif kind != 'p':
+                            continue
+                        result['created'] += await self.ensure_partitions(conn, table, column)
+                        if self.retention_months > 0:
+                            archived, rows = await self._expire(conn, table, column)
+                            result['archived'] += archived
+                            result['rows'] += rows
+                    except Exception as e:
+                        self.stats['errors'] += 1
+                        logger.error(f"❌ Partition maintenance failed for {table}: {e}")
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock(hashtext('log_partition_maintenance'))")
+
+        self.stats['runs'] += 1
+        self.stats['last_run_ms'] = (time.perf_counter() - start) * 1000
+        self.stats['last_run_at'] = datetime.now().isoformat()
+        if result['archived']:
+            logger.info(f"🗄️ Archived {result['archived']} log partitions ({result['rows']} rows)")
+        return result
+
+    async def _expire(self, conn, table: str, column: str) -> Tuple[int, int]:
+        """上限が保持期間より古いパーティションを書き出して削除"""
+        cutoff = month_start(datetime.now(), -self.retention_months)
+        partitions, _ = await self._partitions(conn, table)
+
+        archived = rows = 0
+        for name, lower, upper in sorted(partitions, key=lambda p: p[2] or datetime.max):
+            if upper is None:
+                continue
+            if upper > cutoff:
+                # 変換前のデータ（MINVALUE からの legacy パーティション）は期限切れの行だけを削除
+                if lower is None:
+                    rows += await self._expire_rows(conn, name, column, cutoff)
+                continue
+            count = await self._archive(conn, name)
+            async with conn.transaction():
+                await conn.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+                await conn.execute(f'DROP TABLE {name}')
+            archived += 1
+            rows += count
+            self.stats['partitions_archived'] += 1
+            self.stats['rows_archived'] += count
+        return archived, rows
+
+    async def _expire_rows(self, conn, partition: str, column: str, cutoff: datetime) -> int:
+        """パーティション内の cutoff より古い行を書き出してから、小さなバッチで削除"""
+        if not await conn.fetchval(f'SELECT EXISTS (SELECT 1 FROM {partition} WHERE {column} < $1)', cutoff):
+            return 0
+
+        # 前回の削除が途中で失敗していても、書き出し済みのファイルを上書きしない
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f'{partition}_before_{cutoff:%Y_%m}_{datetime.now():%Y%m%d%H%M%S}.csv')
+        status = await conn.copy_from_query(
+            f'SELECT * FROM {partition} WHERE {column} < $1', cutoff, output=path, format='csv', header=True
+        )
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._compress, path)
+        count = int(status.split()[-1]) if status else 0
+
+        while True:
+            status = await conn.execute(f'''
+                DELETE FROM {partition} WHERE ctid = ANY(ARRAY(
+                    SELECT ctid FROM {partition} WHERE {column} < $1 LIMIT {EXPIRE_BATCH_SIZE}
+                ))
+            ''', cutoff)
+            if int(status.split()[-1]) < EXPIRE_BATCH_SIZE:
+                break
+
+        self.stats['rows_archived'] += count
+        logger.info(f"🗄️ Archived {count} rows older than {cutoff:%Y-%m} from {partition}")
+        return count
+
+    async def _archive(self, conn, partition: str) -> int:
+        """パーティションを <archive_dir>/<partition>.csv.gz に書き出し、行数を返す"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f'{partition}.csv')
+        status = await conn.copy_from_table(partition, output=path, format='csv', header=True)
+
+        # 圧縮はイベントループの外で行う
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._compress, path)
+        return int(status.split()[-1]) if status else 0
+
+    @staticmethod
+    def _compress(path: str):
+        with open(path, 'rb') as src, gzip.open(f'{path}.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+
+    # ------------------------------------------------------------------
+    # スケジュール
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """定期メンテナンスを開始"""
+        if self.task or not self.enabled:
+            return
+        self.task = asyncio.create_task(self._maintenance_loop())
+        logger.info(
+            f"✅ Log partition maintenance scheduled (every {self.interval / 3600:.1f}h, "
+            f"retention={self.retention_months or 'unlimited'} months)"
+        )
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'enabled': self.enabled,
+            'convert_legacy': self.convert_legacy,
+            'retention_months': self.retention_months
+        }
+
+    async def _maintenance_loop(self):
+        await asyncio.sleep(MAINTENANCE_DELAY)
+        while True:
+            try:
+                await self.run_maintenance()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"❌ Log partition maintenance error: {e}")
+            await asyncio.sleep(self.interval)
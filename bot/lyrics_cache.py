@@ -0,0 +1,163 @@
+"""パース済み歌詞のキャッシュ（メモリLRU + SQLite永続化）"""
+import os
+import re
+import time
+import zlib
+import logging
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (タイムスタンプ秒, 歌詞テキスト) の列。None は「歌詞なし」（ネガティブキャッシュ）
+ParsedLyrics = Optional[List[Tuple[float, str]]]
+
+DURATION_BUCKET_SEC = 5  # 再生時間はこの秒数単位で丸めてキーにする
+
+
+class LyricsCache:
+    """歌詞取得結果のキャッシュ
+
+    - キー: 正規化したタイトル・アーティスト・再生時間バケット
+    - 値: タイムスタンプ配列（float32）と歌詞テキスト（zlib圧縮）をSQLiteにBLOBで保存
+    - メモリ上のLRUを前段に置き、見つからなかった結果は短いTTLでキャッシュ
+    """
+
+    _WHITESPACE_RE = re.compile(r'\s+')
+
+    def __init__(self, db_path: str = None, memory_entries: int = 256,
+                 ttl: float = None, negative_ttl: float = None):
+        self.db_path = db_path or os.getenv('LYRICS_CACHE_PATH', 'lyrics_cache.db')
+        self.memory_entries = memory_entries
+        self.ttl = ttl or float(os.getenv('LYRICS_CACHE_TTL', 30 * 24 * 3600))
+        self.negative_ttl = negative_ttl or float(os.getenv('LYRICS_NEGATIVE_TTL', 6 * 3600))
+
+        self.memory: "OrderedDict[str, Tuple[ParsedLyrics, float]]" = OrderedDict()
+        self.engine = None
+
+        # 統計
+        self.stats = {
+            'hits': 0,
+            'memory_hits': 0,
+            'negative_hits': 0,
+            'misses': 0,
+            'stores': 0
+        }
+
+    async def start(self):
+        """SQLiteを開いてテーブルを作成（失敗時はメモリのみで動作）"""
+        try:
+            from sqlite_engine import SQLiteEngine
+            self.engine = SQLiteEngine(self.db_path, readers=2)
+            await self.engine.start()
+            await self.engine.execute('''
+                CREATE TABLE IF NOT EXISTS lyrics_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    timestamps BLOB,
+                    lines BLOB,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            await self.engine.execute('DELETE FROM lyrics_cache WHERE expires_at <= ?', (time.time(),))
+            logger.info(f"✅ Lyrics cache ready ({self.db_path})")
+        except Exception as e:
+            logger.error(f"❌ Lyrics cache persistence unavailable, using memory only: {e}")
+            self.engine = None
+
+    async def close(self):
+        if self.engine:
+            await self.engine.close()
+            self.engine = None
+
+    @classmethod
+    def make_key(cls, title: str, artist: str, duration_ms: int) -> str:
+        """クリーンアップ済みのタイトル・アーティストと再生時間からキーを作る"""
+        title = cls._WHITESPACE_RE.sub(' ', title.lower()).strip()
+        artist = cls._WHITESPACE_RE.sub(' ', (artist or '').lower()).strip()
+        bucket = int(duration_ms or 0) // 1000 // DURATION_BUCKET_SEC
+        return f"{title}\x1f{artist}\x1f{bucket}"
+
+    async def get(self, key: str) -> Tuple[bool, ParsedLyrics]:
+        """(ヒットしたか, 歌詞) を返す。ネガティブキャッシュのヒットは (True, None)"""
+        now = time.time()
+
+        entry = self.memory.get(key)
+        if entry is not None:
+            lyrics, expires_at = entry
+            if expires_at > now:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return self._hit(lyrics)
+            del self.memory[key]
+
+        if self.engine:
+            try:
+                row = await self.engine.fetchone(
+                    'SELECT timestamps, lines, expires_at FROM lyrics_cache WHERE cache_key = ? AND expires_at > ?',
+                    (key, now)
+                )
+                if row:
+                    lyrics = self._decode(row[0], row[1])
+                    self._remember(key, lyrics, row[2])
+                    return self._hit(lyrics)
+            except Exception as e:
+                logger.error(f"❌ Failed to read lyrics cache: {e}")
+
+        self.stats['misses'] += 1
+        return False, None
+
+    async def put(self, key: str, lyrics: ParsedLyrics):
+        """取得結果を保存（None は短いTTLで保存）"""
+        expires_at = time.time() + (self.ttl if lyrics else self.negative_ttl)
+        lyrics = lyrics or None
+        self._remember(key, lyrics, expires_at)
+        self.stats['stores'] += 1
+
+        if self.engine:
+            try:
+                timestamps, lines = self._encode(lyrics)
+                await self.engine.execute(
+                    'INSERT OR REPLACE INTO lyrics_cache (cache_key, timestamps, lines, expires_at) VALUES (?, ?, ?, ?)',
+                    (key, timestamps, lines, expires_at)
+                )
+            except Exception as e:
+                logger.error(f"❌ Failed to write lyrics cache: {e}")
+
+    def get_stats(self) -> Dict:
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': (self.stats['hits'] / lookups) * 100 if lookups else 0.0,
+            'memory_entries': len(self.memory),
+            'persistent': self.engine is not None
+        }
+
+    def _hit(self, lyrics: ParsedLyrics) -> Tuple[bool, ParsedLyrics]:
+        self.stats['hits'] += 1
+        if lyrics is None:
+            self.stats['negative_hits'] += 1
+        return True, lyrics
+
+    def _remember(self, key: str, lyrics: ParsedLyrics, expires_at: float):
+        self.memory[key] = (lyrics, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    @staticmethod
+    def _encode(lyrics: ParsedLyrics) -> Tuple[Optional[bytes], Optional[bytes]]:
+        if not lyrics:
+            return None, None
+        timestamps = array('f', (ts for ts, _ in lyrics)).tobytes()
+        lines = zlib.compress('\n'.join(text for _, text in lyrics).encode('utf-8'))
+        return timestamps, lines
+
+    @staticmethod
+    def _decode(timestamps: Optional[bytes], lines: Optional[bytes]) -> ParsedLyrics:
+        if not timestamps or not lines:
+            return None
+        values = array('f')
+        values.frombytes(timestamps)
+        texts = zlib.decompress(lines).decode('utf-8').split('\n')
+        return [(round(ts, 3), text) for ts, text in zip(values.tolist(), texts)]
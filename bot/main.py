@@ -11,6 +11,13 @@ from database_pg import Database
 from api_server import APIServer
 from supabase_client import SupabaseClient
 from supabase_log_handler import SupabaseLogHandler
+from persistence_pipeline import PersistencePipeline
+from gemini_scheduler import GeminiScheduler
+from stream_resolver import StreamResolver
+from track_search import TrackSearchCache
+from utils.streaming_reply import StreamingReply
+from utils.intent_router import IntentRouter
+from utils.loop_monitor import EventLoopLagMonitor
 
 # Load environment variables
 load_dotenv()
@@ -81,17 +88,45 @@ class DiscordBot(commands.Bot):
         )
         
         self.gemini_client = GeminiClient()
+        self.gemini_scheduler = GeminiScheduler(self.gemini_client)
+        self.intent_router = IntentRouter(self.gemini_client.simple_responses)  # ✅ キーワード判定を1パスで
+        self.streaming_replies = os.getenv('GEMINI_STREAMING', 'true').lower() == 'true'  # ✅ 応答を段階的に表示
         self.database = Database()
         self.supabase_client = SupabaseClient(self)
+        self.persistence = PersistencePipeline(self.database, self.supabase_client)
+        self.loop_monitor = EventLoopLagMonitor()  # ✅ Detects blocking calls on the event loop
+        self.stream_resolver = StreamResolver()  # ✅ yt-dlp extraction in worker processes
+        self.track_search = TrackSearchCache()  # ✅ Cached / single-flight Lavalink searches
         self.api_server = None
         self.start_time = time.time()  # Track bot start time
         self.is_maintenance = False  # Maintenance mode flag
         self.status_task = None  # ✅ ステータスローテーションタスク
+        self.chat_channel_sync_task = None  # ✅ チャットチャンネルインデックス同期タスク
+        self.chat_channel_sync_interval = int(os.getenv('CHAT_CHANNEL_SYNC_INTERVAL', 300))  # seconds
         
     async def setup_hook(self):
         """Called when the bot is starting up"""
+        self.loop_monitor.start()
         await self.database.initialize()
         
+        # ✅ Load chat channel index (on_message checks are then memory-only)
+        try:
+            count = await self.database.load_chat_channels()
+            logger.info(f"✅ Loaded {count} chat channels into index")
+        except Exception as e:
+            logger.error(f"❌ Failed to load chat channel index: {e}")
+        self.chat_channel_sync_task = asyncio.create_task(self._chat_channel_sync_loop())
+        
+        # ✅ Start write-behind persistence for AI interactions
+        await self.persistence.start()
+        
+        # ✅ Persist AI response cache to the database (optional)
+        if os.getenv('GEMINI_CACHE_PERSIST', 'false').lower() == 'true':
+            self.gemini_client.response_cache.attach_store(self.database)
+        
+        # ✅ Start Gemini request scheduler (concurrency / rate / per-guild fairness)
+        await self.gemini_scheduler.start()
+        
         # Initialize Supabase client
         supabase_initialized = await self.supabase_client.initialize()
         
@@ -203,6 +238,18 @@ class DiscordBot(commands.Bot):
                 logger.error(f"Error in status rotation: {e}")
                 await asyncio.sleep(10)
     
+    async def _chat_channel_sync_loop(self):
+        """Periodically reconcile the chat channel index with the database"""
+        await self.wait_until_ready()
+        
+        while not self.is_closed():
+            await asyncio.sleep(self.chat_channel_sync_interval)
+            try:
+                count = await self.database.load_chat_channels()
+                logger.debug(f"Chat channel index reconciled: {count} channels")
+            except Exception as e:
+                logger.error(f"Error reconciling chat channel index: {e}")
+    
     async def _resume_music_sessions(self):
         """Resume music sessions from Supabase after restart"""
         try:
@@ -211,10 +258,11 @@ class DiscordBot(commands.Bot):
                 return
             
             # Get active sessions from Supabase
-            result = self.supabase_client.client.table('active_sessions')\
-                .select('*')\
-                .eq('is_playing', True)\
-                .execute()
+            result = await self.supabase_client.execute(
+                self.supabase_client.client.table('active_sessions')
+                .select('*')
+                .eq('is_playing', True)
+            )
             
             if not result.data:
                 logger.info("No active sessions to resume")
@@ -258,7 +306,7 @@ class DiscordBot(commands.Bot):
                     
                     # Search for the track
                     import wavelink
-                    tracks = await wavelink.Playable.search(f"ytsearch:{track_title}")
+                    tracks = await self.track_search.search(f"ytsearch:{track_title}", limit=1)
                     
                     if not tracks or len(tracks) == 0:
                         logger.warning(f"Could not find track: {track_title}")
@@ -279,6 +327,7 @@ class DiscordBot(commands.Bot):
                     position_ms = session.get('position_ms', 0)
                     if position_ms > 0:
                         await vc.seek(position_ms)
+                        self.dispatch('playback_state_change', guild_id)
                     
                     # Update queue
                     queue = music_cog.get_queue(guild_id)
@@ -319,7 +368,7 @@ class DiscordBot(commands.Bot):
         # Log message for debugging
         logger.debug(f"Message received from {message.author.name} in {message.channel.name}: {message.content[:50]}")
             
-        # Check if this channel is set for auto-response
+        # Check if this channel is set for auto-response (in-memory index, no DB round-trip)
         is_chat_channel = await self.database.is_chat_channel(message.channel.id)
         logger.debug(f"Channel {message.channel.name} is_chat_channel: {is_chat_channel}")
         
@@ -338,43 +387,16 @@ class DiscordBot(commands.Bot):
             if cost_optimizer.is_quota_warning_threshold():
                 await self.send_quota_warning(message.guild)
             
-            # Music control keywords - these always trigger music control
-            control_keywords = [
-                'スキップ', 'skip', '次の曲', 
-                '停止', 'stop', 'ストップ', '止めて', 'とめて',
-                '切断', 'disconnect', '退出', 'leave',
-                '一時停止', 'pause', 'ポーズ',
-                '再開', 'resume',
-                'キュー', 'queue',
-                '今の曲', '何の曲', 'なんの曲', 'nowplaying', 'np',
-                'ループ', 'loop', 'リピート', 'repeat',
-                '音量', 'volume', 'vol'
-            ]
-            
-            content_lower = message.content.lower()
+            # Classify the message in a single pass (control / play / simple / ai)
+            intent = self.intent_router.classify(message.content)
             
             # Check for music control commands first
-            is_control = any(keyword in message.content or keyword in content_lower for keyword in control_keywords)
-            if is_control:
-                control_handled = await self.handle_music_control(message)
+            if intent.is_control:
+                control_handled = await self.handle_music_control(message, intent)
                 if control_handled:
                     return
             
-            # Music play keywords - MUST contain action words like 流して, かけて, 再生して
-            music_action_keywords = [
-                '流して', 'ながして', 'かけて', '再生して', 'プレイして', 
-                '聞かせて', 'きかせて', '聴かせて',
-                'play ', 'play　'  # play with space after
-            ]
-            
-            # Check if message contains music action keywords
-            is_music_request = any(keyword in message.content or keyword in content_lower for keyword in music_action_keywords)
-            
-            # Also check for explicit patterns like "〇〇を流して" or "〇〇かけて"
-            import re
-            music_pattern = re.search(r'.+(を|の|)(流して|かけて|再生して|プレイして|聞かせて|きかせて)', message.content)
-            if music_pattern:
-                is_music_request = True
+            is_music_request = intent.is_play
             
             logger.info(f"Music request check: {is_music_request} for message: {message.content[:50]}")
             
@@ -386,78 +408,59 @@ class DiscordBot(commands.Bot):
             
             start_time = time.time()
             async with message.channel.typing():
-                # Get user's conversation history from database
-                history = await self.database.get_user_history_from_db(message.author.id, limit=5)
-                
                 # Get AI mode for this guild
                 mode = await self.database.get_ai_mode(message.guild.id)
                 
-                # Generate response
-                response = await self.gemini_client.generate_response(
-                    message.content,
-                    history=history,
-                    mode=mode
-                )
+                # Stream the reply: post the first sentence, then edit as it grows
+                reply = StreamingReply(lambda text: message.reply(text))
+                
+                if intent.kind == 'simple':
+                    # Canned reply: no history lookup, no API call
+                    response = intent.simple_response
+                else:
+                    # Get user's conversation history from database
+                    history = await self.database.get_user_history_from_db(message.author.id, limit=5)
+                    
+                    # Generate response
+                    response = await self.gemini_scheduler.generate_response(
+                        message.content,
+                        history=history,
+                        mode=mode,
+                        guild_id=message.guild.id,
+                        on_chunk=reply.on_chunk if self.streaming_replies else None
+                    )
                 
                 if response:
                     response_time = time.time() - start_time
                     
-                    # Send response
-                    await message.reply(response)
+                    # Send (or finalize the streamed) response
+                    await reply.finish(response)
                     
                     # トークン数を推定（実際のAPIレスポンスから取得する場合は修正）
                     prompt_tokens = len(message.content.split()) * 1.3
                     completion_tokens = len(response.split()) * 1.3
                     total_tokens = prompt_tokens + completion_tokens
                     
-                    # Save to Supabase conversation_logs (エラーハンドリング付き)
-                    try:
-                        await self.supabase_client.save_conversation_log(
-                            user_id=message.author.id,
-                            user_name=message.author.display_name,
-                            prompt=message.content,
-                            response=response
-                        )
-                        
-                        # Gemini使用ログを記録
-                        await self.supabase_client.log_gemini_usage(
-                            guild_id=message.guild.id,
-                            user_id=message.author.id,
-                            prompt_tokens=int(prompt_tokens),
-                            completion_tokens=int(completion_tokens),
-                            total_tokens=int(total_tokens),
-                            model="gemini-pro"
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to save conversation log to Supabase: {e}")
-                    
-                    # Save detailed chat log
-                    await self.database.save_chat_log(
-                        user_id=message.author.id,
-                        guild_id=message.guild.id,
-                        channel_id=message.channel.id,
-                        user_message=message.content,
-                        ai_response=response,
-                        username=message.author.display_name,
-                        channel_name=message.channel.name,
-                        guild_name=message.guild.name,
-                        tokens_used=len(response.split()) * 1.3,
-                        ai_mode=mode,
-                        response_time=response_time
-                    )
-                    
-                    # Log usage
-                    await self.database.log_usage(
-                        user_id=message.author.id,
-                        guild_id=message.guild.id,
-                        tokens_used=len(response.split()) * 1.3,
-                        message_type='auto_response'
-                    )
-                    
-                    # Update analytics
-                    await self.database.increment_daily_stat(message.guild.id, 'message_count')
-                    await self.database.increment_daily_stat(message.guild.id, 'user_count', message.author.id)
-                    await self.database.increment_daily_stat(message.guild.id, 'token_count')
+                    # ✅ 永続化はwrite-behindパイプラインへ（chat_logs / usage_logs / 統計 / Supabase）
+                    await self.persistence.submit({
+                        'user_id': message.author.id,
+                        'username': message.author.display_name,
+                        'guild_id': message.guild.id,
+                        'guild_name': message.guild.name,
+                        'channel_id': message.channel.id,
+                        'channel_name': message.channel.name,
+                        'user_message': message.content,
+                        'ai_response': response,
+                        'ai_mode': mode,
+                        'response_time': response_time,
+                        'tokens_used': completion_tokens,
+                        'prompt_tokens': prompt_tokens,
+                        'completion_tokens': completion_tokens,
+                        'total_tokens': total_tokens,
+                        'model': 'gemini-pro',
+                        'message_type': 'auto_response',
+                        'created_at': datetime.now()
+                    })
                     
                     # Update conversation history
                     self.database.update_user_history(
@@ -483,6 +486,9 @@ class DiscordBot(commands.Bot):
                             'response_time': response_time,
                             'timestamp': datetime.now().isoformat()
                         })
+                elif reply.message:
+                    # Stream failed midway: keep what was generated, drop the cursor
+                    await reply.finish(reply.text)
                     
         except Exception as e:
             logger.error(f'Error handling AI response: {e}')
@@ -524,7 +530,7 @@ class DiscordBot(commands.Bot):
                     source_type = "spotify"
                     logger.info("Detected Spotify URL")
                     try:
-                        result = await wavelink.Playable.search(url)
+                        result = await self.track_search.search(url)
                         if isinstance(result, wavelink.Playlist):
                             tracks = result.tracks
                             is_playlist = True
@@ -540,7 +546,7 @@ class DiscordBot(commands.Bot):
                     source_type = "youtube"
                     logger.info(f"Detected URL (YouTube or generic): {url}")
                     try:
-                        result = await wavelink.Playable.search(url)
+                        result = await self.track_search.search(url)
                         logger.info(f"Search result type: {type(result)}")
                         
                         if isinstance(result, wavelink.Playlist):
@@ -566,7 +572,7 @@ class DiscordBot(commands.Bot):
                     source_type = "soundcloud"
                     logger.info("Detected SoundCloud URL")
                     try:
-                        result = await wavelink.Playable.search(url)
+                        result = await self.track_search.search(url)
                         tracks = [result] if result and not isinstance(result, list) else (result if result else [])
                     except Exception as e:
                         logger.error(f"SoundCloud load failed: {e}")
@@ -586,7 +592,7 @@ class DiscordBot(commands.Bot):
                     source_type = "spotify"
                     logger.info("Using Spotify search")
                     try:
-                        tracks = await wavelink.Playable.search(f"spsearch:{recommendation_query}")
+                        tracks = await self.track_search.search(f"spsearch:{recommendation_query}")
                     except Exception as e:
                         logger.error(f"Spotify search failed: {e}")
                 
@@ -596,18 +602,9 @@ class DiscordBot(commands.Bot):
                     
                     try:
                         # ✅ 検索精度向上: ytsearchプレフィックスを使用
-                        # まず単一検索で試す
-                        search_query = f"ytsearch:{recommendation_query}"
-                        logger.info(f"Searching YouTube with query: {search_query}")
-                        
-                        # Use wavelink ytsearch to get results
-                        search_tracks = await wavelink.Playable.search(search_query)
-                        
-                        # If only 1 result or want more options, search for 15
-                        if search_tracks and len(search_tracks) == 1:
-                            search_query = f"ytsearch15:{recommendation_query}"
-                            logger.info(f"Getting more results with: {search_query}")
-                            search_tracks = await wavelink.Playable.search(search_query)
+                        # 選択UI用の15件を1回の検索で取得（キャッシュ・同時検索の集約あり）
+                        logger.info(f"Searching YouTube with query: {recommendation_query}")
+                        search_tracks = await self.track_search.search(recommendation_query, source='ytsearch', limit=15)
                         
                         if search_tracks and len(search_tracks) > 1:
                             # Show selection UI with multiple results
@@ -813,9 +810,10 @@ class DiscordBot(commands.Bot):
             await message.reply(f"❌ 音楽の再生中にエラーが発生しました: {str(e)}")
             return False
     
-    async def handle_music_control(self, message):
+    async def handle_music_control(self, message, intent=None):
         """Handle music control commands in chat"""
-        content = message.content.lower()
+        if intent is None:
+            intent = self.intent_router.classify(message.content)
         music_cog = self.get_cog('MusicPlayer')
         
         if not music_cog:
@@ -824,8 +822,17 @@ class DiscordBot(commands.Bot):
         vc = message.guild.voice_client
         queue = music_cog.get_queue(message.guild.id)
         
+        # Actions are already in priority order; the first one that handles the message wins
+        for action in intent.control_actions:
+            if await self._run_music_control(action, message, intent, vc, queue):
+                return True
+        
+        return False
+    
+    async def _run_music_control(self, action, message, intent, vc, queue):
+        """Run a single music control action"""
         # Skip command
-        if any(cmd in content for cmd in ['スキップ', 'skip', '次', '次の曲', 'つぎ']):
+        if action == 'skip':
             if vc and vc.playing:
                 await vc.stop()
                 await message.reply("⏭️ スキップしました")
@@ -835,7 +842,7 @@ class DiscordBot(commands.Bot):
                 return True
         
         # Stop command
-        if any(cmd in content for cmd in ['停止', 'stop', 'ストップ', '止めて', 'とめて']):
+        if action == 'stop':
             if vc:
                 queue.clear()
                 await vc.disconnect()
@@ -846,7 +853,7 @@ class DiscordBot(commands.Bot):
                 return True
         
         # Disconnect command
-        if any(cmd in content for cmd in ['切断', 'disconnect', '退出', '出て', 'leave', 'でて']):
+        if action == 'disconnect':
             if vc:
                 queue.clear()
                 await vc.disconnect()
@@ -857,21 +864,23 @@ class DiscordBot(commands.Bot):
                 return True
         
         # Pause command
-        if any(cmd in content for cmd in ['一時停止', 'pause', 'ポーズ']):
+        if action == 'pause':
             if vc and vc.playing:
                 await vc.pause(True)
+                self.dispatch('playback_state_change', message.guild.id)
                 await message.reply("⏸️ 一時停止しました")
                 return True
         
         # Resume command
-        if any(cmd in content for cmd in ['再開', 'resume', '続き', 'つづき']):
+        if action == 'resume':
             if vc and vc.paused:
                 await vc.pause(False)
+                self.dispatch('playback_state_change', message.guild.id)
                 await message.reply("▶️ 再開しました")
                 return True
         
         # Queue command
-        if any(cmd in content for cmd in ['キュー', 'queue', '待ち', '次の曲は']):
+        if action == 'queue':
             embed = discord.Embed(title="🎵 音楽キュー", color=0xaa66ff)
             
             if queue.current:
@@ -893,7 +902,7 @@ class DiscordBot(commands.Bot):
             return True
         
         # Now playing command
-        if any(cmd in content for cmd in ['今の曲', '何の曲', 'なんの曲', 'nowplaying', 'np']):
+        if action == 'nowplaying':
             if queue.current and vc:
                 # Get current position
                 position = vc.position // 1000  # Convert to seconds
@@ -923,11 +932,11 @@ class DiscordBot(commands.Bot):
             return True
         
         # Loop command
-        if any(cmd in content for cmd in ['ループ', 'loop', 'リピート', 'repeat']):
-            if 'オフ' in content or 'off' in content:
+        if action == 'loop':
+            if intent.loop_mode == "off":
                 queue.loop_mode = "off"
                 await message.reply("🔁 ループをオフにしました")
-            elif '曲' in content or 'track' in content or '1曲' in content:
+            elif intent.loop_mode == "track":
                 queue.loop_mode = "track"
                 await message.reply("🔂 現在の曲をループします")
             else:
@@ -936,11 +945,9 @@ class DiscordBot(commands.Bot):
             return True
         
         # Volume command
-        if any(cmd in content for cmd in ['音量', 'volume', 'vol']):
-            import re
-            match = re.search(r'(\d+)', content)
-            if match and vc:
-                vol = min(100, max(0, int(match.group(1))))
+        if action == 'volume':
+            if intent.volume is not None and vc:
+                vol = intent.volume
                 await vc.set_volume(vol)
                 await message.reply(f"🔊 音量を {vol}% に設定しました")
                 return True
@@ -1097,6 +1104,11 @@ async def shutdown(bot):
         bot.status_task.cancel()
         logger.info("✅ Status rotation task cancelled")
     
+    if getattr(bot, 'chat_channel_sync_task', None) and not bot.chat_channel_sync_task.done():
+        bot.chat_channel_sync_task.cancel()
+    
+    bot.loop_monitor.stop()
+    
     # Stop music in all guilds
     for guild in bot.guilds:
         if guild.voice_client:
@@ -1109,9 +1121,29 @@ async def shutdown(bot):
             except:
                 pass
     
+    # ✅ Stop Gemini scheduler (pending requests are dropped)
+    try:
+        await bot.gemini_scheduler.close()
+    except Exception as e:
+        logger.error(f"Error stopping Gemini scheduler: {e}")
+    
+    bot.stream_resolver.close()
+    
+    # ✅ Flush pending interaction records before closing connections
+    try:
+        await bot.persistence.close()
+    except Exception as e:
+        logger.error(f"Error flushing persistence pipeline: {e}")
+    
     # Shutdown Supabase client
     await bot.supabase_client.shutdown()
     
+    # Close database (flushes pending SQLite writes)
+    try:
+        await bot.database.close()
+    except Exception as e:
+        logger.error(f"Error closing database: {e}")
+    
     # Close bot
     await bot.close()
     
@@ -176,6 +176,7 @@ class MusicPlayerView(View):
         vc = self.get_vc()
         if vc:
             await vc.seek(0)
+            self.bot.dispatch('playback_state_change', self.guild_id)
             await interaction.response.edit_message(embed=self.create_embed(), view=self)
         else:
             await interaction.response.defer()
@@ -191,6 +192,7 @@ class MusicPlayerView(View):
             else:
                 await vc.pause(True)
                 button.emoji = "▶️"
+            self.bot.dispatch('playback_state_change', self.guild_id)
             await interaction.response.edit_message(embed=self.create_embed(), view=self)
         else:
             await interaction.response.defer()
@@ -0,0 +1,165 @@
+"""AI応答後の永続化処理をまとめて書き込むwrite-behindパイプライン"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PersistencePipeline:
+    """「インタラクション完了」レコードを受け取り、バッチでDB/Supabaseへ書き込む
+
+    呼び出し元は submit() でキューに積むだけで即座に戻る。
+    キューが満杯の場合は submit() が空きを待つ（バックプレッシャー）。
+    """
+
+    def __init__(self, database, supabase_client=None, max_queue_size: int = 5000,
+                 batch_size: int = 200, flush_interval: float = 1.0, max_retries: int = 3):
+        self.database = database
+        self.supabase_client = supabase_client
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.flush_task: Optional[asyncio.Task] = None
+        self.is_running = False
+
+        # 統計
+        self.stats = {
+            'submitted': 0,
+            'flushed': 0,
+            'batches': 0,
+            'dropped': 0,
+            'last_flush_ms': 0.0
+        }
+
+    async def start(self):
+        """フラッシュループを開始"""
+        if self.is_running:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.is_running = True
+        self.flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"✅ Persistence pipeline started (batch={self.batch_size}, interval={self.flush_interval}s)")
+
+    async def submit(self, record: Dict):
+        """インタラクション完了レコードをキューに追加"""
+        if not self.is_running:
+            # パイプライン停止中は同期的に書き込む
+            await self._flush_batch([record])
+            return
+
+        if self.queue.full():
+            logger.warning("⚠️ Persistence queue is full, applying backpressure")
+        await self.queue.put(record)
+        self.stats['submitted'] += 1
+
+    def get_stats(self) -> Dict:
+        """パイプラインの統計を取得"""
+        return {
+            **self.stats,
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            'queue_capacity': self.max_queue_size
+        }
+
+    async def _flush_loop(self):
+        """レコードを集めて一定件数・一定間隔でフラッシュ"""
+        while self.is_running:
+            try:
+                batch = await self._collect_batch()
+                if batch:
+                    await self._flush_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Persistence flush loop error: {e}")
+                await asyncio.sleep(1)
+
+    async def _collect_batch(self) -> List[Dict]:
+        """最初のレコードを待ち、flush_interval内に届いた分をまとめる"""
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    def _drain(self) -> List[Dict]:
+        """キューに残っているレコードをすべて取り出す"""
+        records = []
+        while self.queue and not self.queue.empty():
+            records.append(self.queue.get_nowait())
+        return records
+
+    async def _flush_batch(self, batch: List[Dict]):
+        """バッチをDB（1トランザクション）とSupabaseに書き込む"""
+        start = time.perf_counter()
+
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await self.database.save_interactions(batch)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    logger.error(f"❌ Dropping {len(batch)} interaction records after {attempt} attempts: {e}")
+                    self.stats['dropped'] += len(batch)
+                    return
+                logger.warning(f"⚠️ Interaction batch write failed (attempt {attempt}): {e}")
+                await asyncio.sleep(0.5 * attempt)
+
+        if self.supabase_client and self.supabase_client.client:
+            try:
+                await self.supabase_client.save_conversation_logs([{
+                    'user_id': str(r['user_id']),
+                    'user_name': r['username'],
+                    'prompt': r['user_message'],
+                    'response': r['ai_response']
+                } for r in batch])
+
+                await self.supabase_client.log_gemini_usage_batch([{
+                    'guild_id': str(r['guild_id']),
+                    'user_id': str(r['user_id']),
+                    'prompt_tokens': int(r['prompt_tokens']),
+                    'completion_tokens': int(r['completion_tokens']),
+                    'total_tokens': int(r['total_tokens']),
+                    'model': str(r.get('model', 'gemini-pro'))
+                } for r in batch])
+            except Exception as e:
+                logger.error(f"Failed to save conversation logs to Supabase: {e}")
+
+        self.stats['flushed'] += len(batch)
+        self.stats['batches'] += 1
+        self.stats['last_flush_ms'] = (time.perf_counter() - start) * 1000
+        logger.debug(f"💾 Flushed {len(batch)} interactions in {self.stats['last_flush_ms']:.1f}ms")
+
+    async def close(self):
+        """ループを停止し、残りのレコードをすべてフラッシュ"""
+        if not self.is_running:
+            return
+        self.is_running = False
+
+        # 実行中のバッチを失わないよう、キャンセルせずにループの終了を待つ
+        if self.flush_task and not self.flush_task.done():
+            try:
+                await self.flush_task
+            except Exception as e:
+                logger.error(f"Error stopping persistence flush loop: {e}")
+
+        remaining = self._drain()
+        for i in range(0, len(remaining), self.batch_size):
+            await self._flush_batch(remaining[i:i + self.batch_size])
+
+        logger.info(f"✅ Persistence pipeline closed ({len(remaining)} records flushed on shutdown)")
@@ -0,0 +1,182 @@
+"""Supabaseのログテーブルに件数・期間の上限を適用する定期タスク"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+RPC_NAME = 'enforce_log_retention'
+
+# テーブル -> (最大件数, 最大日数)。None は無制限
+DEFAULT_POLICIES = {
+    'bot_logs': (200000, None),
+    'lyrics_logs': (100000, None),
+    'system_stats': (None, 7),
+    'network_stats': (None, 7),
+}
+
+
+def load_policies() -> Dict[str, tuple]:
+    """RETENTION_<TABLE>_MAX_ROWS / RETENTION_<TABLE>_MAX_DAYS で上書き（0 は無制限）"""
+    policies = {}
+    for table, (max_rows, max_days) in DEFAULT_POLICIES.items():
+        prefix = f'RETENTION_{table.upper()}'
+        max_rows = int(os.getenv(f'{prefix}_MAX_ROWS', max_rows or 0)) or None
+        max_days = float(os.getenv(f'{prefix}_MAX_DAYS', max_days or 0)) or None
+        policies[table] = (max_rows, max_days)
+    return policies
+
+
+class SupabaseRetentionManager:
+    """bot_logs / lyrics_logs / system_stats / network_stats の古い行を削除する
+
+    - 1テーブルにつき enforce_log_retention のRPCを1回（件数・期間の境界を求めて
+      created_at で一括削除するのはDB側）
+    - 関数が未作成の場合は PostgREST の境界取得 + 範囲削除（2リクエスト）にフォールバック
+    - 1回の削除は batch_size 件まで。上限に達したテーブルは次の周期を待たずに続けて削除
+    """
+
+    def __init__(self, supabase_client, interval: float = None, batch_size: int = None,
+                 policies: Dict[str, tuple] = None):
+        self.supabase_client = supabase_client
+        self.interval = interval or float(os.getenv('RETENTION_INTERVAL', 3600))
+        self.batch_size = batch_size or int(os.getenv('RETENTION_BATCH_SIZE', 50000))
+        self.policies = policies or load_policies()
+
+        self.rpc_available = True
+        self.task: Optional[asyncio.Task] = None
+
+        # 統計
+        self.stats = {
+            'runs': 0,
+            'rows_reclaimed': 0,
+            'errors': 0,
+            'last_run_ms': 0.0,
+            'last_run_at': None
+        }
+        self.reclaimed: Dict[str, int] = {table: 0 for table in self.policies}
+
+    def start(self):
+        """定期実行を開始"""
+        if self.task:
+            return
+        self.task = asyncio.create_task(self._loop())
+        logger.info(f"✅ Log retention manager started (interval={self.interval}s)")
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run_once(self) -> Dict[str, int]:
+        """全テーブルに上限を適用し、テーブルごとの削除件数を返す"""
+        start = time.perf_counter()
+        result = {}
+        for table, (max_rows, max_days) in self.policies.items():
+            if not max_rows and not max_days:
+                continue
+            try:
+                deleted = 0
+                while True:
+                    count = await self.enforce(table, max_rows, max_days)
+                    deleted += count
+                    if count < self.batch_size:
+                        break
+                result[table] = deleted
+                self.reclaimed[table] += deleted
+                self.stats['rows_reclaimed'] += deleted
+            except Exception as e:
+                self.stats['errors'] += 1
+                if 'does not exist' in str(e) or '42P01' in str(e):
+                    logger.warning(f"⚠️ {table} table does not exist. Skipping retention.")
+                else:
+                    logger.error(f"❌ Retention failed for {table}: {e}")
+
+        self.stats['runs'] += 1
+        self.stats['last_run_ms'] = (time.perf_counter() - start) * 1000
+        self.stats['last_run_at'] = datetime.now().isoformat()
+        if any(result.values()):
+            summary = ', '.join(f"{table}={count}" for table, count in result.items() if count)
+            logger.info(f"🗑️ Log retention reclaimed rows: {summary}")
+        return result
+
+    async def enforce(self, table: str, max_rows: Optional[int], max_days: Optional[float]) -> int:
+        """1テーブル分の削除を1回実行"""
+        if self.rpc_available:
+            try:
+                return await self._enforce_rpc(table, max_rows, max_days)
+            except Exception as e:
+                # 関数が未作成（PGRST202）の場合のみフォールバック
+                if 'PGRST202' not in str(e) and 'Could not find the function' not in str(e):
+                    raise
+                self.rpc_available = False
+                logger.warning(f"⚠️ {RPC_NAME}() not found, using REST fallback. Please run add_log_retention.sql in Supabase.")
+        return await self._enforce_rest(table, max_rows, max_days)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'mode': 'rpc' if self.rpc_available else 'rest',
+            'reclaimed_by_table': dict(self.reclaimed)
+        }
+
+    async def _enforce_rpc(self, table: str, max_rows: Optional[int], max_days: Optional[float]) -> int:
+        client = self.supabase_client
+        result = await client.execute(client.client.rpc(RPC_NAME, {
+            'p_table': table,
+            'p_max_rows': max_rows,
+            'p_max_age': f'{max_days} days' if max_days else None,
+            'p_batch_size': self.batch_size
+        }))
+        return int(result.data or 0)
+
+    async def _enforce_rest(self, table: str, max_rows: Optional[int], max_days: Optional[float]) -> int:
+        """PostgREST経由：境界の created_at を求め、それより古い行を1回の DELETE で削除"""
+        client = self.supabase_client
+        thresholds = []
+
+        if max_days:
+            thresholds.append((datetime.now(timezone.utc) - timedelta(days=max_days)).isoformat())
+
+        if max_rows:
+            # 新しい方から (max_rows + 1) 件目だけを取得
+            boundary = await client.execute(
+                client.client.table(table)
+                .select('created_at')
+                .order('created_at', desc=True)
+                .range(max_rows, max_rows)
+            )
+            if boundary.data:
+                thresholds.append(boundary.data[0]['created_at'])
+
+        if not thresholds:
+            return 0
+
+        # 新しい方の境界を採用（境界の行自体も削除対象に含める）
+        threshold = max(thresholds, key=lambda value: datetime.fromisoformat(value.replace('Z', '+00:00')))
+        result = await client.execute(
+            client.client.table(table)
+            .delete(count='exact', returning='minimal')
+            .lte('created_at', threshold)
+        )
+        return result.count or 0
+
+    async def _loop(self):
+        # 起動直後は他の初期化を優先する
+        await asyncio.sleep(60)
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"❌ Log retention loop error: {e}")
+            await asyncio.sleep(self.interval)
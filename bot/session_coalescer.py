@@ -0,0 +1,139 @@
+"""active_sessions への書き込みをギルド単位で間引くバッファ"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ActiveSessionCoalescer:
+    """ギルドごとに最新のセッション状態だけを保持し、一定間隔でまとめてupsertする
+
+    - 同じギルドへの更新は後勝ち（フラッシュ前の古い状態は捨てる）
+    - 前回書き込んだ内容と同じ状態は送らない
+    - セッション終了（delete）は保留中の更新を破棄して即座に反映する
+    """
+
+    def __init__(self, supabase_client, flush_interval: float = None):
+        self.supabase_client = supabase_client
+        self.flush_interval = flush_interval or float(os.getenv('ACTIVE_SESSION_FLUSH_INTERVAL', 5))
+
+        self.pending: Dict[str, Dict] = {}
+        self.last_written: Dict[str, Dict] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self.flush_task: Optional[asyncio.Task] = None
+        self.is_running = False
+
+        # 統計
+        self.stats = {
+            'submitted': 0,
+            'coalesced': 0,
+            'skipped_noop': 0,
+            'upserted': 0,
+            'deleted': 0,
+            'flushes': 0,
+            'errors': 0,
+            'last_flush_ms': 0.0
+        }
+
+    def start(self):
+        """フラッシュループを開始"""
+        if self.is_running:
+            return
+        self.is_running = True
+        self.flush_task = asyncio.create_task(self._flush_loop())
+        logger.info(f"✅ Active session coalescer started (interval={self.flush_interval}s)")
+
+    def submit(self, session_data: Dict):
+        """最新のセッション状態を登録（書き込みは次のフラッシュで行う）"""
+        guild_id = session_data['guild_id']
+        self.stats['submitted'] += 1
+
+        if self.last_written.get(guild_id) == session_data:
+            # 書き込み済みの状態と同じなら保留中の更新も不要
+            if self.pending.pop(guild_id, None) is not None:
+                self.stats['coalesced'] += 1
+            self.stats['skipped_noop'] += 1
+            return
+
+        if guild_id in self.pending:
+            self.stats['coalesced'] += 1
+        self.pending[guild_id] = session_data
+
+    async def clear(self, guild_id: str):
+        """セッション終了を即座に反映"""
+        # 実行中のフラッシュが終わってから削除する（削除後に古い状態が復活しないように）
+        async with self._get_lock():
+            self.pending.pop(guild_id, None)
+            await self.supabase_client.execute(
+                self.supabase_client.client.table('active_sessions')
+                .delete()
+                .eq('guild_id', guild_id)
+            )
+            self.last_written.pop(guild_id, None)
+            self.stats['deleted'] += 1
+
+    async def flush(self):
+        """保留中の状態を1回のupsertで書き込む"""
+        if not self.pending:
+            return
+
+        async with self._get_lock():
+            rows = self.pending
+            self.pending = {}
+            if not rows:
+                return
+
+            start = time.perf_counter()
+            try:
+                await self.supabase_client.execute(
+                    self.supabase_client.client.table('active_sessions').upsert(list(rows.values()))
+                )
+                self.last_written.update(rows)
+                self.stats['upserted'] += len(rows)
+                self.stats['flushes'] += 1
+                self.stats['last_flush_ms'] = (time.perf_counter() - start) * 1000
+                logger.debug(f"📊 Active sessions flushed: {len(rows)} guilds")
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"❌ Failed to flush active sessions: {e}")
+                # 新しい状態が来ていないギルドだけ戻して次回再送
+                for guild_id, row in rows.items():
+                    self.pending.setdefault(guild_id, row)
+
+    def get_stats(self) -> Dict:
+        """バッファの統計を取得"""
+        return {
+            **self.stats,
+            'pending': len(self.pending),
+            'tracked_guilds': len(self.last_written)
+        }
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _flush_loop(self):
+        while self.is_running:
+            try:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Active session flush loop error: {e}")
+
+    async def close(self):
+        """ループを止めて残りを書き込む"""
+        self.is_running = False
+        if self.flush_task:
+            self.flush_task.cancel()
+            try:
+                await self.flush_task
+            except asyncio.CancelledError:
+                pass
+            self.flush_task = None
+        await self.flush()
@@ -0,0 +1,192 @@
+"""SQLiteフォールバック用の永続接続エンジン"""
+import asyncio
+import logging
+from typing import Any, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteEngine:
+    """1本の書き込み接続 + 読み取り接続プールを保持するSQLiteエンジン
+
+    - WALモードで読み取りと書き込みを並行実行
+    - 書き込みはキューに積み、まとめて1トランザクションでコミット（グループコミット）
+    - sqlite3のステートメントキャッシュでプリペアドステートメントを再利用
+    """
+
+    def __init__(self, db_path: str, readers: int = 4, batch_size: int = 256,
+                 statement_cache_size: int = 256):
+        self.db_path = db_path
+        self.reader_count = max(1, readers)
+        self.batch_size = batch_size
+        self.statement_cache_size = statement_cache_size
+
+        self._writer = None
+        self._readers: Optional[asyncio.Queue] = None
+        self._reader_conns: List[Any] = []
+        self._write_queue: Optional[asyncio.Queue] = None
+        self._write_task: Optional[asyncio.Task] = None
+
+        # 統計
+        self.stats = {
+            'writes': 0,
+            'commits': 0,
+            'reads': 0
+        }
+
+    async def _connect(self):
+        """PRAGMAを設定済みの接続を作成"""
+        import aiosqlite
+        conn = await aiosqlite.connect(self.db_path, cached_statements=self.statement_cache_size)
+        await conn.execute('PRAGMA journal_mode=WAL')
+        await conn.execute('PRAGMA synchronous=NORMAL')
+        await conn.execute('PRAGMA busy_timeout=5000')
+        return conn
+
+    async def start(self):
+        """接続を開いて書き込みループを開始"""
+        if self._writer is not None:
+            return
+
+        self._writer = await self._connect()
+
+        self._readers = asyncio.Queue()
+        for _ in range(self.reader_count):
+            conn = await self._connect()
+            self._reader_conns.append(conn)
+            self._readers.put_nowait(conn)
+
+        self._write_queue = asyncio.Queue()
+        self._write_task = asyncio.create_task(self._write_loop())
+        logger.info(f"✅ SQLite engine started ({self.db_path}, WAL, {self.reader_count} readers)")
+
+    async def execute(self, query: str, args: Sequence = ()) -> int:
+        """書き込みクエリをキューに積み、コミット完了まで待機"""
+        if self._write_queue is None:
+            raise RuntimeError("SQLite engine is not started")
+
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((query, tuple(args), future))
+        return await future
+
+    async def optimize(self):
+        """必要なテーブルだけ ANALYZE し、読み取り接続に新しい統計を読み込ませる
+
+        統計がないとプランナーが複合インデックスを活かせないため、テーブル・インデックスの
+        作成後に呼ぶ。読み取り接続は統計をスキーマの読み込み時にしか読まないため、
+        ANALYZE sqlite_schema で再読み込みさせる。
+        """
+        await self.execute('PRAGMA optimize=0x10002')
+
+        conns = [await self._readers.get() for _ in range(self.reader_count)]
+        try:
+            for conn in conns:
+                await conn.execute('ANALYZE sqlite_schema')
+        finally:
+            for conn in conns:
+                self._readers.put_nowait(conn)
+
+    async def fetchone(self, query: str, args: Sequence = ()) -> Optional[Tuple]:
+        """読み取り接続で1行取得"""
+        conn = await self._readers.get()
+        try:
+            cursor = await conn.execute(query, tuple(args))
+            row = await cursor.fetchone()
+            await cursor.close()
+            self.stats['reads'] += 1
+            return row
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def fetchall(self, query: str, args: Sequence = ()) -> List[Tuple]:
+        """読み取り接続で全行取得"""
+        conn = await self._readers.get()
+        try:
+            cursor = await conn.execute(query, tuple(args))
+            rows = await cursor.fetchall()
+            await cursor.close()
+            self.stats['reads'] += 1
+            return rows
+        finally:
+            self._readers.put_nowait(conn)
+
+    async def _write_loop(self):
+        """キューに溜まった書き込みをまとめて1回のコミットで反映"""
+        while True:
+            item = await self._write_queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    next_item = self._write_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                if next_item is None:
+                    stop = True
+                    break
+                batch.append(next_item)
+
+            await self._flush_batch(batch)
+
+            if stop:
+                break
+
+    async def _flush_batch(self, batch: List[Tuple[str, Tuple, asyncio.Future]]):
+        """バッチを実行してコミットし、待機中の呼び出し元に結果を返す"""
+        results = []
+        for query, args, future in batch:
+            try:
+                cursor = await self._writer.execute(query, args)
+                results.append((future, cursor.rowcount, None))
+                await cursor.close()
+            except Exception as e:
+                results.append((future, None, e))
+
+        try:
+            await self._writer.commit()
+            self.stats['commits'] += 1
+            self.stats['writes'] += len(batch)
+        except Exception as e:
+            logger.error(f"❌ SQLite group commit failed: {e}")
+            try:
+                await self._writer.rollback()
+            except Exception:
+                pass
+            results = [(future, None, e) for future, _, _ in results]
+
+        for future, rowcount, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(rowcount)
+
+    async def close(self):
+        """保留中の書き込みをフラッシュしてから接続を閉じる"""
+        if self._write_task:
+            await self._write_queue.put(None)
+            try:
+                await self._write_task
+            except Exception as e:
+                logger.error(f"Error stopping SQLite write loop: {e}")
+            self._write_task = None
+
+        for conn in self._reader_conns:
+            try:
+                await conn.close()
+            except Exception:
+                pass
+        self._reader_conns.clear()
+
+        if self._writer:
+            try:
+                await self._writer.close()
+            except Exception:
+                pass
+            self._writer = None
+
+        logger.info("✅ SQLite engine closed")
@@ -0,0 +1,169 @@
+"""全体・ギルドごとの累計統計（書き込み時に更新するロールアップ）"""
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_SCOPE = 0  # scope_id = 0 は全体（ユニークユーザー数のみ）、それ以外は guild_id
+
+EMPTY_SUMMARY = {
+    'total_messages': 0,
+    'total_tokens': 0,
+    'unique_users': 0,
+    'total_music': 0
+}
+
+CREATE_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS stats_rollup (
+        scope_id BIGINT PRIMARY KEY,
+        total_messages BIGINT NOT NULL DEFAULT 0,
+        total_tokens DOUBLE PRECISION NOT NULL DEFAULT 0,
+        unique_users BIGINT NOT NULL DEFAULT 0,
+        total_music BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # ユニークユーザー判定用（行数はメッセージ数ではなくユーザー数に比例）
+    '''
+    CREATE TABLE IF NOT EXISTS stats_rollup_users (
+        scope_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        PRIMARY KEY (scope_id, user_id)
+    )
+    '''
+]
+
+# 既存データからの初回集計（複数プロセスが同時に起動しても1回だけ実行）
+BACKFILL_SQL = [
+    'SELECT pg_advisory_xact_lock(hashtext(\'stats_rollup_backfill\'))',
+    '''
+    INSERT INTO stats_rollup_users (scope_id, user_id)
+    SELECT DISTINCT guild_id, user_id FROM chat_logs
+    UNION
+    SELECT DISTINCT 0, user_id FROM chat_logs
+    ON CONFLICT DO NOTHING
+    ''',
+    '''
+    INSERT INTO stats_rollup (scope_id, total_messages, total_tokens)
+    SELECT guild_id, COUNT(*), COALESCE(SUM(tokens_used), 0) FROM chat_logs GROUP BY guild_id
+    ON CONFLICT (scope_id) DO UPDATE SET
+        total_messages = EXCLUDED.total_messages,
+        total_tokens = EXCLUDED.total_tokens
+    ''',
+    '''
+    INSERT INTO stats_rollup (scope_id, total_music)
+    SELECT guild_id, COUNT(*) FROM playback_history GROUP BY guild_id
+    ON CONFLICT (scope_id) DO UPDATE SET total_music = EXCLUDED.total_music
+    ''',
+    '''
+    UPDATE stats_rollup r SET unique_users = u.total, updated_at = CURRENT_TIMESTAMP
+    FROM (SELECT scope_id, COUNT(*) AS total FROM stats_rollup_users GROUP BY scope_id) u
+    WHERE r.scope_id = u.scope_id
+    '''
+]
+
+UPSERT_CHAT_SQL = '''
+    INSERT INTO stats_rollup (scope_id, total_messages, total_tokens, unique_users)
+    VALUES ($1, $2, $3, $4)
+    ON CONFLICT (scope_id) DO UPDATE SET
+        total_messages = stats_rollup.total_messages + EXCLUDED.total_messages,
+        total_tokens = stats_rollup.total_tokens + EXCLUDED.total_tokens,
+        unique_users = stats_rollup.unique_users + EXCLUDED.unique_users,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+UPSERT_MUSIC_SQL = '''
+    INSERT INTO stats_rollup (scope_id, total_music)
+    VALUES ($1, $2)
+    ON CONFLICT (scope_id) DO UPDATE SET
+        total_music = stats_rollup.total_music + EXCLUDED.total_music,
+        updated_at = CURRENT_TIMESTAMP
+'''
+
+
+class StatsRollup:
+    """chat_logs / playback_history の累計を stats_rollup に保持する（PostgreSQL）
+
+    - 書き込みと同じトランザクションでギルドの行に加算するので、ギルドの読み取りは主キー検索1回で済む
+    - 全体のメッセージ数・トークン数・再生数はギルドの行の合計として読む（全ての書き込みが
+      1つの行を更新して直列化しないよう、全体の行には加算しない）
+    - ユニークユーザーは (scope, user) の集合に INSERT ... ON CONFLICT DO NOTHING し、
+      新規に入った件数だけ加算する（COUNT(DISTINCT) を毎回実行しない）。全体の行を更新するのは
+      初めて見るユーザーの場合だけ
+    - 行ロックの順序を揃えるため、更新は常に scope_id の昇順で行う
+    """
+
+    async def create_tables(self, conn):
+        for sql in CREATE_SQL:
+            await conn.execute(sql)
+
+        exists = await conn.fetchval('SELECT 1 FROM stats_rollup WHERE scope_id = $1', GLOBAL_SCOPE)
+        if not exists:
+            await self.backfill(conn)
+
+    async def backfill(self, conn):
+        """既存の履歴からロールアップを作り直す（初回のみ）"""
+        async with conn.transaction():
+            for sql in BACKFILL_SQL:
+                await conn.execute(sql)
+            await conn.execute('''
+                INSERT INTO stats_rollup (scope_id) VALUES ($1) ON CONFLICT DO NOTHING
+            ''', GLOBAL_SCOPE)
+        logger.info("✅ Stats rollup backfilled from existing history")
+
+    async def record_chats(self, conn, rows: Iterable[Tuple[int, int, float]]):
+        """(guild_id, user_id, tokens_used) をロールアップに加算"""
+        totals: Dict[int, List[float]] = {}
+        pairs = set()
+        for guild_id, user_id, tokens_used in rows:
+            entry = totals.setdefault(guild_id, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += tokens_used or 0
+            pairs.add((guild_id, user_id))
+            pairs.add((GLOBAL_SCOPE, user_id))
+
+        if not totals:
+            return
+
+        pairs = sorted(pairs)
+        inserted = await conn.fetch('''
+            INSERT INTO stats_rollup_users (scope_id, user_id)
+            SELECT * FROM unnest($1::bigint[], $2::bigint[])
+            ON CONFLICT DO NOTHING
+            RETURNING scope_id
+        ''', [scope_id for scope_id, _ in pairs], [user_id for _, user_id in pairs])
+        for row in inserted:
+            totals.setdefault(row['scope_id'], [0, 0.0, 0])[2] += 1
+
+        await conn.executemany(UPSERT_CHAT_SQL, [
+            (scope_id, messages, tokens, new_users)
+            for scope_id, (messages, tokens, new_users) in sorted(totals.items())
+        ])
+
+    async def record_playback(self, conn, guild_id: int, count: int = 1):
+        await conn.execute(UPSERT_MUSIC_SQL, guild_id, count)
+
+    async def fetch(self, conn, guild_id: Optional[int] = None) -> Dict:
+        """全体（guild_id=None）またはギルドの累計を1クエリで取得"""
+        if guild_id is None:
+            row = await conn.fetchrow('''
+                SELECT COALESCE(SUM(total_messages), 0) AS total_messages,
+                       COALESCE(SUM(total_tokens), 0) AS total_tokens,
+                       COALESCE(SUM(total_music), 0) AS total_music,
+                       (SELECT unique_users FROM stats_rollup WHERE scope_id = $1) AS unique_users
+                FROM stats_rollup WHERE scope_id <> $1
+            ''', GLOBAL_SCOPE)
+        else:
+            row = await conn.fetchrow('''
+                SELECT total_messages, total_tokens, unique_users, total_music
+                FROM stats_rollup WHERE scope_id = $1
+            ''', guild_id)
+        if not row:
+            return dict(EMPTY_SUMMARY)
+        return {
+            'total_messages': row['total_messages'],
+            'total_tokens': int(row['total_tokens']),
+            'unique_users': row['unique_users'] or 0,
+            'total_music': row['total_music']
+        }
@@ -0,0 +1,183 @@
+"""Web再生用ストリームURLの解決（yt-dlpをプロセスプールで実行）"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FORMAT = 'bestaudio/best'
+EXPIRY_MARGIN = 60  # 署名の期限よりこの秒数だけ早くキャッシュを捨てる
+
+
+def extract_stream_info(uri: str, fmt: str = DEFAULT_FORMAT) -> Optional[Dict]:
+    """yt-dlpでストリーム情報を取得する（ワーカープロセス内で実行される）"""
+    import yt_dlp
+
+    ydl_opts = {
+        'format': fmt,
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(uri, download=False)
+        if not info or 'url' not in info:
+            return None
+        return {
+            'url': info['url'],
+            'ext': info.get('ext'),
+            'abr': info.get('abr'),
+            'duration': info.get('duration', 0)
+        }
+
+
+def signed_expiry(url: str) -> Optional[float]:
+    """署名付きURLの expire パラメータ（UNIX時刻）を読む"""
+    try:
+        values = parse_qs(urlparse(url).query).get('expire')
+        return float(values[0]) if values else None
+    except (ValueError, TypeError):
+        return None
+
+
+class StreamResolver:
+    """ストリームURLの解決サービス
+
+    - 抽出はプロセスプールで実行し、イベントループをブロックしない
+    - 解決済みURLは署名の期限までキャッシュ
+    - 同じURIへの同時リクエストは1回の抽出にまとめる（single-flight）
+    - 同時抽出数はセマフォで制限
+
+    extractor / executor を差し替えるとテスト用のスタブで動かせる。
+    """
+
+    def __init__(self, extractor: Callable[[str, str], Optional[Dict]] = None,
+                 executor: Optional[Executor] = None, max_workers: int = None,
+                 max_concurrency: int = None, timeout: float = None,
+                 cache_size: int = 512, default_ttl: float = None):
+        self.extractor = extractor or extract_stream_info
+        self.max_workers = max_workers or int(os.getenv('STREAM_RESOLVER_WORKERS', 2))
+        self.max_concurrency = max_concurrency or int(os.getenv('STREAM_RESOLVER_MAX_CONCURRENCY', self.max_workers))
+        self.timeout = timeout or float(os.getenv('STREAM_RESOLVER_TIMEOUT', 30))
+        self.default_ttl = default_ttl or float(os.getenv('STREAM_URL_TTL', 1800))
+        self.cache_size = cache_size
+
+        self._executor = executor
+        self._owns_executor = executor is None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.cache: "OrderedDict[Tuple[str, str], Tuple[Dict, float]]" = OrderedDict()
+        self.inflight = SingleFlight()
+
+        # 統計
+        self.stats = {
+            'requests': 0,
+            'cache_hits': 0,
+            'coalesced': 0,
+            'extractions': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'avg_extract_ms': 0.0
+        }
+
+    async def resolve(self, uri: str, fmt: str = DEFAULT_FORMAT) -> Optional[Dict]:
+        """ストリーム情報（url, ext, abr, duration, expires_at）を返す。取得できなければNone"""
+        self.stats['requests'] += 1
+        key = (uri, fmt)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            info, expires_at = cached
+            if expires_at > time.time():
+                self.cache.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return info
+            del self.cache[key]
+
+        if key in self.inflight:
+            self.stats['coalesced'] += 1
+        # 誰かがキャンセルされても、他の待機者には結果が届く
+        return await self.inflight.do(key, lambda: self._resolve(key, uri, fmt))
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            'cached': len(self.cache),
+            'inflight': len(self.inflight),
+            'workers': self.max_workers
+        }
+
+    def close(self):
+        if self._executor and self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            # fork は動作中のスレッドやイベントループを複製してしまうため spawn を使う
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            self._owns_executor = True
+        return self._executor
+
+    async def _resolve(self, key: Tuple[str, str], uri: str, fmt: str) -> Optional[Dict]:
+        info = await self._extract(uri, fmt)
+        if info:
+            info = self._remember(key, info)
+        return info
+
+    async def _extract(self, uri: str, fmt: str) -> Optional[Dict]:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            try:
+                info = await asyncio.wait_for(
+                    loop.run_in_executor(self._get_executor(), self.extractor, uri, fmt),
+                    timeout=self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.stats['timeouts'] += 1
+                logger.warning(f"⚠️ Stream URL extraction timed out after {self.timeout}s: {uri}")
+                return None
+            except BrokenProcessPool:
+                # ワーカーが落ちた場合はプールを作り直す
+                self.stats['failures'] += 1
+                logger.error("❌ Stream resolver worker pool crashed, restarting")
+                self.close()
+                return None
+            except Exception as e:
+                self.stats['failures'] += 1
+                logger.error(f"❌ Stream URL extraction failed: {e}")
+                return None
+
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.stats['extractions'] += 1
+            self.stats['avg_extract_ms'] += (elapsed_ms - self.stats['avg_extract_ms']) / self.stats['extractions']
+            return info
+
+    def _remember(self, key: Tuple[str, str], info: Dict) -> Dict:
+        expires_at = signed_expiry(info['url'])
+        if expires_at is None:
+            expires_at = time.time() + self.default_ttl
+        expires_at -= EXPIRY_MARGIN
+        info = {**info, 'expires_at': expires_at}
+
+        self.cache[key] = (info, expires_at)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return info
@@ -4,11 +4,15 @@ import logging
 import asyncio
 import psutil
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 from discord.ext import tasks
 from supabase import create_client, Client
 from dotenv import load_dotenv
+from session_coalescer import ActiveSessionCoalescer
+from command_queue import CommandQueueConsumer
+from retention_manager import SupabaseRetentionManager
 
 load_dotenv()
 logger = logging.getLogger(__name__)
@@ -25,7 +29,49 @@ class SupabaseClient:
         self.realtime_channel = None
         self.is_running = False
         self._last_net_io = None  # ✅ ネットワークI/O統計の前回値
-        
+        self.session_coalescer = ActiveSessionCoalescer(self)  # ✅ active_sessionsの更新をまとめて書き込む
+        self.command_consumer = CommandQueueConsumer(self)  # ✅ コマンドキューをプッシュ通知で受け取る
+        self.retention = SupabaseRetentionManager(self)  # ✅ ログテーブルの件数・期間上限をDB側で適用
+        
+        # ✅ supabase-pyは同期クライアントなので、.execute() は専用スレッドプールで実行する
+        self.max_concurrency = int(os.getenv('SUPABASE_MAX_CONCURRENCY', 8))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix='supabase')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.io_stats = {
+            'requests': 0,
+            'errors': 0,
+            'in_flight': 0,
+            'waiting': 0,
+            'avg_ms': 0.0,
+            'max_ms': 0.0
+        }
+        
+    async def execute(self, query):
+        """クエリをスレッドプールで実行して結果を返す（イベントループをブロックしない）"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        
+        self.io_stats['waiting'] += 1
+        async with self._semaphore:
+            self.io_stats['waiting'] -= 1
+            self.io_stats['in_flight'] += 1
+            start = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, query.execute)
+            except Exception:
+                self.io_stats['errors'] += 1
+                raise
+            finally:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                self.io_stats['in_flight'] -= 1
+                self.io_stats['requests'] += 1
+                self.io_stats['avg_ms'] += (elapsed_ms - self.io_stats['avg_ms']) / self.io_stats['requests']
+                self.io_stats['max_ms'] = max(self.io_stats['max_ms'], elapsed_ms)
+    
+    def get_io_stats(self) -> Dict:
+        """Supabase I/Oの統計を取得"""
+        return {**self.io_stats, 'max_concurrency': self.max_concurrency}
+    
     async def initialize(self):
         """Supabaseクライアントを初期化"""
         if not self.supabase_url or not self.supabase_key:
@@ -44,6 +90,8 @@ class SupabaseClient:
             
             # tasks.loopでヘルスモニターを開始
             self.is_running = True
+            self.session_coalescer.start()
+            self.retention.start()
             if not self.health_monitor_loop.is_running():
                 self.health_monitor_loop.start()
             
@@ -58,21 +106,21 @@ class SupabaseClient:
         """必要なテーブルが存在することを確認"""
         try:
             # system_stats テーブルの確認
-            result = self.client.table('system_stats').select('*').limit(1).execute()
+            result = await self.execute(self.client.table('system_stats').select('*').limit(1))
             logger.info("✅ system_stats table exists")
         except Exception as e:
             logger.warning(f"⚠️  system_stats table check failed: {e}")
         
         try:
             # command_queue テーブルの確認
-            result = self.client.table('command_queue').select('*').limit(1).execute()
+            result = await self.execute(self.client.table('command_queue').select('*').limit(1))
             logger.info("✅ command_queue table exists")
         except Exception as e:
             logger.warning(f"⚠️  command_queue table check failed: {e}")
         
         try:
             # active_sessions テーブルの確認
-            result = self.client.table('active_sessions').select('*').limit(1).execute()
+            result = await self.execute(self.client.table('active_sessions').select('*').limit(1))
             logger.info("✅ active_sessions table exists")
         except Exception as e:
             logger.warning(f"⚠️  active_sessions table check failed: {e}")
@@ -98,8 +146,8 @@ class SupabaseClient:
             return
         
         try:
-            # CPU使用率
-            cpu_usage = psutil.cpu_percent(interval=0.1)
+            # CPU使用率（前回呼び出しからの平均。interval指定はループをブロックするため使わない）
+            cpu_usage = psutil.cpu_percent(interval=None)
             
             # システム全体のメモリ使用率
             memory = psutil.virtual_memory()
@@ -140,7 +188,7 @@ class SupabaseClient:
             }
             
             # INSERTでデータを追加（recorded_at, created_atは自動）
-            self.client.table('system_stats').insert(stats).execute()
+            await self.execute(self.client.table('system_stats').insert(stats))
             
             logger.info(f"📊 System stats sent: CPU={cpu_usage:.1f}%, RAM={ram_usage:.1f}%, Status=online")
             
@@ -182,7 +230,7 @@ class SupabaseClient:
                 'mb_total': float(mb_total)
             }
             
-            self.client.table('network_stats').insert(stats).execute()
+            await self.execute(self.client.table('network_stats').insert(stats))
             
             # 現在の値を保存
             self._last_net_io = net_io
@@ -197,48 +245,18 @@ class SupabaseClient:
                 logger.error(f"❌ Failed to send network stats: {e}")
     
     async def start_realtime_listener(self):
-        """Realtimeチャンネルでコマンドキューを監視"""
+        """コマンドキューの監視を開始（LISTEN/NOTIFY、使えない場合は適応ポーリング）"""
         if not self.client:
             return
         
         try:
-            logger.info("🔄 Starting Realtime listener for command_queue...")
-            
-            # Supabase Realtimeの購読
-            # Note: Python SDKのRealtime機能は限定的なため、ポーリングで実装
-            asyncio.create_task(self._poll_command_queue())
-            
-            logger.info("✅ Realtime listener started (polling mode)")
-            
+            logger.info("🔄 Starting command queue consumer...")
+            await self.command_consumer.start()
         except Exception as e:
-            logger.error(f"❌ Failed to start Realtime listener: {e}")
-    
-    async def _poll_command_queue(self):
-        """コマンドキューをポーリング"""
-        logger.info("🔄 Command queue polling started")
-        
-        while self.is_running:
-            try:
-                # pending状態のコマンドを取得
-                result = self.client.table('command_queue')\
-                    .select('*')\
-                    .eq('status', 'pending')\
-                    .order('created_at', desc=False)\
-                    .limit(10)\
-                    .execute()
-                
-                if result.data:
-                    for command in result.data:
-                        await self._process_command(command)
-                
-                await asyncio.sleep(1)  # 1秒ごとにポーリング
-                
-            except Exception as e:
-                logger.error(f"❌ Command queue polling error: {e}")
-                await asyncio.sleep(5)
+            logger.error(f"❌ Failed to start command queue consumer: {e}")
     
-    async def _process_command(self, command: Dict[str, Any]):
-        """コマンドを処理"""
+    async def _process_command(self, command: Dict[str, Any]) -> bool:
+        """取得済み（processing）のコマンドを処理し、成功したかを返す"""
         command_id = command['id']
         command_name = command['command']  # ✅ 正しいカラム名
         payload = command.get('payload', {})
@@ -246,11 +264,6 @@ class SupabaseClient:
         logger.info(f"📥 Processing command: {command_name} (ID: {command_id})")
         
         try:
-            # コマンドを処理中に更新
-            self.client.table('command_queue').update({
-                'status': 'processing'
-            }).eq('id', command_id).execute()
-            
             result = None
             error = None
             
@@ -271,19 +284,24 @@ class SupabaseClient:
                 error = f"Unknown command: {command_name}"
             
             # 完了状態に更新
-            self.client.table('command_queue').update({
+            await self.execute(self.client.table('command_queue').update({
                 'status': 'completed' if not error else 'failed'
-            }).eq('id', command_id).execute()
+            }).eq('id', command_id))
             
             logger.info(f"✅ Command completed: {command_name}")
+            return not error
             
         except Exception as e:
             logger.error(f"❌ Command processing failed: {e}")
             
             # 失敗状態に更新
-            self.client.table('command_queue').update({
-                'status': 'failed'
-            }).eq('id', command_id).execute()
+            try:
+                await self.execute(self.client.table('command_queue').update({
+                    'status': 'failed'
+                }).eq('id', command_id))
+            except Exception as update_error:
+                logger.error(f"❌ Failed to mark command as failed: {update_error}")
+            return False
     
     async def _handle_music_pause(self, payload: Dict) -> str:
         """一時停止コマンド"""
@@ -297,6 +315,7 @@ class SupabaseClient:
             raise ValueError("Not playing music")
         
         await guild.voice_client.pause()
+        self.bot.dispatch('playback_state_change', guild.id)
         return "Paused"
     
     async def _handle_music_resume(self, payload: Dict) -> str:
@@ -311,6 +330,7 @@ class SupabaseClient:
             raise ValueError("Not playing music")
         
         await guild.voice_client.resume()
+        self.bot.dispatch('playback_state_change', guild.id)
         return "Resumed"
     
     async def _handle_music_skip(self, payload: Dict) -> str:
@@ -374,6 +394,7 @@ class SupabaseClient:
             raise ValueError("Not playing music")
         
         await guild.voice_client.seek(position)
+        self.bot.dispatch('playback_state_change', guild.id)
         return f"Seeked to {position}ms"
     
     async def update_active_session(self, guild_id: int, track_data: Optional[Dict] = None):
@@ -393,11 +414,11 @@ class SupabaseClient:
                     'voice_members_count': int(track_data.get('members_count', 0))  # ✅ 追加
                 }
                 
-                self.client.table('active_sessions').upsert(session_data).execute()
-                logger.debug(f"📊 Active session updated for guild {guild_id}")
+                # 最新状態だけを保持し、次のフラッシュでまとめてupsert
+                self.session_coalescer.submit(session_data)
             else:
-                # セッション終了
-                self.client.table('active_sessions').delete().eq('guild_id', str(guild_id)).execute()
+                # セッション終了（即座に削除）
+                await self.session_coalescer.clear(str(guild_id))
                 logger.debug(f"📊 Active session cleared for guild {guild_id}")
                 
         except Exception as e:
@@ -422,7 +443,7 @@ class SupabaseClient:
                 "model": str(model)
             }
             
-            self.client.table("gemini_usage").insert(data).execute()
+            await self.execute(self.client.table("gemini_usage").insert(data))
             logger.debug(f"📊 Gemini usage logged: {total_tokens} tokens")
             
         except Exception as e:
@@ -445,7 +466,7 @@ class SupabaseClient:
                 "requested_by_id": str(requested_by_id)  # ✅ 追加
             }
             
-            self.client.table("music_history").insert(data).execute()
+            await self.execute(self.client.table("music_history").insert(data))
             logger.debug(f"🎵 Music history logged: {track_title}")
             
         except Exception as e:
@@ -465,7 +486,7 @@ class SupabaseClient:
                 "message": str(message)
             }
             
-            self.client.table("bot_logs").insert(data).execute()
+            await self.execute(self.client.table("bot_logs").insert(data))
             
         except Exception as e:
             logger.error(f"❌ Failed to log bot event: {e}")
@@ -484,13 +505,29 @@ class SupabaseClient:
                 # ✅ recorded_at は削除（Supabaseで自動設定）
             }
             
-            self.client.table('conversation_logs').insert(data).execute()
+            await self.execute(self.client.table('conversation_logs').insert(data))
             logger.info(f"💬 Conversation log saved for {user_name}")
         except Exception as e:
             logger.error(f"❌ Failed to save conversation log: {e}")
             import traceback
             traceback.print_exc()
     
+    async def save_conversation_logs(self, rows: List[Dict]):
+        """会話ログをまとめてSupabaseに保存"""
+        if not self.client or not rows:
+            return
+        
+        await self.execute(self.client.table('conversation_logs').insert(rows))
+        logger.info(f"💬 {len(rows)} conversation logs saved")
+    
+    async def log_gemini_usage_batch(self, rows: List[Dict]):
+        """Gemini API使用ログをまとめてSupabaseに記録"""
+        if not self.client or not rows:
+            return
+        
+        await self.execute(self.client.table("gemini_usage").insert(rows))
+        logger.debug(f"📊 Gemini usage logged: {len(rows)} rows")
+    
     async def save_music_log(self, guild_id: int, song_title: str, requested_by: str, requested_by_id: int):
         """音楽ログをSupabaseに保存（music_logs）"""
         if not self.client:
@@ -505,7 +542,7 @@ class SupabaseClient:
                 # ✅ recorded_at は削除（Supabaseで自動設定）
             }
             
-            self.client.table('music_logs').insert(data).execute()
+            await self.execute(self.client.table('music_logs').insert(data))
             logger.info(f"🎵 Music log saved: {song_title} by {requested_by}")
         except Exception as e:
             logger.error(f"❌ Failed to save music log: {e}")
@@ -521,6 +558,21 @@ class SupabaseClient:
         if self.health_monitor_loop.is_running():
             self.health_monitor_loop.cancel()
         
+        await self.retention.close()
+        
+        # コマンドキューの監視を停止
+        try:
+            await self.command_consumer.close()
+        except Exception as e:
+            logger.error(f"Failed to stop command queue consumer: {e}")
+        
+        # 保留中のセッション状態を書き込む
+        if self.client:
+            try:
+                await self.session_coalescer.close()
+            except Exception as e:
+                logger.error(f"Failed to flush active sessions: {e}")
+        
         # オフライン状態をログに記録
         if self.client:
             try:
@@ -528,4 +580,7 @@ class SupabaseClient:
             except Exception as e:
                 logger.error(f"Failed to record offline status: {e}")
         
+        # 実行中のリクエストを待ってからスレッドプールを閉じる
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        
         logger.info("✅ Supabase client shutdown complete")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+SingleFlight のテストスクリプト
+"""
+import asyncio
+
+from utils.single_flight import SingleFlight
+
+
+async def _leader_cancelled():
+    """先行の呼び出し元がキャンセルされても、待機中の呼び出し元に結果が届く"""
+    flight = SingleFlight()
+    started = asyncio.Event()
+    release = asyncio.Event()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        started.set()
+        await release.wait()
+        return 'result'
+
+    leader = asyncio.create_task(flight.do('key', work))
+    await started.wait()
+    follower = asyncio.create_task(flight.do('key', work))
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    await asyncio.sleep(0)
+    assert leader.cancelled()
+    assert 'key' in flight
+
+    release.set()
+    assert await follower == 'result'
+    assert calls == 1
+    assert len(flight) == 0
+
+
+async def _error_shared():
+    """例外は待機者全員に届き、終了後はキーが消える"""
+    flight = SingleFlight()
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+        raise ValueError('boom')
+
+    tasks = [asyncio.create_task(flight.do('key', work)) for _ in range(3)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len(flight) == 0
+
+
+def test_leader_cancelled():
+    asyncio.run(_leader_cancelled())
+
+
+def test_error_shared():
+    asyncio.run(_error_shared())
+
+
+if __name__ == "__main__":
+    test_leader_cancelled()
+    test_error_shared()
+    print("✅ SingleFlight tests passed")
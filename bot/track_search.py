@@ -0,0 +1,150 @@
+"""wavelink.Playable.search の前段に置く検索結果キャッシュ"""
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import wavelink
+
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# ytsearch: / ytsearch15: / scsearch: などの検索プレフィックス
+SEARCH_PREFIX_RE = re.compile(r'^(ytsearch|ytmsearch|scsearch|spsearch|amsearch|dzsearch)(\d*):', re.IGNORECASE)
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+class TrackSearchCache:
+    """Lavalinkの検索結果をキャッシュする
+
+    - キー: ソース（プレフィックス）と正規化したクエリ
+    - 値: トラックの生データ（encoded + info）。ヒットのたびに新しい Playable を作るので、
+      呼び出し側が extras や requester を設定しても他のリクエストに影響しない
+    - YouTube検索は件数違い（ytsearch: / ytsearch15:）を1つのキーにまとめ、1回の検索で最大件数を取る
+    - 同じ検索が同時に来た場合は1回だけLavalinkに問い合わせる
+    - プレイリスト（URL読み込み）はキャッシュしない
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = None, search_limit: int = 15):
+        self.max_entries = max_entries
+        self.ttl = ttl or float(os.getenv('TRACK_SEARCH_TTL', 1800))
+        self.search_limit = search_limit
+
+        self.cache: "OrderedDict[Tuple[str, str], Tuple[List[Dict], float]]" = OrderedDict()
+        self.inflight = SingleFlight()
+
+        # 統計
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'lavalink_calls': 0,
+            'uncacheable': 0
+        }
+
+    def parse(self, query: str, source: str = None) -> Tuple[Tuple[str, str], str]:
+        """(キャッシュキー, Lavalinkに送るクエリ) を返す"""
+        query = query.strip()
+        if source:
+            match = SEARCH_PREFIX_RE.match(f"{source.rstrip(':')}:")
+            family = match.group(1).lower() if match else source.lower().rstrip(':')
+            text = query
+        else:
+            match = SEARCH_PREFIX_RE.match(query)
+            if match:
+                family, text = match.group(1).lower(), query[match.end():].strip()
+            elif query.startswith(('http://', 'https://')):
+                return ('url', query), query
+            else:
+                family, text = 'default', query
+
+        text = WHITESPACE_RE.sub(' ', text).strip()
+        normalized = unicodedata.normalize('NFKC', text).casefold()
+        if family == 'default':
+            lavalink_query = text
+        elif family == 'ytsearch':
+            lavalink_query = f"ytsearch{self.search_limit}:{text}"
+        else:
+            lavalink_query = f"{family}:{text}"
+        return (family, normalized), lavalink_query
+
+    async def search(self, query: str, source: str = None, limit: int = None) -> wavelink.Search:
+        """wavelink.Playable.search と同じ戻り値（トラックのリストまたは Playlist）"""
+        key, lavalink_query = self.parse(query, source)
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            raws, expires_at = cached
+            if expires_at > time.monotonic():
+                self.cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._rebuild(raws, limit)
+            del self.cache[key]
+
+        if key in self.inflight:
+            self.stats['coalesced'] += 1
+            _, raws = await self.inflight.do(key, lambda: self._fetch(key, lavalink_query))
+            if raws is not None:
+                return self._rebuild(raws, limit)
+            # 先行リクエストがプレイリスト等だった場合は自分で検索する
+            return await self._search_lavalink(lavalink_query, limit)
+
+        self.stats['misses'] += 1
+        # 先行リクエストがキャンセルされても、待機中の他のリクエストには結果が届く
+        result, _ = await self.inflight.do(key, lambda: self._fetch(key, lavalink_query))
+
+        if isinstance(result, list) and limit:
+            return result[:limit]
+        return result
+
+    def get_stats(self) -> Dict:
+        lookups = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+        served = self.stats['hits'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'hit_rate': (served / lookups) * 100 if lookups else 0.0,
+            'entries': len(self.cache)
+        }
+
+    async def _fetch(self, key: Tuple[str, str], lavalink_query: str) -> Tuple[wavelink.Search, Optional[List[Dict]]]:
+        """(Lavalinkの結果, 待機者に渡す生データ) を返す"""
+        result = await self._search_lavalink(lavalink_query)
+        raws = self._to_raw(result)
+        if raws:
+            self._remember(key, raws)
+        # 空の結果は待機者にもそのまま返し、プレイリスト等（None）は各自で検索させる
+        return result, (raws if raws is not None or not isinstance(result, list) else [])
+
+    async def _search_lavalink(self, query: str, limit: int = None) -> wavelink.Search:
+        self.stats['lavalink_calls'] += 1
+        result = await wavelink.Playable.search(query)
+        if isinstance(result, list) and limit:
+            return result[:limit]
+        return result
+
+    def _to_raw(self, result) -> Optional[List[Dict]]:
+        """キャッシュ可能な結果（トラックのリスト）なら生データを返す"""
+        if not isinstance(result, list) or not result:
+            self.stats['uncacheable'] += 1
+            return None
+        raws = [getattr(track, 'raw_data', None) for track in result]
+        if not all(raws):
+            self.stats['uncacheable'] += 1
+            return None
+        return raws
+
+    @staticmethod
+    def _rebuild(raws: List[Dict], limit: int = None) -> List[wavelink.Playable]:
+        if limit:
+            raws = raws[:limit]
+        return [wavelink.Playable(data) for data in raws]
+
+    def _remember(self, key: Tuple[str, str], raws: List[Dict]):
+        self.cache[key] = (raws, time.monotonic() + self.ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
@@ -4,6 +4,7 @@ from typing import Optional, Dict, List
 from datetime import datetime, timedelta
 import json
 import asyncio
+import random
 
 logger = logging.getLogger(__name__)
 
@@ -44,6 +45,10 @@ class CostOptimizer:
             ]
         }
         
+        # All patterns compiled into one regex; the group index keeps dict order priority
+        self._patterns = list(self.simple_responses.keys())
+        self._simple_regex = re.compile('|'.join(f'(?P<p{i}>{pattern})' for i, pattern in enumerate(self._patterns)))
+        
         self.api_usage = {
             'daily_requests': 0,
             'daily_tokens': 0,
@@ -63,12 +68,11 @@ class CostOptimizer:
         if len(message) > 100:
             return None
         
-        for pattern, responses in self.simple_responses.items():
-            if re.search(pattern, message_lower):
-                import random
-                return random.choice(responses)
+        matched = [int(m.lastgroup[1:]) for m in self._simple_regex.finditer(message_lower)]
+        if not matched:
+            return None
         
-        return None
+        return random.choice(self.simple_responses[self._patterns[min(matched)]])
     
     def should_use_ai(self, message: str, user_id: int) -> bool:
         """Determine if AI should be used for this message"""
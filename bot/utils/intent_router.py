@@ -0,0 +1,181 @@
+import re
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 音楽コントロールのトリガー（これを含むメッセージだけがコントロール扱いになる）
+CONTROL_TRIGGER_KEYWORDS = [
+    'スキップ', 'skip', '次の曲',
+    '停止', 'stop', 'ストップ', '止めて', 'とめて',
+    '切断', 'disconnect', '退出', 'leave',
+    '一時停止', 'pause', 'ポーズ',
+    '再開', 'resume',
+    'キュー', 'queue',
+    '今の曲', '何の曲', 'なんの曲', 'nowplaying', 'np',
+    'ループ', 'loop', 'リピート', 'repeat',
+    '音量', 'volume', 'vol'
+]
+
+# コントロールの種類（判定の優先順）
+CONTROL_ACTION_KEYWORDS = [
+    ('skip', ['スキップ', 'skip', '次', '次の曲', 'つぎ']),
+    ('stop', ['停止', 'stop', 'ストップ', '止めて', 'とめて']),
+    ('disconnect', ['切断', 'disconnect', '退出', '出て', 'leave', 'でて']),
+    ('pause', ['一時停止', 'pause', 'ポーズ']),
+    ('resume', ['再開', 'resume', '続き', 'つづき']),
+    ('queue', ['キュー', 'queue', '待ち', '次の曲は']),
+    ('nowplaying', ['今の曲', '何の曲', 'なんの曲', 'nowplaying', 'np']),
+    ('loop', ['ループ', 'loop', 'リピート', 'repeat']),
+    ('volume', ['音量', 'volume', 'vol']),
+]
+
+# 再生リクエスト（「〇〇を流して」など）
+PLAY_KEYWORDS = [
+    '流して', 'ながして', 'かけて', '再生して', 'プレイして',
+    '聞かせて', 'きかせて', '聴かせて',
+    'play ', 'play　'
+]
+
+LOOP_OFF_KEYWORDS = ['オフ', 'off']
+LOOP_TRACK_KEYWORDS = ['曲', 'track', '1曲']
+
+NUMBER_RE = re.compile(r'(\d+)')
+
+
+class KeywordAutomaton:
+    """Aho–Corasick オートマトン：全キーワードを1回の走査で検出する（重なりも含む）"""
+
+    def __init__(self, keywords: Iterable[Tuple[str, str]]):
+        # keywords: (キーワード, タグ) の列
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[Set[str]] = [set()]
+
+        for keyword, tag in keywords:
+            state = 0
+            for ch in keyword:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][ch] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(set())
+                state = next_state
+            self.output[state].add(tag)
+
+        # 失敗リンクをBFSで構築し、出力をマージ
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+
+        # 出力を frozenset にして走査中の集合演算を軽くする
+        self.output = [frozenset(tags) for tags in self.output]
+
+    def find_tags(self, text: str) -> Set[str]:
+        """テキスト中に現れたキーワードのタグ集合を返す"""
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+        found: Set[str] = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found |= output[state]
+        return found
+
+
+class Intent:
+    """メッセージの分類結果"""
+
+    __slots__ = ('kind', 'is_control', 'control_actions', 'is_play', 'simple_response', 'loop_mode', 'volume')
+
+    def __init__(self, kind: str, is_control: bool = False, control_actions: Tuple[str, ...] = (),
+                 is_play: bool = False, simple_response: Optional[str] = None,
+                 loop_mode: str = 'queue', volume: Optional[int] = None):
+        self.kind = kind  # 'control' | 'play' | 'simple' | 'ai'
+        self.is_control = is_control
+        self.control_actions = control_actions
+        self.is_play = is_play
+        self.simple_response = simple_response
+        self.loop_mode = loop_mode
+        self.volume = volume
+
+    def __repr__(self):
+        return f"Intent(kind={self.kind!r}, actions={self.control_actions!r}, play={self.is_play})"
+
+
+class IntentRouter:
+    """チャットメッセージを control / play / simple / ai に1パスで分類する
+
+    すべてのキーワードは起動時に1つのオートマトンにまとめてコンパイルされる。
+    """
+
+    def __init__(self, simple_responses: Optional[Dict[str, str]] = None, simple_max_length: int = 20):
+        self.simple_responses = simple_responses or {}
+        self.simple_max_length = simple_max_length
+        self._simple_order = {key: i for i, key in enumerate(self.simple_responses)}
+        self._action_order = [action for action, _ in CONTROL_ACTION_KEYWORDS]
+
+        keywords: List[Tuple[str, str]] = []
+        keywords += [(k, 'control') for k in CONTROL_TRIGGER_KEYWORDS]
+        for action, words in CONTROL_ACTION_KEYWORDS:
+            keywords += [(k, f'action:{action}') for k in words]
+        keywords += [(k, 'play') for k in PLAY_KEYWORDS]
+        keywords += [(k, 'loop:off') for k in LOOP_OFF_KEYWORDS]
+        keywords += [(k, 'loop:track') for k in LOOP_TRACK_KEYWORDS]
+        keywords += [(k.lower(), f'simple:{k}') for k in self.simple_responses]
+
+        self.automaton = KeywordAutomaton(keywords)
+        logger.info(f"✅ Intent router compiled ({len(keywords)} keywords, {len(self.automaton.goto)} states)")
+
+    def classify(self, text: str) -> Intent:
+        """メッセージを分類し、引数（ループモード・音量など）を取り出す"""
+        lowered = text.lower()
+        tags = self.automaton.find_tags(lowered)
+
+        is_control = 'control' in tags
+        is_play = 'play' in tags
+        actions = tuple(a for a in self._action_order if f'action:{a}' in tags)
+
+        loop_mode = 'queue'
+        if 'loop:off' in tags:
+            loop_mode = 'off'
+        elif 'loop:track' in tags:
+            loop_mode = 'track'
+
+        volume = None
+        if 'action:volume' in tags:
+            match = NUMBER_RE.search(lowered)
+            if match:
+                volume = min(100, max(0, int(match.group(1))))
+
+        simple_response = None
+        if len(text) < self.simple_max_length:
+            matched = [tag[7:] for tag in tags if tag.startswith('simple:')]
+            if matched:
+                key = min(matched, key=self._simple_order.__getitem__)
+                simple_response = self.simple_responses[key]
+
+        if is_control:
+            kind = 'control'
+        elif is_play:
+            kind = 'play'
+        elif simple_response:
+            kind = 'simple'
+        else:
+            kind = 'ai'
+
+        return Intent(kind, is_control, actions, is_play, simple_response, loop_mode, volume)
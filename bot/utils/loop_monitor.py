@@ -0,0 +1,54 @@
+import asyncio
+import time
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EventLoopLagMonitor:
+    """イベントループの遅延（ブロッキング時間）を計測する
+
+    interval 秒ごとにスリープし、予定より何ms遅れて起きたかを記録する。
+    同期I/Oがループをブロックするとこの値が跳ね上がる。
+    """
+
+    def __init__(self, interval: float = 0.5, window: int = 240, warn_ms: float = 250):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.warn_ms = warn_ms
+        self.max_ms = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+            logger.info(f"✅ Event loop lag monitor started ({self.interval}s interval)")
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            lag_ms = max(0.0, (time.perf_counter() - expected) * 1000)
+            self.samples.append(lag_ms)
+            self.max_ms = max(self.max_ms, lag_ms)
+            if lag_ms >= self.warn_ms:
+                logger.warning(f"⚠️ Event loop blocked for {lag_ms:.0f}ms")
+
+    def get_stats(self) -> Dict:
+        if not self.samples:
+            return {'current_ms': 0.0, 'avg_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0, 'samples': 0}
+        ordered = sorted(self.samples)
+        return {
+            'current_ms': round(self.samples[-1], 2),
+            'avg_ms': round(sum(ordered) / len(ordered), 2),
+            'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))], 2),
+            'max_ms': round(self.max_ms, 2),
+            'samples': len(ordered)
+        }
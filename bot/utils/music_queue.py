@@ -0,0 +1,208 @@
+import os
+import random
+from collections import deque
+from typing import Any, Dict, Iterator, List, Optional
+
+# 先頭からこの件数までは Playable をそのまま保持し、それより後ろは生データだけにする
+HOT_WINDOW = 32
+# 再生履歴の上限（キューループは履歴ではなくキュー末尾への再追加で実現する）
+HISTORY_LIMIT = int(os.getenv('MUSIC_HISTORY_LIMIT', 500))
+
+
+def playable_from_raw(raw: Dict[str, Any]):
+    """Lavalinkのトラックデータから wavelink.Playable を作る"""
+    import wavelink
+    return wavelink.Playable(raw)
+
+
+class QueueEntry:
+    """キュー内の1曲
+
+    遠い位置の曲は wavelink.Playable を持たず、Lavalinkのトラックデータ（encoded + info）と
+    リクエスト情報（extras）だけを保持する。再生直前に Playable を組み立て直す。
+    """
+
+    __slots__ = ('raw', 'extras', 'track')
+
+    def __init__(self, track):
+        self.raw: Optional[Dict[str, Any]] = getattr(track, 'raw_data', None)
+        self.extras = getattr(track, 'extras', None)
+        self.track = track
+
+    def compact(self):
+        """Playable を手放す（生データがある場合のみ）"""
+        if self.raw is not None:
+            self.track = None
+
+    def materialize(self, factory=playable_from_raw):
+        """再生用の Playable を返す"""
+        if self.track is None:
+            track = factory(self.raw)
+            if self.extras:
+                try:
+                    track.extras = self.extras
+                except Exception:
+                    pass
+            self.track = track
+        return self.track
+
+    def _info(self, key: str, default=None):
+        return (self.raw.get('info') or {}).get(key, default)
+
+    # 表示用（Playable と同じ属性名）
+    @property
+    def title(self) -> str:
+        return self.track.title if self.track is not None else self._info('title', 'Unknown')
+
+    @property
+    def author(self) -> str:
+        return getattr(self.track, 'author', 'Unknown') if self.track is not None else self._info('author', 'Unknown')
+
+    @property
+    def length(self) -> int:
+        return self.track.length if self.track is not None else self._info('length', 0)
+
+    @property
+    def uri(self) -> Optional[str]:
+        return getattr(self.track, 'uri', None) if self.track is not None else self._info('uri')
+
+    @property
+    def artwork(self) -> Optional[str]:
+        return getattr(self.track, 'artwork', None) if self.track is not None else self._info('artworkUrl')
+
+
+class UpcomingView:
+    """待機中の曲への読み取り専用ビュー（len / bool / 反復 / インデックス・スライス）"""
+
+    __slots__ = ('_queue',)
+
+    def __init__(self, queue: 'MusicQueue'):
+        self._queue = queue
+
+    def __len__(self) -> int:
+        return self._queue.size
+
+    def __bool__(self) -> bool:
+        return self._queue.size > 0
+
+    def __iter__(self) -> Iterator[QueueEntry]:
+        q = self._queue
+        for i in range(q._head, len(q._items)):
+            yield q._items[i]
+
+    def __getitem__(self, index):
+        q = self._queue
+        if isinstance(index, slice):
+            start, stop, step = index.indices(q.size)
+            if step > 0:
+                return q._items[q._head + start:q._head + stop:step]
+            return [q._items[q._head + i] for i in range(start, stop, step)]
+        if index < 0:
+            index += q.size
+        if not 0 <= index < q.size:
+            raise IndexError('queue index out of range')
+        return q._items[q._head + index]
+
+
+class MusicQueue:
+    """ギルドごとの再生キュー
+
+    リスト + 先頭インデックスのリングバッファで、先頭からの取り出し・任意位置の参照は O(1)。
+    取り出し済みの領域はまとめて詰める（償却 O(1)）。
+    """
+
+    def __init__(self, track_factory=None):
+        self.track_factory = track_factory or playable_from_raw
+        self._items: List[Optional[QueueEntry]] = []
+        self._head = 0
+        self.history: deque = deque(maxlen=HISTORY_LIMIT)
+        self.current = None
+        self.loop_mode = "off"  # off, track, queue
+        self.shuffle = False
+
+    @property
+    def queue(self) -> UpcomingView:
+        """待機中の曲（旧来の queue.queue と同じ使い方ができる）"""
+        return UpcomingView(self)
+
+    @property
+    def size(self) -> int:
+        return len(self._items) - self._head
+
+    def add(self, track):
+        entry = QueueEntry(track)
+        if self.size >= HOT_WINDOW:
+            entry.compact()
+        self._items.append(entry)
+
+    def add_many(self, tracks):
+        for track in tracks:
+            self.add(track)
+
+    def get_next(self):
+        if self.loop_mode == "track" and self.current:
+            return self.current
+
+        if self.loop_mode == "queue":
+            # 再生済みの曲は末尾に戻す（ループ開始前の履歴も一緒に回す）
+            if self.history:
+                self.add_many(self.history)
+                self.history.clear()
+            if self.current:
+                self.add(self.current)
+
+        if not self.size:
+            return None
+
+        if self.shuffle and self.size > 1:
+            self._swap(0, random.randrange(self.size))
+
+        entry = self._popleft()
+        if self.current and self.loop_mode != "queue":
+            self.history.append(self.current)
+        self.current = entry.materialize(self.track_factory)
+        return self.current
+
+    def peek(self, index: int = 0) -> Optional[QueueEntry]:
+        if 0 <= index < self.size:
+            return self._items[self._head + index]
+        return None
+
+    def remove(self, index: int) -> QueueEntry:
+        """指定位置の曲を取り除く"""
+        if not 0 <= index < self.size:
+            raise IndexError('queue index out of range')
+        return self._items.pop(self._head + index)
+
+    def move(self, src: int, dst: int):
+        """曲を src から dst の位置へ移動"""
+        entry = self.remove(src)
+        dst = max(0, min(dst, self.size))
+        self._items.insert(self._head + dst, entry)
+
+    def shuffle_all(self):
+        """待機中の曲を並べ替える"""
+        upcoming = self._items[self._head:]
+        random.shuffle(upcoming)
+        self._items = upcoming
+        self._head = 0
+
+    def clear(self):
+        self._items = []
+        self._head = 0
+        self.history.clear()
+        self.current = None
+
+    def _swap(self, i: int, j: int):
+        items, head = self._items, self._head
+        items[head + i], items[head + j] = items[head + j], items[head + i]
+
+    def _popleft(self) -> QueueEntry:
+        entry = self._items[self._head]
+        self._items[self._head] = None
+        self._head += 1
+        # 取り出し済みの領域が半分を超えたら詰める
+        if self._head > 64 and self._head * 2 > len(self._items):
+            del self._items[:self._head]
+            self._head = 0
+        return entry
@@ -0,0 +1,45 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Hashable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def _consume_exception(task: asyncio.Task):
+    """待機者が全員キャンセルされても「例外が取得されなかった」警告を出さない"""
+    if not task.cancelled():
+        task.exception()
+
+
+class SingleFlight:
+    """同じキーの処理が同時に来た場合は1回だけ実行し、結果を待機者全員で共有する
+
+    処理は呼び出し元から切り離したタスクで実行するため、最初の呼び出し元がキャンセルされても
+    同じキーを待っている他の呼び出し元には結果（または例外）が届く。
+    """
+
+    def __init__(self):
+        self.inflight: Dict[Hashable, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self.inflight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.inflight
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        """実行中の処理があればその結果を待ち、なければ factory() を新しく実行する"""
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._run(key, factory))
+            task.add_done_callback(_consume_exception)
+            self.inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _run(self, key: Hashable, factory: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return await factory()
+        finally:
+            self.inflight.pop(key, None)
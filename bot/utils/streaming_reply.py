@@ -0,0 +1,68 @@
+import re
+import time
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# 最初の投稿を行う区切り（文末・改行）
+SENTENCE_BOUNDARY = re.compile(r'[。！？!?\n]|[.](\s|$)')
+
+
+class StreamingReply:
+    """ストリーミング中のAI応答をDiscordメッセージに段階的に反映する
+
+    最初の文が揃った時点で send() で投稿し、以降は edit_interval 秒以上の間隔で
+    edit() により本文を更新する（Discordの編集レート制限を超えないため）。
+    """
+
+    def __init__(self, send: Callable[[str], Awaitable[Any]],
+                 edit: Optional[Callable[[Any, str], Awaitable[Any]]] = None,
+                 edit_interval: float = 1.2, max_length: int = 2000, cursor: str = ' ▌'):
+        self.send = send
+        self.edit = edit or (lambda message, text: message.edit(content=text))
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.cursor = cursor
+
+        self.message = None
+        self.text = ''
+        self._shown = ''
+        self._last_edit = 0.0
+
+    def _clip(self, text: str) -> str:
+        if len(text) <= self.max_length:
+            return text
+        return text[:self.max_length - 1] + '…'
+
+    async def on_chunk(self, text: str):
+        """生成途中のテキストを受け取る（GeminiClientのon_chunkに渡す）"""
+        self.text = text
+
+        if self.message is None:
+            if not SENTENCE_BOUNDARY.search(text):
+                return
+            self.message = await self.send(self._clip(text + self.cursor))
+            self._shown = text
+            self._last_edit = time.monotonic()
+            return
+
+        if time.monotonic() - self._last_edit >= self.edit_interval:
+            await self._update(text + self.cursor)
+            self._shown = text
+
+    async def finish(self, text: str):
+        """最終テキストを反映して投稿済みメッセージを返す（未投稿ならここで投稿）"""
+        if self.message is None:
+            self.message = await self.send(self._clip(text))
+        else:
+            await self._update(text)
+        self._shown = text
+        return self.message
+
+    async def _update(self, text: str):
+        try:
+            await self.edit(self.message, self._clip(text))
+        except Exception as e:
+            logger.error(f"Error editing streamed reply: {e}")
+        self._last_edit = time.monotonic()
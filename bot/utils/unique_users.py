@@ -0,0 +1,86 @@
+import hashlib
+import math
+import logging
+from typing import Dict, Hashable, Iterable, Union
+
+logger = logging.getLogger(__name__)
+
+
+class HyperLogLog:
+    """固定メモリでユニーク数を推定するスケッチ（p=12で約1.6%誤差、4KB）"""
+
+    __slots__ = ('p', 'm', 'registers', 'alpha')
+
+    def __init__(self, p: int = 12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+        self.alpha = 0.7213 / (1 + 1.079 / self.m)
+
+    def add(self, value) -> None:
+        h = int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self) -> int:
+        estimate = self.alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        if estimate <= 2.5 * self.m:
+            zeros = self.registers.count(0)
+            if zeros:
+                estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class UniqueUserTracker:
+    """ギルド × 期間（日・時間）ごとのユニークユーザーをメモリ上で数える
+
+    小さいバケットは正確なsetで保持し、hll_thresholdを超えたら
+    HyperLogLogに切り替えてメモリを一定に保つ。
+    """
+
+    def __init__(self, hll_threshold: int = 5000):
+        self.hll_threshold = hll_threshold
+        self.buckets: Dict[Hashable, Union[set, HyperLogLog]] = {}
+
+    def has_bucket(self, key: Hashable) -> bool:
+        return key in self.buckets
+
+    def seed(self, key: Hashable, user_ids: Iterable[int]) -> None:
+        """DBから読み込んだ既存ユーザーでバケットを初期化"""
+        bucket = self.buckets.setdefault(key, set())
+        for user_id in user_ids:
+            bucket.add(user_id)
+        self._maybe_promote(key)
+
+    def add(self, key: Hashable, user_id: int) -> None:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = set()
+        bucket.add(user_id)
+        if isinstance(bucket, set):
+            self._maybe_promote(key)
+
+    def count(self, key: Hashable) -> int:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return 0
+        return len(bucket) if isinstance(bucket, set) else bucket.count()
+
+    def prune(self, keep) -> int:
+        """keep(key) が False のバケットを削除"""
+        stale = [key for key in self.buckets if not keep(key)]
+        for key in stale:
+            del self.buckets[key]
+        return len(stale)
+
+    def _maybe_promote(self, key: Hashable) -> None:
+        bucket = self.buckets[key]
+        if isinstance(bucket, set) and len(bucket) > self.hll_threshold:
+            sketch = HyperLogLog()
+            for user_id in bucket:
+                sketch.add(user_id)
+            self.buckets[key] = sketch
+            logger.debug(f"Unique user bucket {key} promoted to HyperLogLog")